@@ -27,6 +27,10 @@ class ForceAPIAdmin(admin.ModelAdmin):
 
 class MapObjectInline(admin.TabularInline):
     model = MapObject
+    fields = (
+        'sf_api_name', 'sf_label', 'dj_class', 'db_table', 'extractor',
+        'record_count', 'last_refresh')
+    readonly_fields = ('record_count', 'last_refresh')
     extra = 0
 
 
@@ -34,12 +38,21 @@ class MapSchedInline(admin.TabularInline):
     model = MapSched
     extra = 0
 
+    def get_queryset(self, request):
+        qs = super(MapSchedInline, self).get_queryset(request)
+        return qs.select_related('data_map')
+
 
 def refresh_map(modeladmin, request, queryset):
     for obj in queryset:
         obj.load_sf_data()
 refresh_map.short_description = 'Realtime Refresh from SalesForce'
 
+def refresh_map_full(modeladmin, request, queryset):
+    for obj in queryset:
+        obj.load_sf_data(full=True)
+refresh_map_full.short_description = 'Realtime Full Reload from SalesForce'
+
 def refresh_map_bkgd(modeladmin, request, queryset):
     for obj in queryset:
         ts = obj.mapsched_set.create(
@@ -49,19 +62,98 @@ def refresh_map_bkgd(modeladmin, request, queryset):
         ts.save()
 refresh_map_bkgd.short_description = 'Refresh from SalesForce'
 
+PHASE_FIELDS = (
+    'dj_class', 'records', 'inserted', 'updated', 'skipped', 'pages',
+    'bytes', 'http_time', 'map_time', 'db_time', 'records_per_sec')
+
+
+class SyncPhaseInline(admin.TabularInline):
+    model = SyncPhase
+    fields = PHASE_FIELDS
+    readonly_fields = PHASE_FIELDS
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class SyncRunInline(admin.TabularInline):
+    model = SyncRun
+    fields = ('started', 'duration', 'status', 'requests', 'bytes')
+    readonly_fields = fields
+    show_change_link = True
+    extra = 0
+    can_delete = False
+    recent = datetime.timedelta(days=7)
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        qs = super(SyncRunInline, self).get_queryset(request)
+        return qs.filter(started__gte=dtz.now() - self.recent)
+
+
+class SyncRunAdmin(admin.ModelAdmin):
+    list_display = (
+        'data_map', 'started', 'duration', 'status', 'full',
+        'requests', 'handshakes', 'bytes')
+    list_filter = ('data_map', 'status')
+    list_select_related = ('data_map',)
+    readonly_fields = (
+        'data_map', 'started', 'finished', 'full', 'status', 'requests',
+        'handshakes', 'logins', 'bytes', 'error')
+    inlines = [SyncPhaseInline]
+
+
 class DataMapAdmin(admin.ModelAdmin):
     list_display = ('name', 'map_active', 'last_refresh', 'nxt_refresh')
-    inlines = [MapObjectInline, MapSchedInline]
-    actions = [refresh_map_bkgd, refresh_map]
+    inlines = [MapObjectInline, MapSchedInline, SyncRunInline]
+    actions = [refresh_map_bkgd, refresh_map, refresh_map_full]
+
+    def get_queryset(self, request):
+        qs = super(DataMapAdmin, self).get_queryset(request)
+        return qs.annotate(nxt=DataMap.next_refresh())
+
+    def nxt_refresh(self, obj):
+        return obj.nxt
+    nxt_refresh.admin_order_field = 'nxt'
+    nxt_refresh.short_description = 'next refresh'
 
 
-class MapFieldInline(admin.TabularInline):
+class CachedChoicesMixin(object):
+    """renders each FK select's options once per request, not per row"""
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        field = super(CachedChoicesMixin, self).formfield_for_foreignkey(
+            db_field, request, **kwargs)
+        if field is None or request is None:
+            return field
+        cache = request.__dict__.setdefault('_nps_fk_choices', {})
+        key = (self.model, db_field.name)
+        if not(key in cache):
+            cache[key] = list(field.choices)
+        field.choices = cache[key]
+        return field
+
+
+class MapFieldInline(CachedChoicesMixin, admin.TabularInline):
     model = MapField
     fk_name = 'map_object'
     extra = 0
 
+    def get_queryset(self, request):
+        qs = super(MapFieldInline, self).get_queryset(request)
+        return qs.select_related('map_object')
+
 
 class MapObjectAdmin(admin.ModelAdmin):
+    list_display = (
+        'dj_class', 'sf_api_name', 'data_map', 'extractor', 'record_count',
+        'last_refresh')
+    list_filter = ('data_map',)
+    list_select_related = ('data_map',)
     inlines = [MapFieldInline]
 
 
@@ -69,8 +161,15 @@ class MapFilterInline(admin.TabularInline):
     model = MapFilter
     extra = 0
 
+    def get_queryset(self, request):
+        qs = super(MapFilterInline, self).get_queryset(request)
+        return qs.select_related('map_field')
+
 
-class MapFieldAdmin(admin.ModelAdmin):
+class MapFieldAdmin(CachedChoicesMixin, admin.ModelAdmin):
+    list_display = ('__str__', 'sf_api_name', 'sf_relation')
+    list_filter = ('map_object__data_map',)
+    list_select_related = ('map_object', 'sf_relation')
     inlines = [MapFilterInline]
 
 
@@ -78,3 +177,4 @@ admin.site.register(ForceAPI, ForceAPIAdmin)
 admin.site.register(DataMap, DataMapAdmin)
 admin.site.register(MapObject, MapObjectAdmin)
 admin.site.register(MapField, MapFieldAdmin)
+admin.site.register(SyncRun, SyncRunAdmin)
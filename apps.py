@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class NpsConfig(AppConfig):
     name = 'nps'
+
+    def ready(self):
+        from . import signals
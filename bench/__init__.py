@@ -0,0 +1 @@
+"""Synthetic Salesforce org for benchmarking the load path"""
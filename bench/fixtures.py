@@ -0,0 +1,238 @@
+"""Deterministic fake Salesforce records with realistic FK fan-out
+
+Every record is computed from its sobject, its index and the seed, so
+pages can be produced on demand without holding the org in memory.
+"""
+import zlib
+import datetime
+from collections import namedtuple
+
+
+Spec = namedtuple('Spec', 'sobject dj_class prefix ratio fields relations')
+
+EPOCH = datetime.datetime(2016, 1, 1)
+STAMP_STEP = 60
+
+REGIONS = {
+    'USCAN': ('US', 'Canada'),
+    'EUROPE': ('Nordics', 'DACH', 'UKI', 'France'),
+    'ASIA': ('China', 'Japan', 'ASEAN'),
+    'LATAM': ('Brazil', 'Mexico'),
+}
+ORDER_TYPES = (
+    'Field Service', 'Installation', 'Planned Maintenance',
+    'Depot Repair', 'Field Service')
+COUNTRIES = (
+    'United States', 'Canada', 'Germany', 'France', 'United Kingdom',
+    'China', 'Japan', 'Brazil', 'Mexico', 'Sweden')
+LANGUAGES = ('en_US', 'en_US', 'de', 'fr', 'ja', 'zh_CN', 'pt_BR', 'es')
+
+# ratio is the number of rows per ServiceOrder, relations are
+# (sf field, parent sobject, share of rows left empty)
+SPECS = (
+    Spec('Account', 'Account', '001', 1.0 / 20,
+         ('Id', 'Name', 'SystemModstamp', 'Global_Region__c',
+          'Global_Subregion__c'),
+         ()),
+    Spec('Contact', 'Contact', '003', 1.0 / 4,
+         ('Id', 'Name', 'SystemModstamp', 'Phone', 'Language__c', 'Email'),
+         ()),
+    Spec('Case', 'Case', '500', 1.0 / 2,
+         ('Id', 'CaseNumber', 'SystemModstamp', 'CreatedDate'),
+         ()),
+    Spec('SVMXC__Installed_Product__c', 'InstalledProduct', 'a0N', 1.0 / 3,
+         ('Id', 'Name', 'SystemModstamp', 'Product_Description__c'),
+         ()),
+    Spec('User', 'SFUser', '005', 1.0 / 40,
+         ('Id', 'Name', 'SystemModstamp', 'SSO__c', 'ManagerId'),
+         (('ManagerId', 'User', 0.0),)),
+    Spec('SVMXC__Service_Group_Members__c', 'ServiceGroupMembers', 'a1U',
+         1.0 / 50,
+         ('Id', 'Name', 'SystemModstamp', 'SVMXC__Email__c',
+          'SVMXC__Salesforce_User__c'),
+         (('SVMXC__Salesforce_User__c', 'User', 0.05),)),
+    Spec('SVMXC__Service_Order__c', 'ServiceOrder', 'a2B', 1.0,
+         ('Id', 'Name', 'SystemModstamp', 'RecordTypeId',
+          'SVMXC__Order_Type__c', 'SVMXC__Country__c',
+          'SVMXC__Completed_Date_Time__c', 'SVMXC__Case__c',
+          'SVMXC__Company__c', 'SVMXC__Component__c', 'SVMXC__Contact__c',
+          'SVMXC__Group_Member__c'),
+         (('SVMXC__Case__c', 'Case', 0.3),
+          ('SVMXC__Company__c', 'Account', 0.0),
+          ('SVMXC__Component__c', 'SVMXC__Installed_Product__c', 0.1),
+          ('SVMXC__Contact__c', 'Contact', 0.05),
+          ('SVMXC__Group_Member__c', 'SVMXC__Service_Group_Members__c',
+           0.02))),
+)
+
+# model attribute of every fake field, as a DataMap would map it
+ATTRS = {
+    'Id': 'sfid',
+    'Name': 'name',
+    'CaseNumber': 'name',
+    'SystemModstamp': 'systemmodstamp',
+    'CreatedDate': 'createddate',
+    'Global_Region__c': 'global_region_c',
+    'Global_Subregion__c': 'global_subregion_c',
+    'Phone': 'phone',
+    'Language__c': 'language_c',
+    'Email': 'email',
+    'Product_Description__c': 'product_description_c',
+    'SSO__c': 'sso_c',
+    'ManagerId': 'manager',
+    'SVMXC__Email__c': 'svmxc_email_c',
+    'SVMXC__Salesforce_User__c': 'svmxc_salesforce_user_c',
+    'RecordTypeId': 'recordtypeid',
+    'SVMXC__Order_Type__c': 'svmxc_order_type_c',
+    'SVMXC__Country__c': 'svmxc_country_c',
+    'SVMXC__Completed_Date_Time__c': 'svmxc_completed_date_time_c',
+    'SVMXC__Case__c': 'svmxc_case_c',
+    'SVMXC__Company__c': 'svmxc_company_c',
+    'SVMXC__Component__c': 'svmxc_component_c',
+    'SVMXC__Contact__c': 'svmxc_contact_c',
+    'SVMXC__Group_Member__c': 'svmxc_group_member_c',
+}
+
+BY_SOBJECT = dict((spec.sobject, spec) for spec in SPECS)
+KEYS = dict((spec.sobject, zlib.crc32(spec.sobject.encode())) for spec in SPECS)
+MASK = (1 << 64) - 1
+
+
+def mix(*vals):
+    """stable 64 bit hash of some integers (splitmix64)"""
+    acc = 0
+    for val in vals:
+        acc = (acc + val + 0x9e3779b97f4a7c15) & MASK
+        acc = ((acc ^ (acc >> 30)) * 0xbf58476d1ce4e5b9) & MASK
+        acc = ((acc ^ (acc >> 27)) * 0x94d049bb133111eb) & MASK
+        acc = acc ^ (acc >> 31)
+    return acc
+
+
+def sf_stamp(dtm):
+    return dtm.strftime('%Y-%m-%dT%H:%M:%S.000+0000')
+
+
+class FixtureSet(object):
+    """A fake org sized by its number of ServiceOrders"""
+
+    def __init__(self, size, seed=0):
+        self.size = size
+        self.seed = seed
+        self.counts = dict(
+            (spec.sobject, max(int(size * spec.ratio), 1)) for spec in SPECS)
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def sfid(self, sobject, idx):
+        """18 character id, the dash keeps it apart from real ids"""
+        return '%s-%014d' % (BY_SOBJECT[sobject].prefix, idx)
+
+    def index(self, sfid):
+        """row index of a fake id, or None if it is not one"""
+        prefix, sep, num = sfid.partition('-')
+        if not(sep) or not(num.isdigit()):
+            return None
+        idx = int(num)
+        for spec in SPECS:
+            if spec.prefix == prefix and idx < self.counts[spec.sobject]:
+                return spec.sobject, idx
+        return None
+
+    def uniform(self, sobject, idx, salt):
+        """deterministic value in [0, 1) for one field of one row"""
+        return mix(self.seed, KEYS[sobject], idx, salt) / 2.0 ** 64
+
+    def pick(self, sobject, idx, salt, choices):
+        return choices[int(self.uniform(sobject, idx, salt) * len(choices))]
+
+    def stamp(self, idx):
+        """modstamps rise with the index so deltas are a suffix"""
+        return EPOCH + datetime.timedelta(seconds=idx * STAMP_STEP)
+
+    def stamp_index(self, dtm):
+        """first index whose modstamp is after dtm"""
+        if dtm.tzinfo is not None:
+            dtm = dtm.replace(tzinfo=None) - dtm.utcoffset()
+        secs = (dtm - EPOCH).total_seconds()
+        return max(int(secs // STAMP_STEP) + 1, 0)
+
+    def parent(self, sobject, idx, salt, parent, blank):
+        """skewed parent choice so a few parents have most children"""
+        if blank and self.uniform(sobject, idx, salt) < blank:
+            return None
+        if sobject == parent:
+            # users report up a tree, eight to a manager
+            return self.sfid(parent, idx // 8) if idx else None
+        unif = self.uniform(sobject, idx, salt + 100)
+        pidx = int(unif * unif * self.counts[parent])
+        return self.sfid(parent, pidx)
+
+    def values(self, sobject, idx):
+        """every field of one row"""
+        spec = BY_SOBJECT[sobject]
+        stamp = self.stamp(idx)
+        rtn = {
+            'Id': self.sfid(sobject, idx),
+            'Name': '%s %d' % (spec.dj_class, idx),
+            'SystemModstamp': sf_stamp(stamp),
+        }
+        for salt, (field, parent, blank) in enumerate(spec.relations):
+            rtn[field] = self.parent(sobject, idx, salt, parent, blank)
+        if sobject == 'Account':
+            region = self.pick(sobject, idx, 10, sorted(REGIONS))
+            rtn['Global_Region__c'] = region
+            rtn['Global_Subregion__c'] = self.pick(
+                sobject, idx, 11, REGIONS[region])
+        elif sobject == 'Contact':
+            rtn['Phone'] = '+1 555 %07d' % idx
+            rtn['Language__c'] = self.pick(sobject, idx, 10, LANGUAGES)
+            rtn['Email'] = 'contact%d@example.com' % idx
+        elif sobject == 'Case':
+            rtn['CaseNumber'] = '%08d' % idx
+            rtn['CreatedDate'] = rtn['SystemModstamp']
+        elif sobject == 'SVMXC__Installed_Product__c':
+            rtn['Product_Description__c'] = 'System %d' % (idx % 97)
+        elif sobject == 'User':
+            rtn['SSO__c'] = '%09d' % (200000000 + idx)
+        elif sobject == 'SVMXC__Service_Group_Members__c':
+            rtn['SVMXC__Email__c'] = 'tech%d@example.com' % idx
+        elif sobject == 'SVMXC__Service_Order__c':
+            rtn['Name'] = 'WO-%08d' % idx
+            rtn['RecordTypeId'] = '012000000000001AAA'
+            rtn['SVMXC__Order_Type__c'] = self.pick(
+                sobject, idx, 10, ORDER_TYPES)
+            rtn['SVMXC__Country__c'] = self.pick(sobject, idx, 11, COUNTRIES)
+            rtn['SVMXC__Completed_Date_Time__c'] = sf_stamp(
+                stamp - datetime.timedelta(hours=idx % 72))
+        return rtn
+
+    def record(self, sobject, idx, fields):
+        """one row as the REST API returns it, limited to fields"""
+        vals = self.values(sobject, idx)
+        rtn = {'attributes': {'type': sobject}}
+        for field in fields:
+            rtn[field] = vals.get(field)
+        return rtn
+
+
+def build_datamap(api_cred, name, extractor='REST'):
+    """creates a DataMap mapping every fake sobject onto its model"""
+    datamap = api_cred.datamap_set.create(name=name, map_active=True)
+    mobs = {}
+    for spec in SPECS:
+        mobs[spec.sobject] = datamap.mapobject_set.create(
+            sf_api_name=spec.sobject,
+            dj_class=spec.dj_class,
+            extractor=extractor)
+    for spec in SPECS:
+        mob = mobs[spec.sobject]
+        parents = dict((fld, par) for fld, par, blank in spec.relations)
+        for field in spec.fields:
+            parent = parents.get(field)
+            mob.mapfield_set.create(
+                sf_api_name=field,
+                dj_attr=ATTRS[field],
+                sf_relation=mobs[parent] if parent else None)
+    return datamap
@@ -0,0 +1,290 @@
+"""In-process stand-in for the Salesforce REST endpoints a load uses
+
+StandInAdapter is mounted on a transport's requests session, so the
+whole client stack runs unchanged while no socket is ever opened. It
+answers the token endpoint, query with nextRecordsUrl paging, COUNT(),
+composite/batch, sObject Collections retrieve, on its own or as
+composite subrequests, and Bulk API 2.0 query jobs with Sforce-Locator
+paged CSV results.
+"""
+import io
+import re
+import csv
+import json
+import time
+import itertools
+import threading
+from urllib.parse import urlsplit, parse_qs
+from django.utils.dateparse import parse_datetime
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+
+BASE_URL = 'https://bench.invalid'
+PAGE_SIZE = 2000
+# collection or query subrequests a composite request may carry
+COMPOSITE_COLLECTIONS = 5
+
+QUERY_RE = re.compile(
+    r'^SELECT (?P<fields>.+?) FROM (?P<sobject>\w+)'
+    r'(?: WHERE (?P<where>.+?))?(?: ORDER BY \w+)?$', re.I)
+IDS_RE = re.compile(r"\bId in \(([^)]*)\)", re.I)
+SINCE_RE = re.compile(r'\bSystemModstamp ?> ?(\S+)', re.I)
+
+
+class StandInAdapter(BaseAdapter):
+    """Answers API calls from a FixtureSet"""
+
+    def __init__(self, fixtures, page_size=PAGE_SIZE, job_polls=0):
+        super(StandInAdapter, self).__init__()
+        self.fixtures = fixtures
+        self.page_size = page_size
+        # polls a query job answers InProgress to before it completes
+        self.job_polls = job_polls
+        self.cursors = {}
+        self.jobs = {}
+        self.seq = itertools.count(1)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.busy = 0.0
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.answer(request)
+        finally:
+            with self.lock:
+                self.calls += 1
+                self.busy += time.perf_counter() - start
+
+    def answer(self, request):
+        """routes one request to the endpoint it calls"""
+        parts = urlsplit(request.url)
+        path = parts.path
+        body = request.body
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        if path == '/token':
+            return self.respond(request, 200, {
+                'access_token': 'bench',
+                'instance_url': BASE_URL,
+                'token_type': 'Bearer',
+            })
+        path = re.sub(r'^/services/data/v[\d.]+/', '', path)
+        if path == 'query':
+            qtxt = parse_qs(parts.query)['q'][0]
+            size = self.batch_size(request.headers)
+            return self.respond(request, *self.query(qtxt, size))
+        if path.startswith('query/'):
+            return self.respond(request, *self.next_page(path[6:]))
+        if path == 'composite/batch':
+            return self.respond(request, 200, self.batch(json.loads(body)))
+        if path == 'composite':
+            return self.respond(request, *self.composite(json.loads(body)))
+        if path.startswith('composite/sobjects/'):
+            return self.respond(
+                request, *self.subrequest(path, json.loads(body)))
+        if path == 'jobs/query':
+            return self.respond(request, *self.create_job(json.loads(body)))
+        if path.startswith('jobs/query/'):
+            job_id, sep, tail = path[11:].partition('/')
+            if tail == 'results':
+                return self.results(request, job_id, parse_qs(parts.query))
+            if request.method == 'PATCH':
+                return self.respond(
+                    request, *self.update_job(job_id, json.loads(body)))
+            return self.respond(request, *self.job_info(job_id))
+        return self.respond(request, 404, [{
+            'errorCode': 'NOT_FOUND',
+            'message': 'The stand-in does not serve ' + path}])
+
+    def close(self):
+        self.cursors = {}
+        self.jobs = {}
+
+    def respond(self, request, status, data):
+        resp = Response()
+        resp.status_code = status
+        resp.headers = CaseInsensitiveDict(
+            {'Content-Type': 'application/json;charset=UTF-8'})
+        resp._content = json.dumps(data).encode('utf-8')
+        resp.encoding = 'utf-8'
+        resp.url = request.url
+        resp.request = request
+        resp.connection = self
+        return resp
+
+    def batch_size(self, headers):
+        opts = headers.get('Sforce-Query-Options', '')
+        if opts.startswith('batchSize='):
+            return int(opts[len('batchSize='):])
+        return self.page_size
+
+    def matching(self, sobject, where):
+        """indexes of the rows of sobject a where clause selects"""
+        count = self.fixtures.counts.get(sobject, 0)
+        idxs = range(count)
+        where = where or ''
+        ids = IDS_RE.search(where)
+        if ids:
+            found = []
+            for sfid in ids.group(1).split(','):
+                hit = self.fixtures.index(sfid.strip(" '"))
+                if hit is not None and hit[0] == sobject:
+                    found.append(hit[1])
+            idxs = sorted(set(found))
+        since = SINCE_RE.search(where)
+        if since:
+            first = self.fixtures.stamp_index(parse_datetime(since.group(1)))
+            idxs = [idx for idx in idxs if idx >= first]
+        return idxs
+
+    def query(self, qtxt, size):
+        match = QUERY_RE.match(qtxt.strip())
+        if match is None:
+            return 400, [{'errorCode': 'MALFORMED_QUERY', 'message': qtxt}]
+        fields = [fld.strip() for fld in match.group('fields').split(',')]
+        sobject = match.group('sobject')
+        if not(sobject in self.fixtures.counts):
+            return 400, [{'errorCode': 'INVALID_TYPE', 'message': sobject}]
+        idxs = self.matching(sobject, match.group('where'))
+        if fields == ['COUNT()']:
+            return 200, {'totalSize': len(idxs), 'done': True, 'records': []}
+        return self.page(sobject, fields, idxs, 0, size)
+
+    def page(self, sobject, fields, idxs, start, size):
+        stop = min(start + size, len(idxs))
+        recs = [
+            self.fixtures.record(sobject, idxs[pos], fields)
+            for pos in range(start, stop)]
+        rtn = {'totalSize': len(idxs), 'done': stop >= len(idxs),
+               'records': recs}
+        if stop < len(idxs):
+            with self.lock:
+                key = '01g%015d-%d' % (next(self.seq), stop)
+                self.cursors[key] = (sobject, fields, idxs, stop, size)
+            rtn['nextRecordsUrl'] = '/services/data/v37.0/query/' + key
+        return 200, rtn
+
+    def next_page(self, key):
+        with self.lock:
+            cursor = self.cursors.pop(key, None)
+        if cursor is None:
+            return 400, [{'errorCode': 'INVALID_QUERY_LOCATOR',
+                          'message': key}]
+        return self.page(*cursor)
+
+    def batch(self, data):
+        results = []
+        for sub in data.get('batchRequests', []):
+            url = sub['url']
+            path, sep, qstr = url.partition('?')
+            qtxt = parse_qs(qstr).get('q', [''])[0]
+            status, result = self.query(qtxt, self.page_size)
+            results.append({'statusCode': status, 'result': result})
+        return {'hasErrors': False, 'results': results}
+
+    def composite(self, data):
+        subs = data.get('compositeRequest', [])
+        if len(subs) > COMPOSITE_COLLECTIONS:
+            return 400, [{
+                'errorCode': 'LIMIT_EXCEEDED',
+                'message': 'Too many collection subrequests'}]
+        rtn = []
+        for sub in subs:
+            path = re.sub(r'^/services/data/v[\d.]+/', '', sub['url'])
+            status, body = self.subrequest(path, sub.get('body') or {})
+            rtn.append({'body': body, 'httpHeaders': {},
+                        'httpStatusCode': status,
+                        'referenceId': sub['referenceId']})
+        return 200, {'compositeResponse': rtn}
+
+    def subrequest(self, path, data):
+        """one sObject Collections call, alone or inside a composite"""
+        if not(path.startswith('composite/sobjects/')):
+            return 404, [{'errorCode': 'NOT_FOUND', 'message': path}]
+        return 200, self.retrieve(path[19:], data)
+
+    def retrieve(self, sobject, data):
+        rtn = []
+        for sfid in data.get('ids', []):
+            hit = self.fixtures.index(sfid)
+            if hit is None or hit[0] != sobject:
+                rtn.append(None)
+                continue
+            rtn.append(self.fixtures.record(sobject, hit[1], data['fields']))
+        return rtn
+
+    def create_job(self, data):
+        match = QUERY_RE.match(data.get('query', '').strip())
+        if data.get('operation') != 'query' or match is None:
+            return 400, [{'errorCode': 'INVALIDJOB',
+                          'message': data.get('query')}]
+        sobject = match.group('sobject')
+        if not(sobject in self.fixtures.counts):
+            return 400, [{'errorCode': 'INVALIDJOB', 'message': sobject}]
+        fields = [fld.strip() for fld in match.group('fields').split(',')]
+        with self.lock:
+            job_id = '750%015d' % next(self.seq)
+            self.jobs[job_id] = {
+                'fields': fields,
+                'sobject': sobject,
+                'idxs': self.matching(sobject, match.group('where')),
+                'polls': self.job_polls,
+            }
+        return 200, {'id': job_id, 'operation': 'query',
+                     'object': sobject, 'state': 'UploadComplete'}
+
+    def job_info(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return 404, [{'errorCode': 'NOT_FOUND', 'message': job_id}]
+            state = 'JobComplete'
+            if job.get('state'):
+                state = job['state']
+            elif job['polls'] > 0:
+                job['polls'] -= 1
+                state = 'InProgress'
+        return 200, {'id': job_id, 'state': state,
+                     'numberRecordsProcessed': len(job['idxs'])}
+
+    def update_job(self, job_id, data):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return 404, [{'errorCode': 'NOT_FOUND', 'message': job_id}]
+            if data.get('state') != 'Aborted':
+                return 400, [{'errorCode': 'INVALIDJOBSTATE',
+                              'message': data.get('state')}]
+            job['state'] = 'Aborted'
+        return 200, {'id': job_id, 'state': 'Aborted'}
+
+    def results(self, request, job_id, params):
+        """one CSV chunk of a query job, empty fields standing for nulls"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return self.respond(request, 404, [{
+                'errorCode': 'NOT_FOUND', 'message': job_id}])
+        size = int(params.get('maxRecords', [self.page_size])[0])
+        start = int(params.get('locator', ['0'])[0])
+        idxs = job['idxs']
+        stop = min(start + size, len(idxs))
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator='\n')
+        fields = job['fields']
+        writer.writerow(fields)
+        for pos in range(start, stop):
+            rec = self.fixtures.record(job['sobject'], idxs[pos], fields)
+            writer.writerow([rec[fld] for fld in fields])
+        resp = self.respond(request, 200, None)
+        resp.headers = CaseInsensitiveDict({
+            'Content-Type': 'text/csv',
+            'Sforce-Locator': str(stop) if stop < len(idxs) else 'null',
+            'Sforce-NumberOfRecords': str(stop - start),
+        })
+        resp._content = False
+        resp._content_consumed = False
+        resp.raw = io.BytesIO(out.getvalue().encode('utf-8'))
+        return resp
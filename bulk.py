@@ -0,0 +1,123 @@
+"""Salesforce Bulk API 2.0 query jobs"""
+import io
+import csv
+import time
+
+
+BULK_API_VERSION = 'v47.0'
+POLL_SECONDS = 2
+MAX_WAIT = 3600
+MAX_RECORDS = 50000
+
+
+class BulkJobError(Exception):
+    """raised when a query job fails or is aborted"""
+
+
+def soql_text(apiqs):
+    """turns an apiqs REST query string into plain SOQL"""
+    soql = apiqs
+    if soql.startswith('query?q='):
+        soql = soql[len('query?q='):]
+    return soql.replace('+', ' ')
+
+
+class BulkQuery(object):
+    """One Bulk API 2.0 query job run against a ForceAPI credential"""
+
+    def __init__(self, api_cred, soql, poll_seconds=POLL_SECONDS,
+                 max_records=MAX_RECORDS, max_wait=MAX_WAIT):
+        self.api_cred = api_cred
+        self.soql = soql
+        self.poll_seconds = poll_seconds
+        self.max_wait = max_wait
+        self.max_records = max_records
+        self.job_id = None
+
+    def call(self, method, path, **kwargs):
+        resp = self.api_cred.api_request(
+            method, path, version=BULK_API_VERSION, **kwargs)
+        if resp.status_code >= 400:
+            raise BulkJobError('%s %s: %s' % (method, path, resp.text))
+        return resp
+
+    def submit(self):
+        """creates the query job"""
+        body = {
+            'operation': 'query',
+            'query': self.soql,
+            'contentType': 'CSV',
+            'columnDelimiter': 'COMMA',
+            'lineEnding': 'LF',
+        }
+        resp = self.call('POST', 'jobs/query', json=body)
+        self.job_id = resp.json()['id']
+        return self.job_id
+
+    def abort(self):
+        """asks Salesforce to stop the job"""
+        self.call('PATCH', 'jobs/query/' + self.job_id,
+                  json={'state': 'Aborted'})
+
+    def wait(self):
+        """polls the job until its results are ready
+
+        A job still running after max_wait seconds is aborted.
+        """
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            info = self.call('GET', 'jobs/query/' + self.job_id).json()
+            state = info.get('state')
+            if state == 'JobComplete':
+                return info
+            if state in ('Failed', 'Aborted'):
+                raise BulkJobError(
+                    '%s %s: %s' % (
+                        self.job_id, state, info.get('errorMessage')))
+            if time.monotonic() >= deadline:
+                self.abort()
+                raise BulkJobError('%s still %s after %ss' % (
+                    self.job_id, state, self.max_wait))
+            time.sleep(self.poll_seconds)
+
+    def iter_rows(self):
+        """yields result rows as dicts, one result chunk at a time"""
+        locator = None
+        while True:
+            path = 'jobs/query/%s/results?maxRecords=%d' % (
+                self.job_id, self.max_records)
+            if locator:
+                path = path + '&locator=' + locator
+            resp = self.call(
+                'GET', path, headers={'Accept': 'text/csv'}, stream=True)
+            try:
+                resp.raw.decode_content = True
+                resp.raw.auto_close = False
+                text = io.TextIOWrapper(
+                    resp.raw, encoding='utf-8', newline='')
+                reader = csv.reader(text)
+                header = next(reader, None)
+                for row in reader:
+                    yield dict(
+                        (key, val if val != '' else None)
+                        for key, val in zip(header, row))
+            finally:
+                self.api_cred.transport().add_bytes(resp.raw.tell())
+                resp.close()
+            locator = resp.headers.get('Sforce-Locator')
+            if not(locator) or locator == 'null':
+                return
+
+    def iter_batches(self, batch_size=2000):
+        """runs the job and yields lists of at most batch_size rows"""
+        if self.job_id is None:
+            self.submit()
+        self.wait()
+        batch = []
+        for row in self.iter_rows():
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
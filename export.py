@@ -0,0 +1,75 @@
+"""Streaming CSV export of work orders joined with their surveys"""
+import csv
+from .models import ServiceOrder
+
+
+CHUNK_SIZE = 2000
+
+# header, ServiceOrder lookup
+COLUMNS = (
+    ('work_order_id', 'sfid'),
+    ('work_order', 'name'),
+    ('order_type', 'svmxc_order_type_c'),
+    ('country', 'svmxc_country_c'),
+    ('completed', 'svmxc_completed_date_time_c'),
+    ('account_id', 'svmxc_company_c'),
+    ('account', 'svmxc_company_c__name'),
+    ('region', 'svmxc_company_c__global_region_c'),
+    ('subregion', 'svmxc_company_c__global_subregion_c'),
+    ('contact', 'svmxc_contact_c__name'),
+    ('contact_email', 'svmxc_contact_c__email'),
+    ('contact_language', 'svmxc_contact_c__language_c'),
+    ('technician_id', 'svmxc_group_member_c'),
+    ('technician', 'svmxc_group_member_c__name'),
+    ('survey_id', 'survey_record__forms_id'),
+    ('survey_updated', 'survey_record__last_update'),
+    ('nps', 'survey_record__nps'),
+    ('nss_eodb', 'survey_record__nss_eodb'),
+    ('nss_cc', 'survey_record__nss_cc'),
+    ('nss_fe', 'survey_record__nss_fe'),
+    ('nss_ftf', 'survey_record__nss_ftf'),
+    ('nss_ttr', 'survey_record__nss_ttr'),
+    ('gc_compare', 'survey_record__gc_compare'),
+    ('request_contact', 'survey_record__request_contact'),
+    ('comments', 'survey_record__cust_comments'),
+)
+
+
+class Echo(object):
+    """file-like object handing back what csv.writer writes"""
+
+    def write(self, value):
+        return value
+
+
+def export_qs(filters=None, surveyed=False):
+    """one row per work order and survey, as tuples in COLUMNS order"""
+    qs = ServiceOrder.objects.filter(**(filters or {}))
+    if surveyed:
+        qs = qs.filter(survey_record__isnull=False)
+    return qs.order_by('sfid', 'survey_record__pk').values_list(
+        *[lookup for header, lookup in COLUMNS])
+
+
+def iter_csv(qs, chunk_size=CHUNK_SIZE):
+    """yields CSV lines, the header first, without holding the rows
+
+    The header goes out before the query runs. MySQL buffers a whole
+    .iterator() result in the client, so work orders are read in keyset
+    pages of chunk_size sfids instead, each page with its surveys.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow([header for header, lookup in COLUMNS])
+    last = None
+    while True:
+        page = qs.values_list('sfid', flat=True).order_by('sfid')
+        if last is not None:
+            page = page.filter(sfid__gt=last)
+        sfids = list(page.distinct()[:chunk_size])
+        if not(sfids):
+            return
+        for row in qs.filter(sfid__in=sfids):
+            yield writer.writerow(row)
+        if len(sfids) < chunk_size:
+            return
+        last = sfids[-1]
@@ -0,0 +1,145 @@
+"""Fetching Salesforce records by sfid in as few round trips as possible"""
+from .transport import API_VERSION, QueryError
+from .workers import parallel_map
+
+
+MAX_URL = 15000
+BATCH_SIZE = 25
+COLLECTION_SIZE = 2000
+# a composite request takes at most 5 collection or query subrequests
+COMPOSITE_COLLECTIONS = 5
+COLLECTIONS_API_VERSION = 'v47.0'
+
+
+def in_filter(ids):
+    """SOQL filter matching a list of sfids"""
+    return "Id+in+('" + "','".join(ids) + "')"
+
+
+def pack_ids(query_for, ids, max_url=MAX_URL):
+    """query strings covering ids, each packing as many as the URL allows
+
+    query_for turns a where clause into the full query string, so the
+    object's own filters and select list count against the limit.
+    """
+    base = len(query_for(in_filter([])))
+    rtn = []
+    chunk = []
+    size = base
+    for sfid in sorted(ids):
+        add = len(sfid) + 3
+        if chunk and size + add > max_url:
+            rtn.append(query_for(in_filter(chunk)))
+            chunk = []
+            size = base
+        chunk.append(sfid)
+        size += add
+    if chunk:
+        rtn.append(query_for(in_filter(chunk)))
+    return rtn
+
+
+def run_batch(datamap, queries):
+    """runs up to BATCH_SIZE queries in one composite batch request
+
+    A query that fails in the batch is retried once on its own. If that
+    also fails, QueryError is raised rather than returning no records.
+    """
+    # sf_recs raises QueryError on an error result; None means no rows
+    if len(queries) == 1:
+        return [datamap.sf_recs(queries[0]) or []]
+    body = {
+        'batchRequests': [
+            {'method': 'GET', 'url': API_VERSION + '/' + qs}
+            for qs in queries]
+    }
+    resp = datamap.api_cred.api_request('POST', 'composite/batch', json=body)
+    results = resp.json().get('results', []) if resp.ok else []
+    rtn = []
+    for idx, qs in enumerate(queries):
+        res = results[idx] if idx < len(results) else {}
+        page = res.get('result')
+        if res.get('statusCode') != 200 or not(isinstance(page, dict)):
+            # retry on its own, which raises if it fails again
+            rtn.append(datamap.sf_recs(qs) or [])
+            continue
+        recs = list(page.get('records', []))
+        if not(page.get('done', True)):
+            nxt = page['nextRecordsUrl']
+            nxt = nxt.split('/services/data/' + API_VERSION + '/', 1)[-1]
+            recs.extend(datamap.sf_recs(nxt) or [])
+        rtn.append(recs)
+    return rtn
+
+
+def fetch_queries(datamap, queries, workers):
+    """runs query strings in composite batches on a bounded thread pool
+
+    Returns the records of each query, in the order of queries.
+    """
+    batches = [
+        queries[i:i + BATCH_SIZE]
+        for i in range(0, len(queries), BATCH_SIZE)]
+    results = parallel_map(
+        lambda batch: run_batch(datamap, batch), batches, workers)
+    return [recs for batch in results for recs in batch]
+
+
+def response_body(resp):
+    """decoded body of a 200 response, QueryError for any other status"""
+    try:
+        body = resp.json()
+    except ValueError:
+        body = resp.text
+    if resp.status_code != 200:
+        raise QueryError(resp.status_code, body)
+    return body
+
+
+def retrieve_collection(datamap, sobject, fields, chunks):
+    """gets records by id through sObject Collections
+
+    A single chunk of up to COLLECTION_SIZE ids is one collections call.
+    Up to COMPOSITE_COLLECTIONS chunks share one composite request. A
+    failed call or subrequest raises QueryError.
+    """
+    path = 'composite/sobjects/' + sobject
+    cred = datamap.api_cred
+    if len(chunks) == 1:
+        resp = cred.api_request(
+            'POST', path, version=COLLECTIONS_API_VERSION,
+            json={'ids': chunks[0], 'fields': fields})
+        return [rec for rec in response_body(resp) if rec]
+    subs = []
+    for idx, chunk in enumerate(chunks):
+        subs.append({
+            'method': 'POST',
+            'url': '/services/data/%s/%s' % (COLLECTIONS_API_VERSION, path),
+            'referenceId': 'chunk%d' % idx,
+            'body': {'ids': chunk, 'fields': fields},
+        })
+    resp = cred.api_request(
+        'POST', 'composite', version=COLLECTIONS_API_VERSION,
+        json={'allOrNone': False, 'compositeRequest': subs})
+    rtn = []
+    for sub in response_body(resp).get('compositeResponse', []):
+        if sub.get('httpStatusCode') != 200:
+            raise QueryError(sub.get('httpStatusCode'), sub.get('body'))
+        rtn.extend(rec for rec in sub.get('body') or [] if rec)
+    return rtn
+
+
+def fetch_collection(datamap, sobject, fields, ids, workers):
+    """gets records by id in as few collection calls as possible"""
+    ids = sorted(set(ids))
+    chunks = [
+        ids[i:i + COLLECTION_SIZE]
+        for i in range(0, len(ids), COLLECTION_SIZE)]
+    calls = [
+        chunks[i:i + COMPOSITE_COLLECTIONS]
+        for i in range(0, len(chunks), COMPOSITE_COLLECTIONS)]
+    results = parallel_map(
+        lambda call: retrieve_collection(datamap, sobject, fields, call),
+        calls,
+        workers)
+    return [rec for recs in results for rec in recs]
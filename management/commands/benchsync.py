@@ -0,0 +1,134 @@
+import time
+import tracemalloc
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone as dtz
+from django.core.management.base import BaseCommand, CommandError
+from nps.models import ForceAPI, OAuthToken
+from nps.transport import SFTransport
+from nps.mapping import locate_class
+from nps.bench.fixtures import FixtureSet, SPECS, build_datamap
+from nps.bench.server import StandInAdapter, BASE_URL
+
+
+class Command(BaseCommand):
+    help = 'Times DataMap.load_sf_data against a synthetic org'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            dest='sizes',
+            default='1000,10000,100000,1000000',
+            help='Comma separated numbers of ServiceOrders to load')
+        parser.add_argument(
+            '--seed',
+            type=int,
+            dest='seed',
+            default=0,
+            help='Seed of the generated records')
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            dest='page_size',
+            default=2000,
+            help='Records per query page served by the stand-in')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            dest='workers',
+            default=4,
+            help='max_concurrency of the benchmark DataMap')
+        parser.add_argument(
+            '--repeat',
+            action='store_true',
+            dest='repeat',
+            default=False,
+            help='Also time a second, incremental load of each size')
+
+    def handle(self, *args, **options):
+        """runs the loads in a throwaway copy of the default database
+
+        The copy is made like a test database and dropped at the end, so
+        no benchmark rows reach the real tables. Snapshots are switched
+        off while it runs.
+        """
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes takes numbers like 1000,10000')
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        self.report('Rows are written to the throwaway database %s' % (
+            connection.settings_dict['NAME']))
+        try:
+            with override_settings(NPS_SNAPSHOT_DIR=None):
+                self.run_sizes(sizes, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run_sizes(self, sizes, options):
+        for size in sizes:
+            fixtures = FixtureSet(size, options['seed'])
+            api = ForceAPI.objects.create(
+                user_id='benchmark@example.com',
+                access_token_url=BASE_URL + '/token')
+            adapter = StandInAdapter(fixtures, options['page_size'])
+            api.transport().session.mount(BASE_URL + '/', adapter)
+            datamap = build_datamap(api, 'benchmark %d' % size)
+            datamap.max_concurrency = options['workers']
+            datamap.save()
+            try:
+                self.measure(datamap, fixtures, adapter, 'full', True)
+                if options['repeat']:
+                    self.measure(datamap, fixtures, adapter, 'delta', False)
+            finally:
+                SFTransport.drop((api.pk, api.user_id, api.access_token_url))
+                self.purge(api)
+
+    def measure(self, datamap, fixtures, adapter, label, full):
+        """runs one load and reports its cost
+
+        Time spent generating records in the stand-in is reported apart,
+        as a real org serves them while the client waits on the network.
+        """
+        queries = []
+        served = adapter.busy
+
+        def count(execute, sql, params, many, context):
+            queries.append(1)
+            return execute(sql, params, many, context)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        with connection.execute_wrapper(count):
+            datamap.load_sf_data(full=full)
+        wall = time.perf_counter() - start
+        served = adapter.busy - served
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        run = datamap.syncrun_set.order_by('-started').first()
+        recs = sum(run.syncphase_set.values_list('records', flat=True))
+        self.report(
+            '%d orders %s: %d of %d records in %.2fs (%.2fs in stand-in, '
+            '%.0f/s), %d API requests, %d SQL queries, %.1f MB peak' % (
+                fixtures.size, label, recs, fixtures.total(), wall, served,
+                recs / wall if wall else 0, run.requests, len(queries),
+                peak / 1048576.0))
+
+    def purge(self, api=None):
+        """removes benchmark rows, which are told apart by their ids"""
+        # children first, so no SET_NULL updates run on rows about to go
+        for spec in reversed(SPECS):
+            klass = locate_class(spec.dj_class)
+            klass.objects.filter(sfid__startswith=spec.prefix + '-').delete()
+        apis = ForceAPI.objects.filter(user_id='benchmark@example.com')
+        if api is not None:
+            apis = apis.filter(pk=api.pk)
+        for cred in apis:
+            OAuthToken.objects.filter(key=cred.token_key()).delete()
+        apis.delete()
+
+    def report(self, msg):
+        dts = dtz.now().isoformat()
+        self.stdout.write('%s: %s' % (dts, msg))
@@ -0,0 +1,46 @@
+from django.utils import timezone as dtz
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from nps import snapshot
+
+
+
+class Command(BaseCommand):
+    help = 'Updates the columnar snapshot of work orders and surveys'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            dest='full',
+            default=False,
+            help='Rewrite the snapshot instead of adding changed rows')
+        parser.add_argument(
+            '--nps-by',
+            dest='nps_by',
+            default=None,
+            help='Afterwards print NPS grouped on these comma separated '
+                 'columns, e.g. region,month')
+
+    def handle(self, *args, **options):
+        try:
+            written = snapshot.update(full=options['full'])
+        except ImproperlyConfigured as exc:
+            raise CommandError(str(exc))
+        for name, count in sorted(written.items()):
+            self.report('%s: %d rows written' % (name, count))
+        if options['nps_by'] is None:
+            return
+        groups = [name for name in options['nps_by'].split(',') if name]
+        try:
+            rows = snapshot.Snapshot().nps_by(*groups)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        for row in rows:
+            keys = ' '.join(str(row[name]) for name in groups)
+            self.report('%s: %d responses, NPS %s' % (
+                keys or 'all', row['responses'], row['nps']))
+
+    def report(self, msg):
+        dts = dtz.now().isoformat()
+        self.stdout.write('%s: %s' % (dts, msg))
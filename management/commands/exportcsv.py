@@ -0,0 +1,50 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from nps import export
+from nps.views import export_filters
+
+
+
+class Command(BaseCommand):
+    help = 'Writes work orders joined with their surveys as CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            dest='output',
+            default='-',
+            help='File to write, - for standard output')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            dest='chunk_size',
+            default=export.CHUNK_SIZE,
+            help='Rows fetched from the database at a time')
+        parser.add_argument(
+            '--surveyed',
+            action='store_true',
+            dest='surveyed',
+            default=False,
+            help='Leave out work orders without a survey')
+        for name in ('region', 'order_type', 'start', 'end'):
+            parser.add_argument(
+                '--' + name.replace('_', '-'),
+                dest=name,
+                default=None,
+                help='Same as the %s parameter of the export view' % name)
+
+    def handle(self, *args, **options):
+        try:
+            fltrs = export_filters(options)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        qs = export.export_qs(fltrs, options['surveyed'])
+        lines = export.iter_csv(qs, options['chunk_size'])
+        if options['output'] == '-':
+            for line in lines:
+                sys.stdout.write(line)
+            return
+        with open(options['output'], 'w', newline='',
+                  encoding='utf-8') as out:
+            for line in lines:
+                out.write(line)
@@ -1,27 +1,42 @@
-from django.utils import timezone as dtz
-from django.core.management.base import BaseCommand, CommandError
-from nps.models import MapSched
-
-
-
-class Command(BaseCommand):
-    help = 'Populates data from SalesForce to App'
-
-    def handle(self, *args, **options):
-        self.report('Checking schedules')
-        for sched in MapSched.objects.all():
-            datamap = sched.data_map
-            if sched.is_due():
-                self.report('Updating %s' % str(sched))
-                datamap.load_sf_data()
-                datamap.save()
-                sched.increment_nxt()
-
-                self.report(
-                    'Data refreshed for %s' % datamap.name)
-            else:
-                self.report('%s not yet due.' % str(sched))
-
-    def report(self, msg):
-        dts = dtz.now().isoformat()
-        self.stdout.write('%s: %s' % (dts, msg))
+from django.utils import timezone as dtz
+from django.core.management.base import BaseCommand, CommandError
+from nps.models import MapSched
+from nps.transport import stats_delta
+
+
+
+class Command(BaseCommand):
+    help = 'Populates data from SalesForce to App'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            dest='full',
+            default=False,
+            help='Reload every record instead of changes since last run')
+
+    def handle(self, *args, **options):
+        self.report('Checking schedules')
+        qs = MapSched.objects.select_related('data_map__api_cred')
+        for sched in qs:
+            datamap = sched.data_map
+            if sched.is_due():
+                self.report('Updating %s' % str(sched))
+                trn = datamap.api_cred.transport()
+                before = trn.stats()
+                datamap.load_sf_data(full=options['full'])
+                sched.increment_nxt()
+
+                self.report(
+                    'Data refreshed for %s' % datamap.name)
+                used = stats_delta(before, trn.stats())
+                self.report(
+                    '%(requests)d requests, %(handshakes)d handshakes, '
+                    '%(logins)d logins, %(bytes)d bytes' % used)
+            else:
+                self.report('%s not yet due.' % str(sched))
+
+    def report(self, msg):
+        dts = dtz.now().isoformat()
+        self.stdout.write('%s: %s' % (dts, msg))
@@ -0,0 +1,17 @@
+from django.utils import timezone as dtz
+from django.core.management.base import BaseCommand
+from nps import rollups
+
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the NPS rollup tables from every survey'
+
+    def handle(self, *args, **options):
+        self.report('Rebuilding NPS rollups')
+        count = rollups.rebuild()
+        self.report('%d rollup rows written' % count)
+
+    def report(self, msg):
+        dts = dtz.now().isoformat()
+        self.stdout.write('%s: %s' % (dts, msg))
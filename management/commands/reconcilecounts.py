@@ -0,0 +1,48 @@
+from django.utils import timezone as dtz
+from django.core.management.base import BaseCommand
+from nps.models import MapObject
+
+
+
+class Command(BaseCommand):
+    help = 'Checks MapObject record counts against their tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--map',
+            dest='map',
+            default=None,
+            help='Only check the objects of the DataMap with this name')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='Report drift without storing the counted values')
+
+    def handle(self, *args, **options):
+        qs = MapObject.objects.select_related('data_map').exclude(
+            dj_class__isnull=True).order_by('dj_class', 'pk')
+        if options['map']:
+            qs = qs.filter(data_map__name=options['map'])
+        counted = {}
+        drifted = 0
+        for mo in qs:
+            # objects sharing a model share its table, count it once
+            if not(mo.dj_class in counted):
+                counted[mo.dj_class] = mo.get_mapped().objects.count()
+            cur = mo.record_count or 0
+            drift = counted[mo.dj_class] - cur
+            if not(drift):
+                continue
+            drifted += 1
+            self.report('%s %s: stored %d, counted %d' % (
+                mo.data_map.name, mo.dj_class, cur, counted[mo.dj_class]))
+            if not(options['dry_run']):
+                mo.record_count = counted[mo.dj_class]
+                mo.save(update_fields=['record_count'])
+        self.report('%d of %d counts drifted' % (drifted, len(qs)))
+
+    def report(self, msg):
+        dts = dtz.now().isoformat()
+        self.stdout.write('%s: %s' % (dts, msg))
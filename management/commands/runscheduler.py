@@ -0,0 +1,44 @@
+import signal
+from django.utils import timezone as dtz
+from django.core.management.base import BaseCommand
+from nps.scheduler import Scheduler
+
+
+
+class Command(BaseCommand):
+    help = 'Runs SalesForce refreshes as their schedules fall due'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=2,
+            help='Number of DataMaps refreshed at the same time')
+        parser.add_argument(
+            '--max-sleep',
+            type=int,
+            default=60,
+            dest='max_sleep',
+            help='Seconds between checks for schedule changes')
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            dest='full',
+            default=False,
+            help='Reload every record instead of changes since last run')
+
+    def handle(self, *args, **options):
+        sched = Scheduler(
+            workers=options['workers'],
+            max_sleep=options['max_sleep'],
+            full=options['full'],
+            report=self.report)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *a: sched.stop())
+        self.report('Scheduler started')
+        sched.run()
+        self.report('Scheduler stopped')
+
+    def report(self, msg):
+        dts = dtz.now().isoformat()
+        self.stdout.write('%s: %s' % (dts, msg))
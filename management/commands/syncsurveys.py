@@ -0,0 +1,52 @@
+from django.utils import timezone as dtz
+from django.core.management.base import BaseCommand
+from nps.models import Survey_Form
+from nps.surveys import sync_forms
+from nps.transport import stats_delta
+
+
+
+class Command(BaseCommand):
+    help = 'Pulls changed survey records from the Forms API'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            dest='full',
+            default=False,
+            help='Reload every record instead of changes since last run')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            dest='workers',
+            default=4,
+            help='Number of forms pulled at once')
+        parser.add_argument(
+            '--form',
+            dest='form',
+            default=None,
+            help='Only sync the Survey_Form with this name')
+
+    def handle(self, *args, **options):
+        qs = Survey_Form.objects.select_related('access')
+        if options['form']:
+            qs = qs.filter(name=options['form'])
+        forms = list(qs)
+        trns = dict(
+            (form.access_id, form.access.transport()) for form in forms)
+        before = dict((pk, trn.stats()) for pk, trn in trns.items())
+        self.report('Syncing %d survey forms' % len(forms))
+        totals = sync_forms(forms, options['workers'], options['full'])
+        for form in forms:
+            self.report('%s: %d new, %d updated' % (
+                form.name, totals[form.pk][0], totals[form.pk][1]))
+        for pk, trn in trns.items():
+            used = stats_delta(before[pk], trn.stats())
+            self.report(
+                '%(requests)d requests, %(logins)d logins, '
+                '%(bytes)d bytes' % used)
+
+    def report(self, msg):
+        dts = dtz.now().isoformat()
+        self.stdout.write('%s: %s' % (dts, msg))
@@ -0,0 +1,97 @@
+"""Compiled field mapping plans for MapObjects"""
+from collections import namedtuple
+from pydoc import locate
+from django.utils import timezone as dtz
+
+
+FKField = namedtuple('FKField', 'attr attname map_field relation klass')
+
+_classes = {}
+_plans = {}
+
+
+def locate_class(dj_class):
+    """resolves a mapped model class by name once"""
+    if not(dj_class in _classes):
+        _classes[dj_class] = locate('nps.models.' + dj_class)
+    return _classes[dj_class]
+
+
+class MapPlan(object):
+    """Source key to model attribute mapping of one MapObject"""
+
+    def __init__(self, mapobj):
+        self.pk = mapobj.pk
+        self.klass = locate_class(mapobj.dj_class)
+        self.fields = {}
+        self.fields_ci = {}
+        self.fks = {}
+        self.select = []
+        mfqs = mapobj.mapfield_set.select_related(
+            'sf_relation').prefetch_related('mapfilter_set').order_by('pk')
+        fltrs = []
+        for mf in mfqs:
+            self.select.append(mf.sf_api_name)
+            fltrs.extend(mf.mapfilter_set.all())
+            if not(mf.dj_attr):
+                continue
+            self.fields.setdefault(mf.sf_api_name, mf.dj_attr)
+            self.fields_ci.setdefault(mf.sf_api_name.lower(), mf.dj_attr)
+            if mf.sf_relation is not None:
+                fld = self.klass._meta.get_field(mf.dj_attr)
+                self.fks[mf.dj_attr] = FKField(
+                    mf.dj_attr,
+                    fld.attname,
+                    mf,
+                    mf.sf_relation,
+                    locate_class(mf.sf_relation.dj_class))
+        self.compile_filters(mapobj, fltrs)
+
+    def compile_filters(self, mapobj, fltrs):
+        """renders static filters now and keeps time relative ones"""
+        cmpr = [flt.logic_param for flt in fltrs
+                if flt.logic == 'FLDCMPR' and flt.logic_param is not None]
+        fields = {}
+        if cmpr:
+            fields = mapobj.mapfield_set.model.objects.in_bulk(cmpr)
+        self.static = []
+        self.dynamic = []
+        for flt in fltrs:
+            if flt.is_dynamic():
+                self.dynamic.append(flt)
+            else:
+                self.static.append(flt.fltr_txt(fields))
+
+    def where(self, now=None):
+        """filter texts of the query with DELTAxDAYS rendered for now"""
+        now = now or dtz.now()
+        return self.static + [flt.fltr_txt(now=now) for flt in self.dynamic]
+
+    def apply(self, rec):
+        """maps a source record onto model attributes"""
+        rtn = {}
+        for key, val in rec.items():
+            attr = self.fields.get(key)
+            if attr is None:
+                attr = self.fields_ci.get(key.lower())
+            if attr:
+                rtn[attr] = val
+        return rtn
+
+
+def plan_for(mapobj):
+    """gets the cached plan of a MapObject, compiling it if needed"""
+    plan = _plans.get(mapobj.pk)
+    if plan is None:
+        plan = MapPlan(mapobj)
+        _plans[mapobj.pk] = plan
+    return plan
+
+
+def invalidate(pks=None):
+    """drops compiled plans, all of them when no pks are given"""
+    if pks is None:
+        _plans.clear()
+    else:
+        for pk in pks:
+            _plans.pop(pk, None)
@@ -0,0 +1,64 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nps', '0009_auto_20161027_1024'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Form_Fields',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Forms_Access',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=80)),
+                ('client_id', models.CharField(max_length=160)),
+                ('client_secret', models.CharField(max_length=80)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Survey_Form',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=80)),
+                ('form_id', models.IntegerField()),
+                ('access', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='nps.Forms_Access')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='contact',
+            name='language_c',
+            field=models.CharField(blank=True, max_length=80, null=True),
+        ),
+        migrations.CreateModel(
+            name='Survey_Record',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('forms_id', models.CharField(blank=True, max_length=80, null=True)),
+                ('wo_name', models.CharField(max_length=80)),
+                ('last_update', models.DateTimeField(null=True)),
+                ('nps', models.IntegerField(null=True)),
+                ('nss_eodb', models.IntegerField(null=True)),
+                ('nss_cc', models.IntegerField(null=True)),
+                ('nss_fe', models.IntegerField(null=True)),
+                ('nss_ftf', models.IntegerField(null=True)),
+                ('nss_ttr', models.IntegerField(null=True)),
+                ('gc_compare', models.IntegerField(null=True)),
+                ('request_contact', models.BooleanField(default=False)),
+                ('cust_comments', models.TextField(null=True)),
+                ('survey_link', models.CharField(max_length=255, null=True)),
+                ('survey_form', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='nps.Survey_Form')),
+                ('work_order', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='nps.ServiceOrder')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nps', '0010_survey_forms'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OAuthToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('access_token', models.TextField(blank=True, null=True)),
+                ('instance_url', models.CharField(blank=True, max_length=255, null=True)),
+                ('refresh_token', models.TextField(blank=True, null=True)),
+                ('expires', models.DateTimeField(blank=True, null=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
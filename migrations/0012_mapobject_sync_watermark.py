@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nps', '0011_oauthtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mapobject',
+            name='sync_watermark',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nps', '0012_mapobject_sync_watermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mapobject',
+            name='extractor',
+            field=models.CharField(choices=[('AUTO', 'Automatic'), ('REST', 'REST query'), ('BULK', 'Bulk API 2.0')], default='AUTO', max_length=4),
+        ),
+    ]
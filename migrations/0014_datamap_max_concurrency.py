@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nps', '0013_mapobject_extractor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datamap',
+            name='max_concurrency',
+            field=models.IntegerField(default=4, help_text='Concurrent API requests during a refresh'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nps', '0014_datamap_max_concurrency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mapsched',
+            name='modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nps', '0015_mapsched_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('full', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('RUN', 'Running'), ('OK', 'Completed'), ('ERR', 'Failed')], default='RUN', max_length=3)),
+                ('requests', models.IntegerField(default=0)),
+                ('handshakes', models.IntegerField(default=0)),
+                ('logins', models.IntegerField(default=0)),
+                ('bytes', models.BigIntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('data_map', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='nps.DataMap')),
+            ],
+            options={
+                'ordering': ['-started'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SyncPhase',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dj_class', models.CharField(max_length=40)),
+                ('http_time', models.FloatField(default=0)),
+                ('bytes', models.BigIntegerField(default=0)),
+                ('pages', models.IntegerField(default=0)),
+                ('map_time', models.FloatField(default=0)),
+                ('db_time', models.FloatField(default=0)),
+                ('records', models.IntegerField(default=0)),
+                ('inserted', models.IntegerField(default=0)),
+                ('updated', models.IntegerField(default=0)),
+                ('skipped', models.IntegerField(default=0)),
+                ('map_object', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='nps.MapObject')),
+                ('sync_run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='nps.SyncRun')),
+            ],
+        ),
+    ]
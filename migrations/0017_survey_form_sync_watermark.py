@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nps', '0016_syncphase_syncrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='survey_form',
+            name='last_refresh',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='survey_form',
+            name='sync_watermark',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
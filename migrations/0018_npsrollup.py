@@ -0,0 +1,44 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nps', '0017_survey_form_sync_watermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NPSRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region', models.CharField(blank=True, max_length=80, null=True)),
+                ('subregion', models.CharField(blank=True, max_length=80, null=True)),
+                ('order_type', models.CharField(blank=True, max_length=255, null=True)),
+                ('month', models.DateField(blank=True, null=True)),
+                ('responses', models.IntegerField(default=0)),
+                ('promoters', models.IntegerField(default=0)),
+                ('passives', models.IntegerField(default=0)),
+                ('detractors', models.IntegerField(default=0)),
+                ('nss_eodb_sum', models.IntegerField(default=0)),
+                ('nss_eodb_ct', models.IntegerField(default=0)),
+                ('nss_cc_sum', models.IntegerField(default=0)),
+                ('nss_cc_ct', models.IntegerField(default=0)),
+                ('nss_fe_sum', models.IntegerField(default=0)),
+                ('nss_fe_ct', models.IntegerField(default=0)),
+                ('nss_ftf_sum', models.IntegerField(default=0)),
+                ('nss_ftf_ct', models.IntegerField(default=0)),
+                ('nss_ttr_sum', models.IntegerField(default=0)),
+                ('nss_ttr_ct', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('technician', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='nps.ServiceGroupMembers')),
+            ],
+            options={
+                'unique_together': {('region', 'subregion', 'technician', 'order_type', 'month')},
+                'index_together': {('month', 'region')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nps', '0019_rollupstate'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='serviceorder',
+            name='name',
+            field=models.CharField(blank=True, db_index=True, max_length=80, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nps', '0020_serviceorder_name_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollupstate',
+            name='rebuilt',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
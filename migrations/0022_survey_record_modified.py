@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nps', '0021_rollupstate_rebuilt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='survey_record',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True, null=True),
+        ),
+    ]
@@ -1,6 +1,8 @@
-from .general import ForceAPI, DataMap, MapObject
+from .general import ForceAPI, OAuthToken, DataMap, MapObject
 from .general import MapField, MapFilter, MapSched
+from .sync import SyncRun, SyncPhase
 from .nps import Case, Account, Contact
 from .nps import InstalledProduct, SFUser, ServiceGroupMembers
 from .nps import ServiceOrder
 from .geforms import Forms_Access, Survey_Form, Survey_Record
+from .rollup import NPSRollup, RollupState
@@ -1,182 +1,398 @@
-from django.db import models
-from django.utils import timezone
-from .general import proxies
-from .nps import ServiceOrder
-import requests
-
-
-class Forms_Access(models.Model):
-    name = models.CharField(max_length=80)
-    client_id = models.CharField(max_length=160)
-    client_secret = models.CharField(max_length=80)
-
-    scope = 'GECorp_Forms_API'
-    access_token_url = 'https://fssfed.ge.com/fss/as/token.oauth2'
-    access_token_expires = None
-    access_token = None
-
-    def __str__(self):
-        return self.name
-
-    def _access_token_params(self):
-        return {
-            'grant_type': 'client_credentials',
-            'client_id': self.client_id,
-            'client_secret': self.client_secret,
-            'scope': self.scope
-        }
-
-    def get_access_token(self, params=None):
-        data = params if params is not None else self._access_token_params()
-        headers = {
-            'content-type': 'application/x-www-form-urlencoded'
-        }
-        req = self.post(
-            self.access_token_url,
-            data,
-            headers)
-        if req.status_code == 200:
-            rj = req.json()
-            secs = 7199
-            if 'expires_in' in rj:
-                secs = rj['expires_in']
-            if 'access_token' in rj:
-                self.access_token = rj['access_token']
-                self.access_token_expires = timezone.now()
-                self.access_token_expires += timezone.timedelta(seconds=secs)
-                return self.access_token
-            else:
-                return rj
-        else:
-            return req
-
-    def post(self, url, data, headers=None):
-        if headers is None:
-            headers = self.api_call_headers()
-        if proxies():
-            return requests.post(
-                url,
-                headers=headers,
-                data=data,
-                proxies=proxies())
-        else:
-            return requests.post(
-                url,
-                headers=headers,
-                data=data)
-
-    def get(self, url, headers=None):
-        if headers is None:
-            headers = self.api_call_headers()
-        if proxies():
-            return requests.post(
-                url,
-                headers=headers,
-                proxies=proxies())
-        else:
-            return requests.post(
-                url,
-                headers=headers)
-
-
-    def api_call_headers(self):
-        return {
-            'content-type': 'application/json',
-            'Authorization': 'Bearer ' + self.check_access_token()
-        }
-
-    def check_access_token(self):
-        if self.access_token_expires is None:
-            self.access_token = None
-        elif timezone.now() > self.access_token_expires:
-            self.access_token = None
-            self.access_token_expires = None
-        if self.access_token is None:
-            self.get_access_token()
-        return self.access_token
-
-    def get_available_forms(self):
-        url = 'https://api.ge.com/gecorp/forms/v1/forms'
-        return self.get(url, self.api_call_headers())
-
-
-class Survey_Form(models.Model):
-    name = models.CharField(max_length=80)
-    form_id = models.IntegerField()
-    access = models.ForeignKey(
-        Forms_Access,
-        on_delete=models.CASCADE)
-
-    def __str__(self):
-        return self.name
-
-
-class Form_Fields(models.Model):
-    pass
-
-
-class Survey_Record(models.Model):
-    work_order = models.ForeignKey(
-        ServiceOrder,
-        null=True,
-        on_delete=models.SET_NULL)
-    forms_id = models.CharField(
-        max_length=80,
-        null=True,
-        blank=True)
-    survey_form = models.ForeignKey(
-        Survey_Form,
-        on_delete=models.CASCADE)
-    wo_name = models.CharField(max_length=80)
-    last_update = models.DateTimeField(null=True)
-    nps = models.IntegerField(null=True)
-    nss_eodb = models.IntegerField(null=True)
-    nss_cc = models.IntegerField(null=True)
-    nss_fe = models.IntegerField(null=True)
-    nss_ftf = models.IntegerField(null=True)
-    nss_ttr = models.IntegerField(null=True)
-    gc_compare = models.IntegerField(null=True)
-    request_contact = models.BooleanField(default=False)
-    cust_comments = models.TextField(null=True)
-    survey_link = models.CharField(
-        null=True,
-        max_length=255)
-
-    def __str__(self):
-        return self.wo_name
-
-    def find_filt(self):
-        return {
-            "field_id": 1588082,
-            "operator": "eq",
-            "value": self.wo_name
-        }
-
-    def find_record(self):
-        access = self.survey_form.access
-        body = {
-            'offset': 0,
-            'limit': 499,
-            'fields': [
-                "record_id",
-                "dt_updated",
-                1588082, # wo_name
-                1672513, # nss_eodb
-                1672514, # nss_cc
-                1672515, # nss_fe
-                1672516, # nss_ftf
-                1672517, # nss_ttr
-                1672518, # gc_compare
-                1672519, # request_contact
-                1672526, # cust_comments
-                1631523 # survey_link
-            ],
-            'filters': {
-                'and': self.find_filt()
-            },
-            'sort': {},
-            'case_sensitive': True
-        }
-        request_url = "https://api.ge.com/gecorp/forms/v1/forms/"
-        request_url += "%s/records" % self.survey_form.form_id
-        return access.post(request_url, body)
+import time
+import datetime
+from django.db import models, transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from .general import proxies, OAuthToken, rows_changing
+from .nps import ServiceOrder
+from ..transport import SFTransport
+from ..surveys import PLAN, WO_NAME_FIELD, sync_forms
+
+
+FORMS_API_URL = 'https://api.ge.com/gecorp/forms/v1/'
+PAGE_LIMIT = 499
+# pages are read by keyset on this order, see Forms_Access.iter_records
+PAGE_SORT = {'dt_updated': 'asc', 'record_id': 'asc'}
+
+
+class Forms_Access(models.Model):
+    name = models.CharField(max_length=80)
+    client_id = models.CharField(max_length=160)
+    client_secret = models.CharField(max_length=80)
+
+    scope = 'GECorp_Forms_API'
+    access_token_url = 'https://fssfed.ge.com/fss/as/token.oauth2'
+    token_lifetime = 7199
+
+    def __str__(self):
+        return self.name
+
+    def transport(self):
+        """gets the pooled transport shared by this client"""
+        key = ('forms', self.pk, self.client_id)
+        return SFTransport.for_key(key, proxies())
+
+    @property
+    def access_token(self):
+        cnn = self.transport().conn
+        return cnn['access_token'] if cnn else None
+
+    def token_key(self):
+        """key of this client in the shared token store"""
+        return 'forms:%s' % self.pk
+
+    def _access_token_params(self):
+        return {
+            'grant_type': 'client_credentials',
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'scope': self.scope
+        }
+
+    def get_access_token(self, params=None):
+        """logs in with the client credentials"""
+        data = params if params is not None else self._access_token_params()
+        headers = {
+            'content-type': 'application/x-www-form-urlencoded'
+        }
+        trn = self.transport()
+        with trn.lock:
+            req = trn.request(
+                'POST',
+                self.access_token_url,
+                data=data,
+                headers=headers)
+            trn.logins += 1
+            if req.status_code != 200:
+                return req
+            rj = req.json()
+            if not('access_token' in rj):
+                return rj
+            secs = int(rj.get('expires_in') or self.token_lifetime)
+            # refresh a minute early rather than race the expiry
+            trn.conn = {'access_token': rj['access_token']}
+            trn.conn_expires = time.time() + secs - 60
+            return rj['access_token']
+
+    def cached_token(self):
+        """gets a still valid token another process stored, if any"""
+        tok = OAuthToken.objects.filter(key=self.token_key()).first()
+        if tok is None or not(tok.is_valid()):
+            return None
+        trn = self.transport()
+        trn.conn = tok.as_conn()
+        trn.conn_expires = tok.expires_ts()
+        return tok.access_token
+
+    def refresh_access_token(self):
+        """logs in once under the store's row lock and shares the token"""
+        key = self.token_key()
+        OAuthToken.objects.get_or_create(key=key)
+        with transaction.atomic():
+            tok = OAuthToken.objects.select_for_update().get(key=key)
+            if tok.is_valid():
+                # another worker logged in while this one waited
+                return self.cached_token()
+            rtn = self.get_access_token()
+            if isinstance(rtn, str):
+                tok.store(self.transport().conn, self.transport().conn_expires)
+        return rtn
+
+    def check_access_token(self):
+        """gets a live token from memory, the shared store or a login"""
+        trn = self.transport()
+        with trn.lock:
+            expd = trn.conn_expires is None or trn.conn_expires < time.time()
+            if trn.conn is None or expd:
+                return self.cached_token() or self.refresh_access_token()
+            return trn.conn['access_token']
+
+    def invalidate_token(self, token):
+        """drops a token the API has rejected"""
+        trn = self.transport()
+        with trn.lock:
+            if trn.conn and trn.conn.get('access_token') == token:
+                trn.conn = None
+                trn.conn_expires = None
+            OAuthToken.objects.filter(
+                key=self.token_key(),
+                access_token=token).update(expires=None)
+
+    def api_request(self, method, url, **kwargs):
+        """sends an authorised request, logging in again once on a 401"""
+        trn = self.transport()
+        hdr = kwargs.pop('headers', None) or {}
+        hdr.setdefault('content-type', 'application/json')
+        resp = None
+        for attempt in range(2):
+            token = self.check_access_token()
+            if not(isinstance(token, str)):
+                # the login failed, hand back its response
+                return token
+            hdr['Authorization'] = 'Bearer ' + token
+            resp = trn.request(method, url, headers=hdr, **kwargs)
+            if resp.status_code != 401:
+                break
+            self.invalidate_token(token)
+        return resp
+
+    def post(self, url, data, headers=None):
+        if headers is None:
+            return self.api_request('POST', url, json=data)
+        trn = self.transport()
+        return trn.request('POST', url, headers=headers, data=data)
+
+    def get(self, url, headers=None):
+        if headers is None:
+            return self.api_request('GET', url)
+        return self.transport().request('GET', url, headers=headers)
+
+    def api_call_headers(self):
+        return {
+            'content-type': 'application/json',
+            'Authorization': 'Bearer ' + self.check_access_token()
+        }
+
+    def get_available_forms(self):
+        return self.get(FORMS_API_URL + 'forms')
+
+    def iter_records(self, form_id, fields, filters=None,
+                     limit=PAGE_LIMIT):
+        """yields the records of a form one page at a time
+
+        Pages follow PAGE_SORT and each asks for the records past the
+        last (dt_updated, record_id) read, not for an offset, so a record
+        updated meanwhile cannot shift an unread one into a page already
+        read. Filters take no tuple comparison, so the records tied on
+        the last dt_updated are read first. fields must hold both keys.
+        """
+        url = FORMS_API_URL + 'forms/%s/records' % form_id
+        base = list((filters or {}).get('and', []))
+        last = None
+        ties = False
+        while True:
+            conds = list(base)
+            if ties:
+                conds.append(page_cond('dt_updated', 'eq', last[0]))
+                conds.append(page_cond('record_id', 'gt', last[1]))
+            elif last is not None:
+                conds.append(page_cond('dt_updated', 'gt', last[0]))
+            body = {
+                'offset': 0,
+                'limit': limit,
+                'fields': fields,
+                'filters': {'and': conds} if conds else {},
+                'sort': PAGE_SORT,
+                'case_sensitive': True
+            }
+            resp = self.api_request('POST', url, json=body)
+            resp.raise_for_status()
+            data = resp.json()
+            recs = data.get('records', []) if isinstance(data, dict) else data
+            if recs:
+                yield recs
+            if len(recs) >= limit:
+                last = (recs[-1]['dt_updated'], recs[-1]['record_id'])
+                ties = True
+            elif ties:
+                ties = False
+            else:
+                return
+
+
+def page_cond(field_id, operator, value):
+    return {'field_id': field_id, 'operator': operator, 'value': value}
+
+
+class Survey_Form(models.Model):
+    name = models.CharField(max_length=80)
+    form_id = models.IntegerField()
+    access = models.ForeignKey(
+        Forms_Access,
+        on_delete=models.CASCADE)
+    sync_watermark = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False)
+    last_refresh = models.DateTimeField(
+        null=True,
+        blank=True)
+    watermark_overlap = datetime.timedelta(minutes=5)
+    upsert_chunk_size = 2000
+
+    def __str__(self):
+        return self.name
+
+    def delta_filter(self):
+        """records filter limiting a pull to rows past the watermark"""
+        if self.sync_watermark is None:
+            return None
+        since = self.sync_watermark - self.watermark_overlap
+        return {
+            'and': [{
+                'field_id': 'dt_updated',
+                'operator': 'gt',
+                'value': since.astimezone(timezone.utc).strftime(
+                    '%Y-%m-%dT%H:%M:%SZ')
+            }]
+        }
+
+    def extract(self, full=False):
+        """pages of records updated since the watermark, or all if full"""
+        fltr = None if full else self.delta_filter()
+        return self.access.iter_records(self.form_id, PLAN.request, fltr)
+
+    def upsert_recs(self, frecs):
+        """inserts new and updates changed survey rows in bulk"""
+        latest = {}
+        for frec in frecs:
+            if frec.get('forms_id'):
+                latest[frec['forms_id']] = frec
+        names = set(frec.get('wo_name') for frec in latest.values())
+        names.discard(None)
+        new = []
+        changed = {}
+        with transaction.atomic():
+            wos = dict(ServiceOrder.objects.filter(
+                name__in=list(names)).values_list('name', 'sfid'))
+            cur = dict(
+                (rec.forms_id, rec) for rec in self.survey_record_set.filter(
+                    forms_id__in=list(latest)))
+            for fid, frec in latest.items():
+                frec['work_order_id'] = wos.get(frec.get('wo_name'))
+                rec = cur.get(fid)
+                if rec is None:
+                    new.append(Survey_Record(survey_form=self, **frec))
+                    continue
+                stamp = frec.get('last_update')
+                if rec.last_update and stamp and not(stamp > rec.last_update):
+                    continue
+                for attr, val in frec.items():
+                    setattr(rec, attr, val)
+                # bulk_update leaves auto_now fields alone
+                rec.modified = timezone.now()
+                flds = tuple(sorted(
+                    attr for attr in frec if attr != 'forms_id')) + (
+                        'modified',)
+                changed.setdefault(flds, []).append(rec)
+            keys = [rec.forms_id for rec in new]
+            keys.extend(
+                rec.forms_id for recs in changed.values() for rec in recs)
+            after = []
+            if keys:
+                after = rows_changing.send(
+                    sender=Survey_Record, keys=keys, survey_form=self)
+            Survey_Record.objects.bulk_create(
+                new, batch_size=self.upsert_chunk_size)
+            for flds, recs in changed.items():
+                Survey_Record.objects.bulk_update(
+                    recs, flds, batch_size=self.upsert_chunk_size)
+            for rcv, done in after:
+                if callable(done):
+                    done()
+        return len(new), sum(len(recs) for recs in changed.values())
+
+    def link_orders(self):
+        """links stored surveys to work orders that arrived after them
+
+        upsert_recs only links the surveys in the batch it writes, so a
+        survey stored before its ServiceOrder stays unlinked until this
+        matches it by wo_name. Returns the number of surveys linked.
+        """
+        orders = ServiceOrder.objects.filter(name=OuterRef('wo_name'))
+        with transaction.atomic():
+            rows = list(self.survey_record_set.filter(
+                work_order__isnull=True,
+                wo_name__in=ServiceOrder.objects.values('name')).values_list(
+                    'pk', 'forms_id'))
+            if not(rows):
+                return 0
+            after = rows_changing.send(
+                sender=Survey_Record,
+                keys=[fid for pk, fid in rows],
+                survey_form=self)
+            linked = Survey_Record.objects.filter(
+                pk__in=[pk for pk, fid in rows]).update(
+                    work_order_id=Subquery(orders.values('sfid')[:1]),
+                    modified=timezone.now())
+            for rcv, done in after:
+                if callable(done):
+                    done()
+        return linked
+
+    def advance_watermark(self, newest):
+        """moves the watermark up to the newest stored dt_updated"""
+        self.last_refresh = timezone.now()
+        flds = ['last_refresh']
+        if newest and (self.sync_watermark is None or
+                       self.sync_watermark < newest):
+            self.sync_watermark = newest
+            flds.append('sync_watermark')
+        self.save(update_fields=flds)
+
+    def sync(self, full=False):
+        """pulls this form's changed records, returning (new, updated)"""
+        return sync_forms([self], 1, full)[self.pk]
+
+
+class Form_Fields(models.Model):
+    pass
+
+
+class Survey_Record(models.Model):
+    work_order = models.ForeignKey(
+        ServiceOrder,
+        null=True,
+        on_delete=models.SET_NULL)
+    forms_id = models.CharField(
+        max_length=80,
+        null=True,
+        blank=True)
+    survey_form = models.ForeignKey(
+        Survey_Form,
+        on_delete=models.CASCADE)
+    wo_name = models.CharField(max_length=80)
+    last_update = models.DateTimeField(null=True)
+    nps = models.IntegerField(null=True)
+    nss_eodb = models.IntegerField(null=True)
+    nss_cc = models.IntegerField(null=True)
+    nss_fe = models.IntegerField(null=True)
+    nss_ftf = models.IntegerField(null=True)
+    nss_ttr = models.IntegerField(null=True)
+    gc_compare = models.IntegerField(null=True)
+    request_contact = models.BooleanField(default=False)
+    cust_comments = models.TextField(null=True)
+    survey_link = models.CharField(
+        null=True,
+        max_length=255)
+    # set on every write, so the snapshot finds relinked surveys too
+    modified = models.DateTimeField(
+        auto_now=True,
+        null=True,
+        db_index=True)
+
+    def __str__(self):
+        return self.wo_name
+
+    def find_filt(self):
+        return {
+            "field_id": WO_NAME_FIELD,
+            "operator": "eq",
+            "value": self.wo_name
+        }
+
+    def find_record(self):
+        access = self.survey_form.access
+        body = {
+            'offset': 0,
+            'limit': 499,
+            'fields': PLAN.request,
+            'filters': {
+                'and': self.find_filt()
+            },
+            'sort': {},
+            'case_sensitive': True
+        }
+        request_url = FORMS_API_URL
+        request_url += "forms/%s/records" % self.survey_form.form_id
+        return access.post(request_url, body)
@@ -1,10 +1,46 @@
 """Django models for the nps app"""
 import os
-import requests
+import time
+import logging
+import calendar
 import datetime
-from pydoc import locate
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
 from django.utils import timezone as dtz
+from django.utils.dateparse import parse_datetime
+from ..transport import SFTransport, API_VERSION, QueryError, stats_delta
+from ..recorder import SyncRecorder
+from .. import mapping
+from ..planner import LoadPlanner
+from ..bulk import BulkQuery, soql_text
+from ..fetcher import fetch_collection
+
+
+logger = logging.getLogger(__name__)
+
+# sent by upserts before a batch is written, with the keys of the rows
+# whose stored values it may change; a receiver may return a callable, which runs
+# once the batch is written, inside the same transaction
+rows_changing = Signal(providing_args=['keys', 'survey_form'])
+# sent once a DataMap refresh has stored all of its records and updated
+# last_refresh; receiver errors are logged, not raised
+datamap_refreshed = Signal(providing_args=['datamap', 'full'])
+
+
+def sf_datetime(dtm):
+    """formats a datetime as a SOQL literal in UTC"""
+    if dtz.is_naive(dtm):
+        dtm = dtz.make_aware(dtm)
+    return dtm.astimezone(dtz.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def add_months(dtm, months):
+    """same day and time a number of months later, clamped to month end"""
+    idx = dtm.year * 12 + dtm.month - 1 + months
+    year, month = idx // 12, idx % 12 + 1
+    day = min(dtm.day, calendar.monthrange(year, month)[1])
+    return dtm.replace(year=year, month=month, day=day)
 
 
 def proxies():
@@ -31,12 +67,25 @@ class ForceAPI(models.Model):
     access_token_url = models.CharField(
         max_length=255,
         default='https://login.salesforce.com/services/oauth2/token')
-    conn = None
+    token_lifetime = 7200
 
     def __str__(self):
         return self.user_id
 
-    def create_connection(self):
+    def transport(self):
+        """gets the pooled transport shared by this credential"""
+        key = (self.pk, self.user_id, self.access_token_url)
+        return SFTransport.for_key(key, proxies())
+
+    @property
+    def conn(self):
+        return self.transport().conn
+
+    def token_key(self):
+        """key of this credential in the shared token store"""
+        return 'force:%s:%s' % (self.pk, self.user_id)
+
+    def create_connection(self, refresh_token=None):
         """Creates API Connection"""
         data = {
             'grant_type': 'password',
@@ -45,23 +94,64 @@ class ForceAPI(models.Model):
             'username': self.user_id,
             'password': self.password
         }
+        if refresh_token:
+            data = {
+                'grant_type': 'refresh_token',
+                'client_id': self.consumer_key,
+                'client_secret': self.consumer_secret,
+                'refresh_token': refresh_token
+            }
         headers = {
             'content-type': 'application/x-www-form-urlencoded'
         }
-        if proxies():
-            req = requests.post(
-                self.access_token_url,
-                data=data,
-                headers=headers,
-                proxies=proxies())
-        else:
-            req = requests.post(
+        trn = self.transport()
+        with trn.lock:
+            req = trn.request(
+                'POST',
                 self.access_token_url,
                 data=data,
                 headers=headers)
-
-        self.conn = req.json()
-        return req.json()
+            cnn = req.json()
+            trn.logins += 1
+            if refresh_token and not('access_token' in cnn):
+                return self.create_connection()
+            if 'access_token' in cnn:
+                trn.conn = cnn
+                trn.conn_expires = self.token_expiry(cnn)
+            return cnn
+
+    def token_expiry(self, cnn):
+        """works out when a token response stops being valid"""
+        secs = int(cnn.get('expires_in') or self.token_lifetime)
+        issued = time.time()
+        if cnn.get('issued_at'):
+            issued = int(cnn['issued_at']) / 1000.0
+        # refresh a minute early rather than race the session timeout
+        return issued + secs - 60
+
+    def cached_connection(self):
+        """gets a still valid token another process stored, if any"""
+        tok = OAuthToken.objects.filter(key=self.token_key()).first()
+        if tok is None or not(tok.is_valid()):
+            return None
+        trn = self.transport()
+        trn.conn = tok.as_conn()
+        trn.conn_expires = tok.expires_ts()
+        return trn.conn
+
+    def refresh_connection(self):
+        """logs in once under the store's row lock and shares the token"""
+        key = self.token_key()
+        OAuthToken.objects.get_or_create(key=key)
+        with transaction.atomic():
+            tok = OAuthToken.objects.select_for_update().get(key=key)
+            if tok.is_valid():
+                # another worker logged in while this one waited
+                return self.cached_connection()
+            cnn = self.create_connection(tok.refresh_token)
+            if 'access_token' in cnn:
+                tok.store(cnn, self.transport().conn_expires)
+        return cnn
 
     def test_connection(self):
         """tests if connection is still working"""
@@ -70,28 +160,104 @@ class ForceAPI(models.Model):
                 'Authorization': 'Bearer ' + self.conn['access_token']
             }
             tsturl = self.conn['instance_url']
-            tsturl = tsturl + '/services/data/v37.0/sobjects'
-            tst = requests.get(tsturl, headers=tsthdr, proxies=proxies())
+            tsturl = tsturl + '/services/data/' + API_VERSION + '/sobjects'
+            tst = self.transport().request('GET', tsturl, headers=tsthdr)
             return tst.status_code == 200
 
         return False
 
     def get_connection(self):
         """gets a live connection to the REST API"""
-        if not self.test_connection():
-            return self.create_connection()
-        else:
-            return self.conn
+        trn = self.transport()
+        with trn.lock:
+            expd = trn.conn_expires is None or trn.conn_expires < time.time()
+            if trn.conn is None or expd:
+                return self.cached_connection() or self.refresh_connection()
+            return trn.conn
+
+    def invalidate_connection(self, cnn):
+        """drops a token the API has rejected"""
+        trn = self.transport()
+        with trn.lock:
+            if trn.conn is cnn:
+                trn.conn = None
+                trn.conn_expires = None
+            OAuthToken.objects.filter(
+                key=self.token_key(),
+                access_token=cnn.get('access_token')).update(expires=None)
+
+    def api_request(self, method, apifunction, version=None, **kwargs):
+        """sends an authorised request, logging in again once on a 401"""
+        trn = self.transport()
+        hdr = kwargs.pop('headers', {})
+        resp = None
+        for attempt in range(2):
+            cnn = self.get_connection()
+            hdr['Authorization'] = 'Bearer ' + cnn['access_token']
+            url = cnn['instance_url'] + '/services/data/'
+            url = url + (version or API_VERSION) + '/' + apifunction
+            resp = trn.request(method, url, headers=hdr, **kwargs)
+            if resp.status_code != 401:
+                break
+            self.invalidate_connection(cnn)
+        return resp
 
-    def get_data(self, apifunction):
+    def get_data(self, apifunction, headers=None):
         """gets data defined in the apifunction"""
-        cnn = self.get_connection()
-        hdr = {
-            'Authorization': 'Bearer ' + cnn['access_token']
+        hdr = dict(headers or {})
+        return self.api_request('GET', apifunction, headers=hdr).json()
+
+
+class OAuthToken(models.Model):
+    """Access token shared by every process using a credential"""
+    key = models.CharField(
+        max_length=255,
+        unique=True)
+    access_token = models.TextField(
+        null=True,
+        blank=True)
+    instance_url = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True)
+    refresh_token = models.TextField(
+        null=True,
+        blank=True)
+    expires = models.DateTimeField(
+        null=True,
+        blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.key
+
+    def is_valid(self):
+        """token is present and not past its expiry"""
+        if not(self.access_token) or self.expires is None:
+            return False
+        return self.expires > dtz.now()
+
+    def expires_ts(self):
+        """expiry as epoch seconds"""
+        if self.expires is None:
+            return None
+        return time.time() + (self.expires - dtz.now()).total_seconds()
+
+    def as_conn(self):
+        """token in the shape of the login response"""
+        return {
+            'access_token': self.access_token,
+            'instance_url': self.instance_url,
         }
-        url = cnn['instance_url'] + '/services/data/v37.0/' + apifunction
-        grs = requests.get(url, headers=hdr, proxies=proxies())
-        return grs.json()
+
+    def store(self, cnn, expires_ts):
+        """saves a fresh login response"""
+        self.access_token = cnn['access_token']
+        self.instance_url = cnn.get('instance_url')
+        self.refresh_token = cnn.get('refresh_token', self.refresh_token)
+        secs = expires_ts - time.time()
+        self.expires = dtz.now() + datetime.timedelta(seconds=secs)
+        self.save()
 
 
 class DataMap(models.Model):
@@ -104,44 +270,99 @@ class DataMap(models.Model):
     last_refresh = models.DateTimeField(
         null=True,
         blank=True)
+    max_concurrency = models.IntegerField(
+        default=4,
+        help_text='Concurrent API requests during a refresh')
+    sf_concurrency_limit = 25
 
     def __str__(self):
         return self.name
 
+    def concurrency(self):
+        """worker count kept within Salesforce's concurrent request limit"""
+        return max(1, min(self.max_concurrency, self.sf_concurrency_limit))
+
+    @staticmethod
+    def next_refresh(prefix='mapsched__'):
+        """aggregate of the earliest next_itr of schedules not yet ended"""
+        return models.Min(
+            prefix + 'next_itr',
+            filter=models.Q(**{prefix + 'end__isnull': True}) | models.Q(
+                **{prefix + 'next_itr__lte': models.F(prefix + 'end')}))
+
     def nxt_refresh(self):
-        rtn = None
-        for sched in self.mapsched_set.all():
-            ed = sched.next_itr if sched.end is None else sched.end
-            if not(sched.next_itr > ed):
-                snxt = sched.next_itr
-                if rtn is None:
-                    rtn = snxt
-                else:
-                    rtn = rtn if snxt < rtn else snxt
-        return rtn
+        if hasattr(self, 'nxt'):
+            # annotated by the queryset
+            return self.nxt
+        return self.mapsched_set.aggregate(
+            nxt=self.next_refresh(''))['nxt']
+
+    def iter_sf_recs(self, qs, batch_size=None):
+        """yields query results one page at a time
+
+        An error body, such as INVALID_FIELD, INVALID_QUERY_LOCATOR or
+        REQUEST_LIMIT_EXCEEDED, raises QueryError instead of ending the
+        results early.
+        """
+        hdr = {}
+        if batch_size:
+            size = min(max(batch_size, 200), 2000)
+            hdr['Sforce-Query-Options'] = 'batchSize=%d' % size
+        while qs:
+            resp = self.api_cred.api_request('GET', qs, headers=dict(hdr))
+            try:
+                req = resp.json()
+            except ValueError:
+                req = resp.text
+            ok = isinstance(req, dict) and 'records' in req
+            if resp.status_code != 200 or not(ok):
+                raise QueryError(resp.status_code, req)
+            recs = req['records']
+            step = batch_size or len(recs) or 1
+            for i in range(0, len(recs), step):
+                yield recs[i:i + step]
+            qs = None
+            if not(req['done']):
+                nxt = req['nextRecordsUrl']
+                qs = nxt.split('/services/data/' + API_VERSION + '/', 1)[-1]
 
     def sf_recs(self, qs):
         rtn = None
-        req = self.api_cred.get_data(qs)
-        if 'records' in req.keys():
-            rtn = req['records']
-            if not(req['done']):
-                nqs = req['nextRecordsUrl'][21:]
-                rtn.append(self.sf_recs(nqs))
+        for recs in self.iter_sf_recs(qs):
+            rtn = rtn or []
+            rtn.extend(recs)
         return rtn
 
-    def prime_obj(self):
-        moqs = self.mapobject_set.all()
-        prime = None
-        for mob in moqs:
-            if mob.is_master():
-                prime = mob
-        return prime   
-
-    def load_sf_data(self):
-        prime = self.prime_obj()
-        prime.load_obj()
+    def root_objs(self):
+        """objects no other object of the map depends on"""
+        return [mob for mob in self.mapobject_set.all() if mob.is_master()]
+
+    def load_sf_data(self, full=False):
+        mapping.invalidate(self.mapobject_set.values_list('pk', flat=True))
+        trn = self.api_cred.transport()
+        before = trn.stats()
+        recorder = SyncRecorder(trn)
+        run = self.syncrun_set.create(full=full)
+        try:
+            planner = LoadPlanner(self, recorder)
+            streams = []
+            for mob in self.root_objs():
+                batches, ordered = mob.extract(full=full)
+                streams.append((mob, batches, ordered))
+            planner.load_streams(streams)
+            planner.finish()
+        except Exception as exc:
+            run.finish(recorder, stats_delta(before, trn.stats()), exc)
+            raise
+        run.finish(recorder, stats_delta(before, trn.stats()))
         self.update_refresh()
+        # the data is stored, so a failing receiver must not fail the sync
+        for rcv, res in datamap_refreshed.send_robust(
+                sender=DataMap, datamap=self, full=full):
+            if isinstance(res, Exception):
+                logger.error(
+                    'datamap_refreshed receiver %r failed for %s',
+                    rcv, self, exc_info=res)
 
     def update_refresh(self):
         now = dtz.now()
@@ -154,7 +375,7 @@ class DataMap(models.Model):
                     nd = mo.last_refresh
         if nd > then:
             self.last_refresh = nd
-            self.save()
+            self.save(update_fields=['last_refresh'])
 
 
 class MapSched(models.Model):
@@ -181,6 +402,7 @@ class MapSched(models.Model):
         blank=True,
         editable=False,
         default=dtz.now)
+    modified = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         unt = [d for d in self.UNIT_OPTS if d[0] == self.freq_unit]
@@ -192,61 +414,79 @@ class MapSched(models.Model):
             unt,
             self.next_itr.isoformat())
 
-    def incr_opt(self, idt):
+    def incr_opt(self, idt, steps=1):
+        count = self.frequency * steps
         if self.freq_unit == 'HR':
-            hrs = self.frequency
-            return idt + datetime.timedelta(hours=hrs)
+            return idt + datetime.timedelta(hours=count)
         elif self.freq_unit == 'DY':
-            daze = self.frequency
-            return idt + datetime.timedelta(days=daze)
+            return idt + datetime.timedelta(days=count)
         elif self.freq_unit == 'WK':
-            wks = self.frequency
-            return idt + datetime.timedelta(days=wks)
+            return idt + datetime.timedelta(weeks=count)
         elif self.freq_unit == 'MO':
-            premonth = idt.month
-            nxtyear = idt.year
-            nxtmonth = premonth + self.frequency
-            while nxtmonth > 12:
-                nxtyear = nxtyear + 1
-                nxtmonth = nxtmonth - 12
-            return idt.replace(year=nxtyear, month=nxtmonth)
+            return add_months(idt, count)
         elif self.freq_unit == 'YR':
-            yr = idt.year + self.frequency
-            return idt.replace(year=yr)
+            return add_months(idt, 12 * count)
+
+    def first_itr(self):
+        """stored next iteration, never before the start"""
+        nxt = self.next_itr or self.start
+        return self.start if self.start > nxt else nxt
+
+    def next_after(self, now=None):
+        """first iteration at or after now, worked out without stepping"""
+        now = now or dtz.now()
+        nxt = self.first_itr()
+        if nxt >= now:
+            return nxt
+        step = self.incr_opt(nxt) - nxt
+        if step <= datetime.timedelta(0):
+            return now
+        if self.freq_unit in ('MO', 'YR'):
+            per = self.frequency * (12 if self.freq_unit == 'YR' else 1)
+            elapsed = (now.year - nxt.year) * 12 + now.month - nxt.month
+            steps = max(elapsed // per, 0)
+            while self.incr_opt(nxt, steps) < now:
+                steps += 1
+        else:
+            steps = -(-(now - nxt) // step)
+        return self.incr_opt(nxt, steps)
 
-    def is_due(self):
+    def due_time(self):
+        """when this schedule next wants its map refreshed"""
+        lstDone = self.data_map.last_refresh
+        if lstDone is None:
+            return self.start
+        exptd = self.incr_opt(lstDone)
+        nxt = self.first_itr()
+        exptd = nxt if exptd > nxt else exptd
+        return self.start if self.start > exptd else exptd
+
+    def is_active(self, now=None):
+        now = now or dtz.now()
         if not(self.end is None):
-            if self.end < dtz.now():
+            if self.end < now:
                 return False
-        if self.start > dtz.now():
+        return self.data_map.map_active
+
+    def is_due(self):
+        now = dtz.now()
+        if not(self.is_active(now)):
             return False
-        if not(self.data_map.map_active):
+        if self.start > now:
             return False
-        if self.next_itr is None:
-            self.next_itr = self.start
-            self.save()
-        if self.start > self.next_itr:
-            self.next_itr = self.start
-            self.save()
-        lstDone = self.data_map.last_refresh
-        if lstDone is None:
-            return True
-        exptd = self.incr_opt(lstDone)
-        if exptd > self.next_itr:
-            exptd = self.next_itr
-        return exptd < dtz.now()
+        return self.due_time() < now
 
     def increment_nxt(self):
-        if self.next_itr is None:
-            self.next_itr = self.start
-            self.save()
-        while self.next_itr < dtz.now():
-            self.next_itr = self.incr_opt(self.next_itr)
-            self.save()
+        self.next_itr = self.next_after()
+        self.save(update_fields=['next_itr'])
 
 
 class MapObject(models.Model):
     """Provides Objects for the DataMap"""
+    EXTRACTORS = (
+        ('AUTO', 'Automatic'),
+        ('REST', 'REST query'),
+        ('BULK', 'Bulk API 2.0'),)
     data_map = models.ForeignKey(
         DataMap,
         on_delete=models.CASCADE)
@@ -270,112 +510,138 @@ class MapObject(models.Model):
         null=True,
         blank=True,
         default=0)
-
-    def get_field(self, sf_api_name):
-        qs = self.mapfield_set.filter(sf_api_name=sf_api_name)
-        if qs.count() == 0:
-            return None
-        else:
-            return qs[0]
+    sync_watermark = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False)
+    extractor = models.CharField(
+        max_length=4,
+        choices=EXTRACTORS,
+        default='AUTO')
+    load_chunk_size = 2000
+    bulk_threshold = 50000
+    watermark_overlap = datetime.timedelta(minutes=5)
 
     def get_mapped(self):
-        locn = 'nps.models.' + self.dj_class
-        return locate(locn)
+        return mapping.locate_class(self.dj_class)
+
+    def plan(self):
+        """compiled field mapping of this object"""
+        return mapping.plan_for(self)
 
     def get_one(self, sfid):
         rtfilt = "Id='" + sfid + "'"
         return self.get_sf_recs(rtfilt)
 
+    def get_many(self, sfids):
+        """gets records by sfid through sObject Collections
+
+        Only the mapped fields are returned. Unlike get_one, the
+        object's MapFilters are not applied.
+        """
+        return fetch_collection(
+            self.data_map,
+            self.sf_api_name,
+            self.plan().select,
+            sfids,
+            self.data_map.concurrency())
+
+    def load_many(self, sfids):
+        """refreshes specific records and any missing parents"""
+        recs = self.get_many(sfids)
+        if recs:
+            self.load_recs(recs)
+        return len(recs)
+
     def get_sf_recs(self, rtfilt=None):
         qs = self.apiqs(rtfilt)
         resp = self.data_map.sf_recs(qs)
         return resp
 
-    def apply_map(self, rec):
-        rtn = {}
-        for key in rec:
-            mf = self.get_field(key)
-            if mf:
-                rtn[mf.dj_attr] = rec[key]
-        return rtn
+    def iter_sf_recs(self, rtfilt=None, batch_size=None, order=None):
+        """yields batches of query results without holding them all"""
+        qs = self.apiqs(rtfilt, order)
+        return self.data_map.iter_sf_recs(qs, batch_size)
 
-    def fkfields(self):
-        """check if any child objects"""
-        rtn = {}
-        rqs = self.mapfield_set.filter(sf_relation__isnull=False)
-        for mf in rqs:
-            rtn[mf.dj_attr] = mf
-        return rtn
-
-    def check_deps(self, rec):
-        rtn = {'rec': {}, 'ndd': {}}
-        for key, val in rec.items():
-            fks = self.fkfields()
-            if key in fks.keys() and not(val is None):
-                relobj = fks[key].sf_relation.get_mapped()
-                luqs = relobj.objects.filter(sfid=val)
-                if luqs.count() == 0:
-                    djc = fks[key].sf_relation.dj_class
-                    rtn['ndd'][djc] = val
-                else:
-                    rtn['rec'][key] = luqs[0]
-            else:
-                rtn['rec'][key] = val
-        return rtn
+    def apply_map(self, rec):
+        return self.plan().apply(rec)
 
-    def is_newer(self, frec, rqs):
-        try:
-            nd = frec['systemmodstamp']
-            cqs = rqs.filter(systemmodstamp__lt=nd)
-            return cqs.count() > 0
-        except:
+    def is_newer(self, frec, cur):
+        """check if a mapped record is newer than the stored modstamp"""
+        nd = frec.get('systemmodstamp')
+        if nd is None:
             return False
+        if cur is None:
+            return True
+        if not(isinstance(nd, datetime.datetime)):
+            nd = parse_datetime(nd)
+            if nd is None:
+                return False
+        if dtz.is_aware(nd) and dtz.is_naive(cur):
+            nd = dtz.make_naive(nd)
+        return cur < nd
+
+    def upsert_recs(self, frecs, klass=None):
+        """inserts new and updates newer rows in a single transaction"""
+        klass = klass or self.get_mapped()
+        latest = {}
+        for frec in frecs:
+            latest[frec['sfid']] = frec
+        with transaction.atomic():
+            cur = dict(klass.objects.filter(
+                sfid__in=list(latest)).values_list('sfid', 'systemmodstamp'))
+            new = []
+            changed = {}
+            for sfid, frec in latest.items():
+                if not(sfid in cur):
+                    new.append(klass(**frec))
+                elif self.is_newer(frec, cur[sfid]):
+                    flds = tuple(sorted(k for k in frec if k != 'sfid'))
+                    changed.setdefault(flds, []).append(klass(**frec))
+            keys = [obj.sfid for objs in changed.values() for obj in objs]
+            after = []
+            if keys:
+                after = rows_changing.send(sender=klass, keys=keys)
+            if new:
+                klass.objects.bulk_create(new)
+            for flds, objs in changed.items():
+                klass.objects.bulk_update(objs, flds)
+            for rcv, done in after:
+                if callable(done):
+                    done()
+        return len(new), sum(len(objs) for objs in changed.values())
+
+    def load_recs(self, recs, chunk_size=None):
+        """loads records and any missing parents, parents first"""
+        planner = LoadPlanner(self.data_map)
+        planner.load(self, recs, chunk_size)
+        planner.finish()
+
+    def set_stats(self, inserted=None):
+        """stamps the refresh and counts rows a load inserted"""
+        self.set_refreshed()
+        if inserted is None:
+            self.set_rec_ct()
+        else:
+            self.add_rec_ct(inserted)
 
-    def load_recs(self, recs, ct=0):
-        if ct > 900:
+    def add_rec_ct(self, count):
+        """moves record_count by a row delta without counting the table"""
+        if not(count):
             return
-        need_deps = {}
-        deferred = []
-        klass = self.get_mapped()
-        for rec in recs:
-            frec = self.apply_map(rec)
-            deps = self.check_deps(frec)
-            if deps['ndd']:
-                for key, val in deps['ndd'].items():
-                    if not(key in need_deps.keys()):
-                        need_deps[key] = []
-                    if not(val in need_deps[key]):
-                        need_deps[key].append(val)
-                    deferred.append(rec)
-            elif 'sfid' in deps['rec'].keys():
-                rqs = klass.objects.filter(sfid=deps['rec']['sfid'])
-                if rqs.count() == 0:
-                    nr = klass.objects.create(**deps['rec'])
-                    nr.save()
-                elif self.is_newer(deps['rec'], rqs):
-                    rqs.update(**deps['rec'])
-        for key, val in need_deps.items():
-            ids = val[:249]
-            rtfilt = "Id+in+('" + "','".join(ids) + "')"
-            relqs = self.data_map.mapobject_set.filter(dj_class=key)
-            relmo = relqs[0]
-            drecs = relmo.get_sf_recs(rtfilt)
-            relmo.load_recs(drecs)
-        if len(deferred) > 0:
-            self.load_recs(deferred, ct+1)
-        self.set_stats()
-
-    def set_stats(self):
-        self.set_refreshed()
-        self.set_rec_ct()
+        MapObject.objects.filter(pk=self.pk).update(
+            record_count=Coalesce(models.F('record_count'), 0) + count)
+        self.record_count = (self.record_count or 0) + count
 
     def set_rec_ct(self):
+        """counts the table and stores it, returning the drift found"""
         mo = self.get_mapped()
         ct = mo.objects.all().count()
-        cur = self.record_count or 0
-        if cur < ct:
+        drift = ct - (self.record_count or 0)
+        if drift or self.record_count is None:
             self.record_count = ct
-            self.save()
+            self.save(update_fields=['record_count'])
+        return drift
 
     def set_refreshed(self):
         now = dtz.now()
@@ -383,18 +649,77 @@ class MapObject(models.Model):
         cur = self.last_refresh or then
         if cur < now:
             self.last_refresh = now
-            self.save()
-
-    def load_obj(self):
-        recs = self.get_sf_recs()
-        self.load_recs(recs)
+            self.save(update_fields=['last_refresh'])
+
+    def modstamp_field(self):
+        """SF name of the field mapped to systemmodstamp, if any"""
+        for sfname, attr in self.plan().fields.items():
+            if attr == 'systemmodstamp':
+                return sfname
+        return None
+
+    def delta_filter(self):
+        """where clause limiting a query to rows past the watermark"""
+        sfname = self.modstamp_field()
+        if sfname is None or self.sync_watermark is None:
+            return None
+        since = self.sync_watermark - self.watermark_overlap
+        return sfname + '>' + sf_datetime(since)
+
+    def newest_stamp(self, recs):
+        """latest modstamp among raw records"""
+        sfname = self.modstamp_field()
+        stamps = [parse_datetime(rec[sfname]) for rec in recs
+                  if sfname and rec.get(sfname)]
+        stamps = [stamp for stamp in stamps if stamp is not None]
+        return max(stamps) if stamps else None
+
+    def advance_watermark(self, newest):
+        """moves the watermark up to the newest stored modstamp"""
+        if newest is None:
+            return
+        if self.sync_watermark is None or self.sync_watermark < newest:
+            self.sync_watermark = newest
+            self.save(update_fields=['sync_watermark'])
+
+    def count_sf_recs(self, rtfilt=None):
+        """number of records a query would return"""
+        qs = self.apiqs(rtfilt, select=['COUNT()'])
+        req = self.data_map.api_cred.get_data(qs)
+        if isinstance(req, dict):
+            return req.get('totalSize', 0)
+        return 0
+
+    def use_bulk(self, rtfilt=None):
+        """check if this extract should run as a Bulk API job"""
+        if self.extractor == 'AUTO':
+            return self.count_sf_recs(rtfilt) >= self.bulk_threshold
+        return self.extractor == 'BULK'
+
+    def iter_bulk_recs(self, rtfilt=None, batch_size=2000):
+        """yields batches of records from a Bulk API 2.0 query job"""
+        job = BulkQuery(self.data_map.api_cred, soql_text(self.apiqs(rtfilt)))
+        return job.iter_batches(batch_size)
+
+    def extract(self, batch_size=2000, full=False):
+        """starts the extract of a load, returning batches and if ordered"""
+        rtfilt = None if full else self.delta_filter()
+        if self.use_bulk(rtfilt):
+            return self.iter_bulk_recs(rtfilt, batch_size), False
+        batches = self.iter_sf_recs(
+            rtfilt, batch_size, order=self.modstamp_field())
+        return batches, True
+
+    def load_obj(self, batch_size=2000, full=False):
+        """loads the object, only rows changed since the last run unless full"""
+        planner = LoadPlanner(self.data_map)
+        batches, ordered = self.extract(batch_size, full)
+        planner.load_streams([(self, batches, ordered)])
+        planner.finish()
 
     def apiqsw(self, rtfilt=None):
         """Returns Where Clause of query"""
-        fqs = self.mapfield_set.all()
-        fltrs = []
-        for fld in fqs:
-            fltrs.extend([flt.fltr_txt() for flt in fld.mapfilter_set.all()])
+        fltrs = self.plan().where()
         if rtfilt:
             fltrs.append(rtfilt)
         if (len(fltrs) > 0):
@@ -402,10 +727,11 @@ class MapObject(models.Model):
         else:
             return None
 
-    def apiqs(self, rtfilt=None):
+    def apiqs(self, rtfilt=None, order=None, select=None):
         """Returns Query for api"""
-        fqs = self.mapfield_set.all()
-        selflds = [fld.sf_api_name for fld in fqs]
+        selflds = select
+        if selflds is None:
+            selflds = self.plan().select
         qlist = [
             'query?q=SELECT',
             ','.join(selflds),
@@ -415,6 +741,9 @@ class MapObject(models.Model):
         if whc:
             qlist.append('WHERE')
             qlist.append(whc)
+        if order:
+            qlist.append('ORDER+BY')
+            qlist.append(order)
         return "+".join(qlist)
 
     def is_master(self):
@@ -493,41 +822,39 @@ class MapFilter(models.Model):
         null=True,
         blank=True)
 
-    def delta_days_logic(self):
+    def is_dynamic(self):
+        """check if the filter text depends on the time it is rendered"""
+        return self.logic == 'DELTAxDAYS' and self.logic_param is not None
+
+    def delta_days_logic(self, now=None):
         """Creates delta_days logical filter at runtime"""
-        valid = (MapFilter.objects.filter(
-            logic='DELTAxDAYS',
-            logic_param__isnull=False,
-            pk=self.pk).count() == 1)
         rtn = None
-        if valid:
-            curdt = dtz.now()
+        if self.is_dynamic():
+            curdt = now or dtz.now()
             tmd = datetime.timedelta(days=self.logic_param)
             fdt = curdt + tmd
-            sdt = fdt.isoformat().split('+')[0][0:-3] + 'Z'
             rtn = self.map_field.sf_api_name
-            rtn = rtn + self.operator + sdt
+            rtn = rtn + self.operator + sf_datetime(fdt)
         return rtn
 
-    def fld_comp_logic(self):
+    def fld_comp_logic(self, fields=None):
         """Creates field comparison logical filter"""
-        valid = (MapFilter.objects.filter(
-            logic='FLDCMPR',
-            logic_param__isnull=False,
-            pk=self.pk).count() == 1)
         rtn = None
-        if valid:
-            cfld = MapField.objects.get(pk=self.logic_param)
+        if self.logic == 'FLDCMPR' and self.logic_param is not None:
+            if fields is None:
+                cfld = MapField.objects.get(pk=self.logic_param)
+            else:
+                cfld = fields[self.logic_param]
             rtn = self.map_field.sf_api_name
             rtn = rtn + self.operator
             rtn = rtn + cfld.sf_api_name
         return rtn
 
-    def fltr_txt(self):
+    def fltr_txt(self, fields=None, now=None):
         """generates filter text for API call"""
-        rtn = self.delta_days_logic()
+        rtn = self.delta_days_logic(now)
         if not(rtn):
-            rtn = self.fld_comp_logic()
+            rtn = self.fld_comp_logic(fields)
             if not(rtn):
                 rtn = self.map_field.sf_api_name
                 rtn = rtn + self.operator
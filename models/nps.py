@@ -101,6 +101,12 @@ class ServiceGroupMembers(CommonInfo):
 
 class ServiceOrder(CommonInfo):
     """Copy of SF work order Object"""
+    # surveys find their work order by name
+    name = models.CharField(
+        max_length=80,
+        null=True,
+        blank=True,
+        db_index=True)
     binder_date_acknowledged_c = models.DateField(
         null=True,
         blank=True)
@@ -0,0 +1,78 @@
+"""Precomputed NPS aggregates"""
+from django.db import models
+from .nps import ServiceGroupMembers
+
+
+class NPSRollup(models.Model):
+    """Survey counts and score sums of one reporting bucket"""
+    region = models.CharField(
+        max_length=80,
+        null=True,
+        blank=True)
+    subregion = models.CharField(
+        max_length=80,
+        null=True,
+        blank=True)
+    technician = models.ForeignKey(
+        ServiceGroupMembers,
+        null=True,
+        blank=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False)
+    order_type = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True)
+    month = models.DateField(
+        null=True,
+        blank=True)
+    responses = models.IntegerField(default=0)
+    promoters = models.IntegerField(default=0)
+    passives = models.IntegerField(default=0)
+    detractors = models.IntegerField(default=0)
+    nss_eodb_sum = models.IntegerField(default=0)
+    nss_eodb_ct = models.IntegerField(default=0)
+    nss_cc_sum = models.IntegerField(default=0)
+    nss_cc_ct = models.IntegerField(default=0)
+    nss_fe_sum = models.IntegerField(default=0)
+    nss_fe_ct = models.IntegerField(default=0)
+    nss_ftf_sum = models.IntegerField(default=0)
+    nss_ftf_ct = models.IntegerField(default=0)
+    nss_ttr_sum = models.IntegerField(default=0)
+    nss_ttr_ct = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (
+            ('region', 'subregion', 'technician', 'order_type', 'month'),)
+        index_together = (('month', 'region'),)
+
+    def __str__(self):
+        return '%s/%s %s %s' % (
+            self.region, self.subregion, self.order_type, self.month)
+
+    def nps(self):
+        """promoter share less detractor share, as a percentage"""
+        rated = self.promoters + self.passives + self.detractors
+        if not(rated):
+            return None
+        return round(100.0 * (self.promoters - self.detractors) / rated, 1)
+
+    def nss(self, metric):
+        """mean of one nss_* score over the surveys that answered it"""
+        cnt = getattr(self, metric + '_ct')
+        if not(cnt):
+            return None
+        return round(float(getattr(self, metric + '_sum')) / cnt, 2)
+
+
+class RollupState(models.Model):
+    """Single row rollup writers lock so that they take turns"""
+    SINGLETON = 1
+    rebuilt = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False)
+
+    def __str__(self):
+        return 'rollup state'
@@ -0,0 +1,95 @@
+"""Telemetry of DataMap refreshes"""
+from django.db import models
+from django.utils import timezone as dtz
+
+
+class SyncRun(models.Model):
+    """One refresh of a DataMap from SalesForce"""
+    STATUS_OPTS = (
+        ('RUN', 'Running'),
+        ('OK', 'Completed'),
+        ('ERR', 'Failed'),)
+    data_map = models.ForeignKey(
+        'DataMap',
+        on_delete=models.CASCADE)
+    started = models.DateTimeField(default=dtz.now)
+    finished = models.DateTimeField(
+        null=True,
+        blank=True)
+    full = models.BooleanField(default=False)
+    status = models.CharField(
+        max_length=3,
+        choices=STATUS_OPTS,
+        default='RUN')
+    requests = models.IntegerField(default=0)
+    handshakes = models.IntegerField(default=0)
+    logins = models.IntegerField(default=0)
+    bytes = models.BigIntegerField(default=0)
+    error = models.TextField(
+        null=True,
+        blank=True)
+
+    class Meta:
+        ordering = ['-started']
+
+    def __str__(self):
+        return '%s: %s' % (self.data_map.name, self.started.isoformat())
+
+    def duration(self):
+        """wall time of the refresh in seconds"""
+        if self.finished is None:
+            return None
+        return (self.finished - self.started).total_seconds()
+
+    def finish(self, recorder, used, error=None):
+        """stores the run totals and one SyncPhase per object"""
+        self.finished = dtz.now()
+        self.status = 'OK' if error is None else 'ERR'
+        self.error = None if error is None else repr(error)
+        for key in ('requests', 'handshakes', 'logins', 'bytes'):
+            setattr(self, key, used.get(key, 0))
+        self.save()
+        mos = dict(
+            (mo.dj_class, mo) for mo in self.data_map.mapobject_set.all())
+        phases = []
+        for djc, counts in recorder.phases.items():
+            phases.append(SyncPhase(
+                sync_run=self,
+                map_object=mos.get(djc),
+                dj_class=djc,
+                **counts))
+        SyncPhase.objects.bulk_create(phases)
+
+
+class SyncPhase(models.Model):
+    """Timings and row counts of one MapObject within a SyncRun"""
+    sync_run = models.ForeignKey(
+        SyncRun,
+        on_delete=models.CASCADE)
+    map_object = models.ForeignKey(
+        'MapObject',
+        null=True,
+        on_delete=models.SET_NULL)
+    dj_class = models.CharField(max_length=40)
+    http_time = models.FloatField(default=0)
+    bytes = models.BigIntegerField(default=0)
+    pages = models.IntegerField(default=0)
+    map_time = models.FloatField(default=0)
+    db_time = models.FloatField(default=0)
+    records = models.IntegerField(default=0)
+    inserted = models.IntegerField(default=0)
+    updated = models.IntegerField(default=0)
+    skipped = models.IntegerField(default=0)
+
+    def __str__(self):
+        return self.dj_class
+
+    def busy_time(self):
+        return self.http_time + self.map_time + self.db_time
+
+    def records_per_sec(self):
+        """records stored per second spent on this object"""
+        busy = self.busy_time()
+        if not(busy):
+            return None
+        return round(self.records / busy, 1)
@@ -0,0 +1,261 @@
+"""Dependency ordered loading of a DataMap's object graph"""
+import time
+from django.db import transaction
+from .mapping import locate_class
+from .workers import merge_streams
+from .fetcher import pack_ids, fetch_queries
+from .recorder import SyncRecorder
+
+
+MAX_ROUNDS = 50
+
+
+class PlanError(Exception):
+    """raised when the parents of a batch cannot be resolved"""
+
+
+class LoadPlanner(object):
+    """Loads MapObjects of a DataMap parents first
+
+    The graph comes from MapField.sf_relation. Edges that close a cycle,
+    such as SFUser.manager, are deferred: those FKs are left out of the
+    first write and set in a second pass once every row exists.
+
+    A FK is only stored as NULL when its parent is known to be absent:
+    Salesforce answered the lookup without the row, or the parent class
+    is not mapped. A failed lookup raises, so the batch is not written.
+    """
+
+    def __init__(self, datamap, recorder=None):
+        self.datamap = datamap
+        self.recorder = recorder or SyncRecorder()
+        self.by_class = {}
+        for mo in datamap.mapobject_set.all():
+            self.by_class.setdefault(mo.dj_class, mo)
+        self.parents = {}
+        for djc, mo in self.by_class.items():
+            self.parents[djc] = dict(
+                (attr, fk.relation.dj_class)
+                for attr, fk in mo.plan().fks.items())
+        self.order, self.deferred = self.toposort()
+        self.workers = datamap.concurrency()
+        self.touched = set()
+        self.inserted = {}
+
+    def toposort(self):
+        """parents first order of classes and the FKs deferred by cycles"""
+        deferred = dict((djc, set()) for djc in self.by_class)
+        deps = {}
+        for djc, fks in self.parents.items():
+            deps[djc] = set()
+            for attr, pdjc in fks.items():
+                if pdjc == djc:
+                    deferred[djc].add(attr)
+                elif pdjc in self.by_class:
+                    deps[djc].add(pdjc)
+        order = []
+        while deps:
+            free = sorted(djc for djc, pds in deps.items() if not(pds))
+            if not(free):
+                # break a cycle by deferring one class's FKs into it
+                djc = sorted(deps)[0]
+                for attr, pdjc in self.parents[djc].items():
+                    if pdjc in deps[djc]:
+                        deferred[djc].add(attr)
+                deps[djc] = set()
+                continue
+            for djc in free:
+                order.append(djc)
+                del deps[djc]
+            for pds in deps.values():
+                pds.difference_update(free)
+        return order, deferred
+
+    def fetch_all(self, wanted):
+        """gets mapped parent records of every class by sfid
+
+        Ids are packed into as few IN queries as the URL length allows,
+        and the queries go out in composite batches run in parallel.
+        """
+        tasks = []
+        for djc, ids in wanted.items():
+            mo = self.by_class[djc]
+            for qs in pack_ids(mo.apiqs, ids):
+                tasks.append((djc, qs))
+        start = time.perf_counter()
+        results = fetch_queries(
+            self.datamap, [qs for djc, qs in tasks], self.workers)
+        elapsed = time.perf_counter() - start
+        for djc, qs in tasks:
+            # queries of several classes share batches, so split evenly
+            self.recorder.add(djc, http_time=elapsed / len(tasks))
+        byid = {}
+        for (djc, qs), recs in zip(tasks, results):
+            rows = byid.setdefault(djc, {})
+            for rec in recs:
+                rows[rec.get('Id')] = rec
+        rtn = {}
+        for djc, rows in byid.items():
+            plan = self.by_class[djc].plan()
+            with self.recorder.timed(djc, 'map_time'):
+                rtn[djc] = [plan.apply(rec) for rec in rows.values()]
+        return rtn
+
+    def load(self, mapobj, recs, chunk_size=None):
+        """loads records of mapobj together with every missing parent"""
+        plan = mapobj.plan()
+        staged = {}
+        known = {}
+        asked = {}
+        absent = {}
+        with self.recorder.timed(mapobj.dj_class, 'map_time'):
+            pending = {mapobj.dj_class: [plan.apply(rec) for rec in recs]}
+        rounds = 0
+        while pending and rounds < MAX_ROUNDS:
+            rounds += 1
+            wanted = {}
+            for djc, frecs in pending.items():
+                rows = staged.setdefault(djc, {})
+                for frec in frecs:
+                    if frec.get('sfid'):
+                        rows[frec['sfid']] = frec
+                        known.setdefault(djc, set()).add(frec['sfid'])
+                for attr, pdjc in self.parents.get(djc, {}).items():
+                    for frec in frecs:
+                        val = frec.get(attr)
+                        if val is not None:
+                            wanted.setdefault(pdjc, set()).add(val)
+            fetch = {}
+            for pdjc, ids in wanted.items():
+                ids = ids - known.setdefault(pdjc, set())
+                ids = ids - asked.setdefault(pdjc, set())
+                if not(ids):
+                    continue
+                asked[pdjc].update(ids)
+                klass = locate_class(pdjc)
+                with self.recorder.timed(pdjc, 'db_time'):
+                    found = set(klass.objects.filter(
+                        sfid__in=list(ids)).values_list('sfid', flat=True))
+                known[pdjc].update(found)
+                ids = ids - found
+                if not(ids):
+                    continue
+                if pdjc in self.by_class:
+                    fetch[pdjc] = ids
+                else:
+                    absent.setdefault(pdjc, set()).update(ids)
+            pending = self.fetch_all(fetch)
+            for pdjc, ids in fetch.items():
+                got = set(frec.get('sfid') for frec in pending.get(pdjc, []))
+                absent.setdefault(pdjc, set()).update(ids - got)
+        if any(pending.values()):
+            raise PlanError(
+                'parents of %s still missing after %d rounds' % (
+                    mapobj.dj_class, MAX_ROUNDS))
+        self.write(staged, known, absent, chunk_size)
+
+    def write(self, staged, known, absent, chunk_size=None):
+        """upserts staged rows parents first, then the deferred FKs
+
+        FKs to parents in absent are stored as NULL. Any other parent
+        must be in known.
+        """
+        second = {}
+        for djc in self.order:
+            frecs = list(staged.get(djc, {}).values())
+            if not(frecs):
+                continue
+            mo = self.by_class[djc]
+            fks = mo.plan().fks
+            rows = []
+            for frec in frecs:
+                row = dict(frec)
+                for attr, fk in fks.items():
+                    if not(attr in row):
+                        continue
+                    val = row.pop(attr)
+                    if val is not None and attr in self.deferred[djc]:
+                        second.setdefault(djc, []).append(
+                            (row['sfid'], fk.attname, val))
+                        continue
+                    pdjc = fk.relation.dj_class
+                    if val is not None and not(val in known.get(pdjc, ())):
+                        if not(val in absent.get(pdjc, ())):
+                            raise PlanError(
+                                '%s %s: parent %s %s was not looked up' % (
+                                    djc, row.get('sfid'), pdjc, val))
+                        val = None
+                    row[fk.attname] = val
+                rows.append(row)
+            size = chunk_size or mo.load_chunk_size
+            for i in range(0, len(rows), size):
+                chunk = rows[i:i + size]
+                with self.recorder.timed(djc, 'db_time'):
+                    new, changed = mo.upsert_recs(chunk)
+                self.inserted[djc] = self.inserted.get(djc, 0) + new
+                self.recorder.add(
+                    djc,
+                    records=len(chunk),
+                    inserted=new,
+                    updated=changed,
+                    skipped=len(chunk) - new - changed)
+            self.touched.add(djc)
+        for djc, links in second.items():
+            with self.recorder.timed(djc, 'db_time'):
+                self.link(djc, links)
+
+    def link(self, djc, links):
+        """sets deferred FKs whose target rows exist"""
+        klass = self.by_class[djc].get_mapped()
+        targets = {}
+        for sfid, attname, val in links:
+            targets.setdefault(attname, []).append((sfid, val))
+        for attname, pairs in targets.items():
+            fld = klass._meta.get_field(attname)
+            rel = fld.related_model
+            vals = set(val for sfid, val in pairs)
+            found = set(rel.objects.filter(
+                sfid__in=list(vals)).values_list('sfid', flat=True))
+            objs = [
+                klass(**{'sfid': sfid, attname: val})
+                for sfid, val in pairs if val in found]
+            with transaction.atomic():
+                klass.objects.bulk_update(objs, [attname])
+
+    def load_streams(self, streams):
+        """loads record batches of several extracts as they arrive
+
+        streams is a list of (mapobj, batches, ordered) tuples. Ordered
+        extracts move their watermark after every stored batch, unordered
+        ones once their last batch is stored.
+        """
+        mos = dict((mo.pk, (mo, ordered)) for mo, batches, ordered in streams)
+        newest = {}
+        merged = merge_streams(
+            [(mo.pk, self.recorder.timed_batches(mo.dj_class, batches))
+             for mo, batches, ordered in streams],
+            self.workers)
+        try:
+            for pk, recs, done in merged:
+                mo, ordered = mos[pk]
+                if done:
+                    mo.advance_watermark(newest.get(pk))
+                    self.touched.add(mo.dj_class)
+                    continue
+                self.load(mo, recs)
+                stamp = mo.newest_stamp(recs)
+                if ordered:
+                    mo.advance_watermark(stamp)
+                elif stamp and (
+                        newest.get(pk) is None or newest[pk] < stamp):
+                    newest[pk] = stamp
+        finally:
+            # stops the extract threads if a batch failed to load
+            merged.close()
+
+    def finish(self):
+        """records refresh stats on every object that was written"""
+        for djc in self.touched:
+            self.by_class[djc].set_stats(self.inserted.get(djc, 0))
+        self.touched = set()
+        self.inserted = {}
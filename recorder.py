@@ -0,0 +1,56 @@
+"""Timing and throughput counters for a DataMap refresh"""
+import time
+import threading
+from contextlib import contextmanager
+
+
+COUNTERS = (
+    'http_time', 'bytes', 'pages', 'map_time', 'db_time',
+    'records', 'inserted', 'updated', 'skipped')
+
+
+class SyncRecorder(object):
+    """Per-object counters of one refresh, safe to update from threads"""
+
+    def __init__(self, transport=None):
+        self.transport = transport
+        self.phases = {}
+        self.lock = threading.Lock()
+
+    def add(self, key, **counts):
+        with self.lock:
+            phase = self.phases.setdefault(key, dict.fromkeys(COUNTERS, 0))
+            for name, val in counts.items():
+                phase[name] += val
+
+    @contextmanager
+    def timed(self, key, name):
+        """adds the time spent in the block to one counter"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(key, **{name: time.perf_counter() - start})
+
+    def thread_bytes(self):
+        if self.transport is None:
+            return 0
+        return self.transport.thread_bytes()
+
+    def timed_batches(self, key, batches):
+        """wraps an extract, counting pages and the time spent fetching"""
+        batches = iter(batches)
+        while True:
+            start = time.perf_counter()
+            read = self.thread_bytes()
+            try:
+                recs = next(batches)
+            except StopIteration:
+                self.add(key, http_time=time.perf_counter() - start)
+                return
+            self.add(
+                key,
+                http_time=time.perf_counter() - start,
+                bytes=self.thread_bytes() - read,
+                pages=1)
+            yield recs
@@ -0,0 +1,186 @@
+"""Building the NPSRollup aggregates from survey rows"""
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone as dtz
+from .models import NPSRollup, RollupState, Survey_Record
+
+
+# Survey_Record.nps is only filled once NPS_FORM_FIELD is configured,
+# see surveys.survey_fields
+PROMOTER = 9
+PASSIVE = 7
+METRICS = ('nss_eodb', 'nss_cc', 'nss_fe', 'nss_ftf', 'nss_ttr')
+COUNTERS = ('responses', 'promoters', 'passives', 'detractors') + tuple(
+    metric + suffix for metric in METRICS for suffix in ('_sum', '_ct'))
+
+# rollup key, Survey_Record lookup it is grouped on
+KEYS = (
+    ('region', 'work_order__svmxc_company_c__global_region_c'),
+    ('subregion', 'work_order__svmxc_company_c__global_subregion_c'),
+    ('technician_id', 'work_order__svmxc_group_member_c'),
+    ('order_type', 'work_order__svmxc_order_type_c'),
+    ('month', 'rollup_month'),
+)
+
+
+def month_of():
+    """month a survey reports in, its order's completion if known"""
+    return TruncMonth(
+        Coalesce('work_order__svmxc_completed_date_time_c', 'last_update'),
+        output_field=models.DateField())
+
+
+def bucket_counts():
+    """aggregates of one rollup bucket over Survey_Record rows"""
+    rtn = {
+        'responses': models.Count('pk'),
+        'promoters': models.Count(
+            'pk', filter=models.Q(nps__gte=PROMOTER)),
+        'passives': models.Count(
+            'pk', filter=models.Q(nps__gte=PASSIVE, nps__lt=PROMOTER)),
+        'detractors': models.Count(
+            'pk', filter=models.Q(nps__lt=PASSIVE)),
+    }
+    for metric in METRICS:
+        rtn[metric + '_sum'] = Coalesce(models.Sum(metric), 0)
+        rtn[metric + '_ct'] = models.Count(metric)
+    return rtn
+
+
+def aggregate(qs):
+    """rollup rows, as dicts keyed like NPSRollup, over a survey queryset"""
+    rows = qs.annotate(rollup_month=month_of()).values(
+        *[lookup for key, lookup in KEYS]).annotate(
+            **bucket_counts()).order_by()
+    rtn = []
+    for row in rows:
+        for key, lookup in KEYS:
+            row[key] = row.pop(lookup)
+        rtn.append(row)
+    return rtn
+
+
+def rebuild(batch_size=1000):
+    """replaces every rollup row with totals computed from scratch
+
+    The rebuild time is stored, so cached metrics are not served past it.
+    """
+    with transaction.atomic():
+        state = lock_buckets()
+        rows = aggregate(Survey_Record.objects.all())
+        NPSRollup.objects.all().delete()
+        NPSRollup.objects.bulk_create(
+            [NPSRollup(**row) for row in rows], batch_size=batch_size)
+        state.rebuilt = dtz.now()
+        state.save(update_fields=['rebuilt'])
+    return len(rows)
+
+
+def rebuilt():
+    """time of the last rebuild, None if there has been none"""
+    state = RollupState.objects.filter(pk=RollupState.SINGLETON).first()
+    return state.rebuilt if state else None
+
+
+def maintained():
+    """check if the rollups hold totals that deltas can be applied to
+
+    An empty table next to existing surveys has never been built, and
+    deltas alone would leave it with partial or negative counts.
+    """
+    return (NPSRollup.objects.exists() or
+            not(Survey_Record.objects.exists()))
+
+
+def bucket_key(row):
+    return tuple(row[key] for key, lookup in KEYS)
+
+
+def lock_buckets():
+    """keeps other rollup writers out until the transaction ends
+
+    unique_together does not stop a second row with the same key when a
+    key column is NULL, and a gap lock cannot be relied on either, so
+    two syncs adding the same bucket could both insert it. Writers lock
+    the RollupState row first instead, which works on every backend.
+    """
+    RollupState.objects.get_or_create(pk=RollupState.SINGLETON)
+    return RollupState.objects.select_for_update().get(
+        pk=RollupState.SINGLETON)
+
+
+def apply_delta(before, after):
+    """adds after less before to the rollup rows, returning rows touched
+
+    Runs inside a transaction, which holds the lock on the rollups.
+    """
+    deltas = {}
+    for sign, rows in ((-1, before), (1, after)):
+        for row in rows:
+            acc = deltas.setdefault(
+                bucket_key(row), dict.fromkeys(COUNTERS, 0))
+            for name in COUNTERS:
+                acc[name] += sign * row[name]
+    deltas = dict(
+        (key, acc) for key, acc in deltas.items() if any(acc.values()))
+    if not(deltas):
+        return 0
+    lock_buckets()
+    names = [key for key, lookup in KEYS]
+    match = models.Q()
+    for key in deltas:
+        match |= models.Q(**dict(zip(names, key)))
+    changed = []
+    dropped = []
+    for row in NPSRollup.objects.select_for_update().filter(match):
+        acc = deltas.pop(bucket_key(row.__dict__), None)
+        if acc is None:
+            continue
+        for name, val in acc.items():
+            setattr(row, name, getattr(row, name) + val)
+        if row.responses > 0:
+            changed.append(row)
+        else:
+            dropped.append(row.pk)
+    NPSRollup.objects.bulk_update(changed, COUNTERS)
+    NPSRollup.objects.filter(pk__in=dropped).delete()
+    NPSRollup.objects.bulk_create([
+        NPSRollup(**dict(zip(names, key), **acc))
+        for key, acc in deltas.items() if acc['responses'] > 0])
+    return len(changed) + len(dropped) + len(deltas)
+
+
+def tracker(qs):
+    """notes the rollup share of the surveys in qs before they change
+
+    Returns a callable that, once the changes are written, applies the
+    difference to the rollups. Work is bounded by the rows in qs.
+    """
+    if not(maintained()):
+        return None
+    before = aggregate(qs)
+
+    def apply():
+        with transaction.atomic():
+            apply_delta(before, aggregate(qs))
+    return apply
+
+
+def summarize(filters=None, group_by=()):
+    """summed rollup rows with their scores, grouped on some KEYS"""
+    qs = NPSRollup.objects.filter(**(filters or {}))
+    sums = dict((name, Coalesce(models.Sum(name), 0)) for name in COUNTERS)
+    if group_by:
+        rows = qs.values(*group_by).annotate(**sums).order_by(*group_by)
+    else:
+        rows = [qs.aggregate(**sums)]
+    rtn = []
+    for row in rows:
+        counts = dict((name, row.pop(name)) for name in COUNTERS)
+        bucket = NPSRollup(**counts)
+        row['responses'] = counts['responses']
+        row['nps'] = bucket.nps()
+        for metric in METRICS:
+            row[metric] = bucket.nss(metric)
+        rtn.append(row)
+    return rtn
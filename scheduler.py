@@ -0,0 +1,133 @@
+"""Long running scheduler dispatching DataMap refreshes"""
+import heapq
+import datetime
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.db.models import Count, Max
+from django.utils import timezone as dtz
+from .models import DataMap, MapSched
+from .workers import closing_db
+
+
+schedules_changed = threading.Event()
+
+
+class Scheduler(object):
+    """Keeps MapSched due times in a min-heap and runs refreshes when due"""
+
+    def __init__(self, workers=2, max_sleep=60, full=False, report=None):
+        self.workers = workers
+        self.max_sleep = max_sleep
+        self.full = full
+        self.report = report or (lambda msg: None)
+        self.heap = []
+        self.queued = {}
+        self.seq = itertools.count()
+        self.version = None
+        self.running = {}
+        self.stopped = threading.Event()
+
+    def sched_version(self):
+        """cheap marker that changes when any MapSched is edited
+
+        The pks of active DataMaps are part of it, so switching a map's
+        map_active on or off also reloads the schedules.
+        """
+        active = tuple(DataMap.objects.filter(
+            map_active=True).order_by('pk').values_list('pk', flat=True))
+        return tuple(MapSched.objects.aggregate(
+            Max('modified'), Count('id')).values()) + (active,)
+
+    def rebuild(self):
+        """reloads every schedule with one query and heapifies due times"""
+        schedules_changed.clear()
+        self.version = self.sched_version()
+        now = dtz.now()
+        qs = MapSched.objects.select_related('data_map__api_cred').filter(
+            data_map__map_active=True)
+        self.heap = []
+        self.queued = {}
+        for sched in qs:
+            if sched.is_active(now):
+                due = sched.due_time()
+                self.queued[sched.pk] = due
+                self.heap.append((due, next(self.seq), sched))
+        heapq.heapify(self.heap)
+        self.report('Loaded %d schedules' % len(self.heap))
+
+    def push(self, sched, due=None):
+        """queues a schedule, replacing any earlier entry, unless ended"""
+        if sched.is_active():
+            due = due or sched.due_time()
+            self.queued[sched.pk] = due
+            heapq.heappush(self.heap, (due, next(self.seq), sched))
+
+    def refresh(self, sched):
+        """runs one refresh on a worker thread"""
+        datamap = sched.data_map
+        datamap.load_sf_data(full=self.full)
+        sched.increment_nxt()
+        return sched
+
+    def dispatch(self, pool, now):
+        """starts every refresh whose due time has passed"""
+        while self.heap and self.heap[0][0] <= now:
+            due, seq, sched = heapq.heappop(self.heap)
+            if self.queued.get(sched.pk) != due:
+                # superseded by a later push
+                continue
+            del self.queued[sched.pk]
+            dmpk = sched.data_map_id
+            if dmpk in self.running:
+                # the map is already refreshing, look again shortly
+                self.push(sched, now + datetime.timedelta(seconds=1))
+                continue
+            if not(DataMap.objects.filter(pk=dmpk, map_active=True).exists()):
+                continue
+            self.report('Updating %s' % str(sched))
+            self.running[dmpk] = (
+                pool.submit(closing_db(self.refresh), sched), sched)
+
+    def collect(self):
+        """requeues schedules whose refresh has finished"""
+        for dmpk, (fut, sched) in list(self.running.items()):
+            if not(fut.done()):
+                continue
+            del self.running[dmpk]
+            exc = fut.exception()
+            if exc is not None:
+                self.report('Refresh failed for %s: %r' % (str(sched), exc))
+                # retry at the next iteration rather than straight away
+                sched.increment_nxt()
+                self.push(sched, sched.next_itr)
+                continue
+            self.report('Data refreshed for %s' % sched.data_map.name)
+            sched.data_map.refresh_from_db()
+            self.push(sched)
+
+    def wait_time(self, now):
+        """seconds until the earliest due time, capped at max_sleep"""
+        secs = self.max_sleep
+        if self.heap:
+            secs = min(secs, (self.heap[0][0] - now).total_seconds())
+        if self.running:
+            secs = min(secs, 1)
+        return max(secs, 0)
+
+    def run(self):
+        """loops until stop() is called"""
+        self.rebuild()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while not(self.stopped.is_set()):
+                if schedules_changed.is_set() or (
+                        self.sched_version() != self.version):
+                    self.rebuild()
+                self.collect()
+                now = dtz.now()
+                self.dispatch(pool, now)
+                schedules_changed.wait(self.wait_time(dtz.now()))
+
+    def stop(self):
+        self.stopped.set()
+        schedules_changed.set()
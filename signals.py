@@ -0,0 +1,55 @@
+"""Signal receivers for the nps app"""
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import MapObject, MapField, MapFilter, MapSched
+from .models import ServiceOrder, Survey_Record
+from .models.general import rows_changing, datamap_refreshed
+from .scheduler import schedules_changed
+from . import mapping, rollups, snapshot
+
+
+STAT_FIELDS = frozenset(['last_refresh', 'record_count', 'sync_watermark'])
+
+
+@receiver(post_save, sender=MapObject)
+@receiver(post_delete, sender=MapObject)
+@receiver(post_save, sender=MapField)
+@receiver(post_delete, sender=MapField)
+@receiver(post_save, sender=MapFilter)
+@receiver(post_delete, sender=MapFilter)
+def drop_map_plans(sender, **kwargs):
+    """mapping and filter changes invalidate every compiled plan"""
+    flds = kwargs.get('update_fields')
+    if flds and STAT_FIELDS.issuperset(flds):
+        return
+    mapping.invalidate()
+
+
+@receiver(post_save, sender=MapSched)
+@receiver(post_delete, sender=MapSched)
+def wake_scheduler(sender, **kwargs):
+    """schedule edits made in this process reload the scheduler at once"""
+    flds = kwargs.get('update_fields')
+    if flds and set(flds) == set(['next_itr']):
+        return
+    schedules_changed.set()
+
+
+@receiver(rows_changing, sender=ServiceOrder)
+def track_order_rollups(sender, keys, **kwargs):
+    """order edits can move their surveys to another rollup bucket"""
+    return rollups.tracker(
+        Survey_Record.objects.filter(work_order_id__in=keys))
+
+
+@receiver(rows_changing, sender=Survey_Record)
+def track_survey_rollups(sender, keys, survey_form=None, **kwargs):
+    return rollups.tracker(
+        survey_form.survey_record_set.filter(forms_id__in=keys))
+
+
+@receiver(datamap_refreshed)
+def update_snapshot(sender, datamap, full=False, **kwargs):
+    """folds the rows a refresh wrote into the columnar snapshot"""
+    if snapshot.enabled():
+        snapshot.update(full=full)
@@ -0,0 +1,558 @@
+"""Columnar on-disk snapshot of work orders and surveys for analytics
+
+Each table is stored as segments: directories of NumPy .npy files, one
+per column, read back memory-mapped. Text columns with few distinct
+values are stored as int32 codes into a JSON vocabulary. numpy is
+optional: without it, or without settings.NPS_SNAPSHOT_DIR, snapshots
+are switched off.
+
+Segments are never changed once written. An update appends a segment
+holding the rows that changed and lists, in the small dead.npy of its
+version directory, the rows of older segments they replace. When the
+segments pile up they are compacted into new ones. manifest.json names
+the current version and its segments, and the version before it is
+kept for readers that opened it. Updates take turns on a file lock.
+"""
+import os
+import re
+import json
+import shutil
+import datetime
+import contextlib
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Max, Q
+from django.utils import timezone as dtz
+from django.utils.dateparse import parse_datetime
+from .models import ServiceOrder, Survey_Record
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+FORMAT = 2
+CHUNK_SIZE = 5000
+# rows a segment holds before the next one is started
+SEGMENT_ROWS = 250000
+# an update compacts a table with more segments than this, or with more
+# replaced rows than live ones
+MAX_SEGMENTS = 16
+NULL = -1
+# rows can be committed a little after their stamp, so look back a bit
+OVERLAP = datetime.timedelta(minutes=5)
+
+# column, lookup, kind: key, code (dictionary encoded), time or int
+# the first column is the primary key
+ORDER_COLUMNS = (
+    ('sfid', 'sfid', 'key'),
+    ('completed', 'svmxc_completed_date_time_c', 'time'),
+    ('region', 'svmxc_company_c__global_region_c', 'code'),
+    ('subregion', 'svmxc_company_c__global_subregion_c', 'code'),
+    ('country', 'svmxc_country_c', 'code'),
+    ('order_type', 'svmxc_order_type_c', 'code'),
+    ('technician', 'svmxc_group_member_c', 'code'),
+)
+SURVEY_COLUMNS = (
+    ('pk', 'pk', 'int'),
+    ('work_order', 'work_order_id', 'key'),
+    ('last_update', 'last_update', 'time'),
+    ('nps', 'nps', 'int'),
+    ('nss_eodb', 'nss_eodb', 'int'),
+    ('nss_cc', 'nss_cc', 'int'),
+    ('nss_fe', 'nss_fe', 'int'),
+    ('nss_ftf', 'nss_ftf', 'int'),
+    ('nss_ttr', 'nss_ttr', 'int'),
+)
+# model, columns, field stamping a change
+TABLES = {
+    'orders': (ServiceOrder, ORDER_COLUMNS, 'systemmodstamp'),
+    'surveys': (Survey_Record, SURVEY_COLUMNS, 'modified'),
+}
+DTYPES = {'key': 'U18', 'time': 'datetime64[s]', 'code': 'int32',
+          'int': 'int64'}
+METRICS = ('nss_eodb', 'nss_cc', 'nss_fe', 'nss_ftf', 'nss_ttr')
+GROUPS = ('region', 'subregion', 'country', 'order_type', 'technician',
+          'month')
+
+
+def snapshot_dir():
+    return getattr(settings, 'NPS_SNAPSHOT_DIR', None)
+
+
+def enabled():
+    """check if snapshots are configured and numpy is installed"""
+    return np is not None and fcntl is not None and bool(snapshot_dir())
+
+
+def require():
+    if np is None:
+        raise ImproperlyConfigured('Snapshots need numpy installed')
+    if fcntl is None:
+        raise ImproperlyConfigured('Snapshots need POSIX file locks')
+    if not(snapshot_dir()):
+        raise ImproperlyConfigured('Set NPS_SNAPSHOT_DIR to use snapshots')
+    return snapshot_dir()
+
+
+def write_file(path, write):
+    """writes through a temporary file so readers never see half a file"""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as out:
+        write(out)
+    os.replace(tmp, path)
+
+
+def as_naive_utc(dtm):
+    if dtm is None:
+        return None
+    if dtz.is_aware(dtm):
+        dtm = dtm.astimezone(dtz.utc).replace(tzinfo=None)
+    return dtm
+
+
+def segment_path(root, table, seg):
+    return os.path.join(root, 'segments', table, seg)
+
+
+def live_rows(parts, dead, kind):
+    """one column from its segments, less the rows later ones replaced"""
+    if not(parts):
+        return np.array([], dtype=DTYPES[kind])
+    if len(parts) == 1 and not(len(dead)):
+        return parts[0]
+    return np.delete(np.concatenate(parts), dead)
+
+
+class Table(object):
+    """The segments of one table, as an update appends to them"""
+
+    def __init__(self, root, name, columns, version, src=None, state=None):
+        # src is the version directory to start from, None for empty
+        self.root = root
+        self.name = name
+        self.columns = columns
+        self.version = version
+        self.segments = []
+        self.dead = np.array([], dtype='int64')
+        self.vocabs = {}
+        if src:
+            self.segments = [list(seg) for seg in state['segments']]
+            self.dead = np.load(os.path.join(src, name, 'dead.npy'))
+        for col, lookup, kind in columns:
+            if kind == 'code':
+                self.vocabs[col] = self.read_vocab(src, col) if src else []
+
+    def read_vocab(self, src, col):
+        with open(os.path.join(src, self.name, col + '.json')) as inp:
+            return json.load(inp)
+
+    def load(self, seg, col):
+        return np.load(
+            os.path.join(segment_path(self.root, self.name, seg),
+                         col + '.npy'),
+            mmap_mode='r')
+
+    def encode(self, col, vals):
+        """int32 codes of text values, growing the vocabulary as needed"""
+        vocab = self.vocabs[col]
+        index = dict((val, idx) for idx, val in enumerate(vocab))
+        codes = []
+        for val in vals:
+            if val is None:
+                codes.append(NULL)
+                continue
+            if not(val in index):
+                index[val] = len(vocab)
+                vocab.append(val)
+            codes.append(index[val])
+        return np.array(codes, dtype='int32')
+
+    def to_array(self, col, kind, vals):
+        if kind == 'code':
+            return self.encode(col, vals)
+        if kind == 'time':
+            return np.array(
+                [as_naive_utc(val) for val in vals], dtype='datetime64[s]')
+        if kind == 'int':
+            return np.array(
+                [NULL if val is None else val for val in vals],
+                dtype='int64')
+        return np.array(
+            ['' if val is None else val for val in vals], dtype='U18')
+
+    def append(self, qs, chunk_size=CHUNK_SIZE):
+        """adds the rows of qs as new segments, returning their number
+
+        Rows are read in keyset pages of chunk_size by primary key, and
+        at most SEGMENT_ROWS of them are held before they are written.
+        """
+        lookups = [lookup for col, lookup, kind in self.columns]
+        qs = qs.order_by('pk').values_list(*lookups)
+        parts = []
+        pending = 0
+        count = 0
+        last = None
+        while True:
+            page = qs if last is None else qs.filter(pk__gt=last)
+            rows = list(page[:chunk_size])
+            if not(rows):
+                break
+            cols = list(zip(*rows))
+            parts.append(dict(
+                (col, self.to_array(col, kind, cols[pos]))
+                for pos, (col, lookup, kind) in enumerate(self.columns)))
+            pending += len(rows)
+            count += len(rows)
+            if pending >= SEGMENT_ROWS:
+                self.supersede(parts)
+                self.write_segment(parts)
+                parts = []
+                pending = 0
+            if len(rows) < chunk_size:
+                break
+            last = rows[-1][0]
+        if parts:
+            self.supersede(parts)
+            self.write_segment(parts)
+        return count
+
+    def supersede(self, parts):
+        """marks dead the stored rows that parts holds newer copies of
+
+        Each segment keeps the sort order of its keys, so the lookup
+        reads only the pages of the memory-mapped keys it needs.
+        """
+        keycol = self.columns[0][0]
+        keys = np.concatenate([part[keycol] for part in parts])
+        found = [self.dead]
+        offset = 0
+        for seg, size in self.segments:
+            if size:
+                stored = self.load(seg, keycol)
+                order = self.load(seg, 'order')
+                pos = np.minimum(
+                    np.searchsorted(stored, keys, sorter=order), size - 1)
+                rows = order[pos]
+                found.append(offset + rows[stored[rows] == keys])
+            offset += size
+        self.dead = np.unique(np.concatenate(found))
+
+    def write_segment(self, parts):
+        """writes rows as a new segment, never to be changed again"""
+        seg = '%s-%04d' % (self.version, len(self.segments))
+        path = segment_path(self.root, self.name, seg)
+        os.makedirs(path)
+        size = 0
+        for col, lookup, kind in self.columns:
+            arr = np.concatenate([part[col] for part in parts])
+            np.save(os.path.join(path, col + '.npy'), arr)
+            if col == self.columns[0][0]:
+                np.save(os.path.join(path, 'order.npy'),
+                        np.argsort(arr, kind='stable'))
+            size = len(arr)
+        self.segments.append([seg, size])
+
+    def needs_compaction(self):
+        return (len(self.segments) > MAX_SEGMENTS or
+                len(self.dead) > len(self))
+
+    def compact(self):
+        """rewrites the live rows into as few segments as hold them"""
+        old = self.segments
+        dead = self.dead
+        self.segments = []
+        self.dead = np.array([], dtype='int64')
+        parts = []
+        pending = 0
+        offset = 0
+        for seg, size in old:
+            gone = dead[(dead >= offset) & (dead < offset + size)] - offset
+            keep = np.ones(size, dtype=bool)
+            keep[gone] = False
+            offset += size
+            if not(keep.any()):
+                continue
+            parts.append(dict(
+                (col, np.asarray(self.load(seg, col))[keep])
+                for col, lookup, kind in self.columns))
+            pending += int(keep.sum())
+            if pending >= SEGMENT_ROWS:
+                self.write_segment(parts)
+                parts = []
+                pending = 0
+        if parts:
+            self.write_segment(parts)
+
+    def save(self, dst):
+        """writes the dead rows and vocabularies into version dst"""
+        path = os.path.join(dst, self.name)
+        os.makedirs(path)
+        np.save(os.path.join(path, 'dead.npy'), self.dead)
+        for col, vocab in self.vocabs.items():
+            with open(os.path.join(path, col + '.json'), 'w') as out:
+                json.dump(vocab, out)
+
+    def __len__(self):
+        return sum(size for seg, size in self.segments) - len(self.dead)
+
+
+def read_manifest(root):
+    fname = os.path.join(root, 'manifest.json')
+    if not(os.path.exists(fname)):
+        return {}
+    with open(fname) as inp:
+        return json.load(inp)
+
+
+def new_version(root):
+    """creates an empty version directory, named by the time"""
+    name = 'v' + dtz.now().strftime('%Y%m%d%H%M%S%f')
+    os.makedirs(os.path.join(root, name))
+    return name
+
+
+@contextlib.contextmanager
+def update_lock(root):
+    """holds the snapshot's file lock, waiting for a running update"""
+    with open(os.path.join(root, 'update.lock'), 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def changed_rows(name, state):
+    """queryset of rows stored or changed since the last update"""
+    klass, columns, stamp_field = TABLES[name]
+    qs = klass.objects.all()
+    if not(state):
+        return qs
+    cond = Q()
+    if state.get('stamp'):
+        since = parse_datetime(state['stamp']) - OVERLAP
+        cond = Q(**{stamp_field + '__gt': since})
+    if name == 'surveys':
+        cond |= Q(pk__gt=state.get('max_pk') or 0)
+    return qs.filter(cond)
+
+
+def collect_garbage(root, keep, tables):
+    """removes versions and segments no kept manifest refers to
+
+    Runs under the update lock, so anything else is left over from an
+    update that failed part way.
+    """
+    for fname in os.listdir(root):
+        if re.match(r'^v\d+$', fname) and not(fname in keep):
+            shutil.rmtree(os.path.join(root, fname), ignore_errors=True)
+    for name in TABLES:
+        path = os.path.join(root, 'segments', name)
+        used = set(seg for state in tables for seg, size in
+                   state.get(name, {}).get('segments', []))
+        for seg in os.listdir(path):
+            if not(seg in used):
+                shutil.rmtree(os.path.join(path, seg), ignore_errors=True)
+
+
+def update(full=False, chunk_size=CHUNK_SIZE):
+    """brings the snapshot up to date, writing only rows that changed
+
+    Returns rows written per table. Orders are found by systemmodstamp
+    and surveys by a new pk or a later modified time. Changes that move
+    neither, like an Account's region or orders a full reload brings in
+    with old stamps, need full=True.
+
+    The changed rows go into new segments, so an update costs time in
+    the rows it writes, plus a compaction now and then.
+    """
+    root = require()
+    os.makedirs(root, exist_ok=True)
+    with update_lock(root):
+        return write_update(root, full, chunk_size)
+
+
+def write_update(root, full, chunk_size):
+    manifest = read_manifest(root)
+    current = manifest.get('version')
+    before = manifest.get('tables', {})
+    tables = before
+    if full or not(current) or manifest.get('format') != FORMAT:
+        tables = {}
+    src = os.path.join(root, current) if tables else None
+    version = new_version(root)
+    after = {}
+    rtn = {}
+    for name, (klass, columns, stamp_field) in sorted(TABLES.items()):
+        os.makedirs(os.path.join(root, 'segments', name), exist_ok=True)
+        mark = klass.objects.aggregate(
+            stamp=Max(stamp_field), max_pk=Max('pk'))
+        table = Table(root, name, columns, version, src, tables.get(name))
+        rtn[name] = table.append(
+            changed_rows(name, tables.get(name)), chunk_size)
+        if table.needs_compaction():
+            table.compact()
+        table.save(os.path.join(root, version))
+        after[name] = {
+            'rows': len(table),
+            'segments': table.segments,
+            'stamp': mark['stamp'].isoformat() if mark['stamp'] else None,
+            'max_pk': mark['max_pk'] if name == 'surveys' else None,
+        }
+    manifest = {
+        'format': FORMAT,
+        'version': version,
+        'previous': current,
+        'tables': after,
+        'updated': dtz.now().isoformat(),
+    }
+    data = json.dumps(manifest, indent=1).encode('utf-8')
+    write_file(
+        os.path.join(root, 'manifest.json'), lambda out: out.write(data))
+    collect_garbage(root, (version, current), (after, before))
+    return rtn
+
+
+class Snapshot(object):
+    """Read only view of the snapshot for analytics
+
+    Every column of the version the manifest names is read when the
+    reader opens, so all of them come from the same update. A column
+    stored in one segment with no replaced rows stays memory-mapped.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or require()
+        self.manifest = read_manifest(self.root)
+        if self.manifest.get('format') != FORMAT:
+            raise ImproperlyConfigured('No snapshot has been built yet')
+        path = os.path.join(self.root, self.manifest['version'])
+        self.columns = {}
+        self.vocabs = {}
+        for table, (klass, columns, stamp_field) in TABLES.items():
+            segs = [segment_path(self.root, table, seg) for seg, size in
+                    self.manifest['tables'][table]['segments']]
+            dead = np.load(os.path.join(path, table, 'dead.npy'))
+            for col, lookup, kind in columns:
+                parts = [
+                    np.load(os.path.join(seg, col + '.npy'), mmap_mode='r')
+                    for seg in segs]
+                self.columns[(table, col)] = live_rows(parts, dead, kind)
+                if kind == 'code':
+                    fname = os.path.join(path, table, col + '.json')
+                    with open(fname) as inp:
+                        self.vocabs[(table, col)] = json.load(inp)
+
+    def column(self, table, col):
+        """one column as an array"""
+        return self.columns[(table, col)]
+
+    def vocab(self, table, col):
+        return self.vocabs[(table, col)]
+
+    def survey_orders(self):
+        """row of each survey's work order in the order columns, or -1"""
+        keys = self.column('orders', 'sfid')
+        wos = self.column('surveys', 'work_order')
+        if not(len(keys)):
+            return np.full(len(wos), NULL, dtype='int64')
+        sorter = np.argsort(keys, kind='stable')
+        pos = np.minimum(
+            np.searchsorted(keys, wos, sorter=sorter), len(keys) - 1)
+        rows = sorter[pos]
+        return np.where(keys[rows] == wos, rows, NULL)
+
+    def months(self, orders):
+        """reporting month per survey, its order's completion if known"""
+        done = np.full(len(orders), np.datetime64('NaT'), 'datetime64[s]')
+        linked = orders >= 0
+        done[linked] = self.column('orders', 'completed')[orders[linked]]
+        missing = np.isnat(done)
+        done[missing] = self.column('surveys', 'last_update')[missing]
+        return done.astype('datetime64[M]')
+
+    def nps_by(self, *groups, **bounds):
+        """NPS and mean NSS scores per combination of groups
+
+        groups are names from GROUPS. start and end bound the reporting
+        month, given as dates. Computed with vectorised numpy over the
+        columns.
+        """
+        for name in groups:
+            if not(name in GROUPS):
+                raise ValueError('cannot group by %s' % name)
+        orders = self.survey_orders()
+        month = self.months(orders)
+        keep = np.ones(len(orders), dtype=bool)
+        if bounds.get('start'):
+            keep &= month >= np.datetime64(bounds['start'], 'M')
+        if bounds.get('end'):
+            keep &= month <= np.datetime64(bounds['end'], 'M')
+        codes = []
+        for name in groups:
+            if name == 'month':
+                vals = month.astype('int64')
+                vals[np.isnat(month)] = NULL
+            else:
+                vals = np.full(len(orders), NULL, dtype='int64')
+                linked = orders >= 0
+                vals[linked] = self.column('orders', name)[orders[linked]]
+            codes.append(vals[keep])
+        idx = np.flatnonzero(keep)
+        if codes:
+            uniq, inverse = np.unique(
+                np.stack(codes, axis=1), axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+        else:
+            uniq = np.zeros((1, 0), dtype='int64')
+            inverse = np.zeros(len(idx), dtype='int64')
+        size = len(uniq)
+        score = np.asarray(self.column('surveys', 'nps'))[idx]
+        promoters = np.bincount(
+            inverse, weights=score >= 9, minlength=size)
+        passives = np.bincount(
+            inverse, weights=(score >= 7) & (score < 9), minlength=size)
+        detractors = np.bincount(
+            inverse, weights=(score >= 0) & (score < 7), minlength=size)
+        responses = np.bincount(inverse, minlength=size)
+        means = {}
+        for metric in METRICS:
+            vals = np.asarray(self.column('surveys', metric))[idx]
+            answered = vals >= 0
+            total = np.bincount(
+                inverse, weights=np.where(answered, vals, 0), minlength=size)
+            count = np.bincount(inverse, weights=answered, minlength=size)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means[metric] = total / count
+        labels = dict(
+            (name, self.vocab('orders', name))
+            for name in groups if name != 'month')
+        rated = promoters + passives + detractors
+        rtn = []
+        for pos in range(size):
+            row = {}
+            for num, name in enumerate(groups):
+                code = int(uniq[pos][num])
+                if code == NULL:
+                    row[name] = None
+                elif name == 'month':
+                    row[name] = np.datetime64(code, 'M').astype(
+                        datetime.date)
+                else:
+                    row[name] = labels[name][code]
+            row['responses'] = int(responses[pos])
+            row['nps'] = None
+            if rated[pos]:
+                row['nps'] = round(float(
+                    100.0 * (promoters[pos] - detractors[pos]) / rated[pos]),
+                    1)
+            for metric in METRICS:
+                val = means[metric][pos]
+                row[metric] = None if np.isnan(val) else round(float(val), 2)
+            rtn.append(row)
+        return rtn
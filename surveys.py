@@ -0,0 +1,129 @@
+"""Compiled mapping of Forms API survey records onto Survey_Record"""
+import datetime
+from django.conf import settings
+from django.utils import timezone as dtz
+from django.utils.dateparse import parse_datetime
+from .workers import merge_streams
+
+
+def to_int(val):
+    if val is None or val == '':
+        return None
+    try:
+        return int(float(val))
+    except (TypeError, ValueError):
+        return None
+
+
+def to_bool(val):
+    if isinstance(val, str):
+        return val.strip().lower() in ('1', 'y', 'yes', 'true')
+    return bool(val)
+
+
+def to_text(val):
+    if val is None:
+        return None
+    return str(val)
+
+
+def to_datetime(val):
+    """reads ISO text or epoch milliseconds as an aware datetime"""
+    if val is None or val == '':
+        return None
+    if isinstance(val, (int, float)):
+        dtm = datetime.datetime.utcfromtimestamp(val / 1000.0)
+    else:
+        dtm = parse_datetime(str(val).replace(' ', 'T', 1))
+        if dtm is None:
+            return None
+    if dtz.is_naive(dtm):
+        dtm = dtz.make_aware(dtm, dtz.utc)
+    return dtm
+
+
+# form field, Survey_Record attribute, converter
+SURVEY_FIELDS = (
+    ('record_id', 'forms_id', to_text),
+    ('dt_updated', 'last_update', to_datetime),
+    (1588082, 'wo_name', to_text),
+    (1672513, 'nss_eodb', to_int),
+    (1672514, 'nss_cc', to_int),
+    (1672515, 'nss_fe', to_int),
+    (1672516, 'nss_ftf', to_int),
+    (1672517, 'nss_ttr', to_int),
+    (1672518, 'gc_compare', to_int),
+    (1672519, 'request_contact', to_bool),
+    (1672526, 'cust_comments', to_text),
+    (1631523, 'survey_link', to_text),
+)
+WO_NAME_FIELD = 1588082
+
+
+class SurveyPlan(object):
+    """Field lookups of SURVEY_FIELDS resolved once for every record"""
+
+    def __init__(self, fields=SURVEY_FIELDS):
+        self.request = [fld for fld, attr, conv in fields]
+        # JSON turns numeric field ids into string keys
+        self.steps = tuple(
+            (str(fld), attr, conv) for fld, attr, conv in fields)
+
+    def apply(self, rec):
+        """maps one Forms API record onto Survey_Record attributes"""
+        rtn = {}
+        for key, attr, conv in self.steps:
+            if key in rec:
+                rtn[attr] = conv(rec[key])
+        if rtn.get('request_contact') is None:
+            rtn.pop('request_contact', None)
+        return rtn
+
+
+def survey_fields():
+    """SURVEY_FIELDS plus the NPS question when settings name its field
+
+    The forms have no known field id for the likelihood to recommend
+    question yet. Until NPS_FORM_FIELD is set, Survey_Record.nps is not
+    sourced and the rollups count no promoters, passives or detractors.
+    """
+    nps = getattr(settings, 'NPS_FORM_FIELD', None)
+    if nps is None:
+        return SURVEY_FIELDS
+    return SURVEY_FIELDS + ((nps, 'nps', to_int),)
+
+
+PLAN = SurveyPlan(survey_fields())
+
+
+def sync_forms(forms, workers=4, full=False):
+    """pulls several Survey_Forms at once, storing pages as they arrive
+
+    Pages are fetched on up to workers threads and written here, one
+    form page at a time. Surveys stored before their work order are
+    linked first. Returns (new, updated) counts per form pk.
+    """
+    forms = dict((form.pk, form) for form in forms)
+    for form in forms.values():
+        form.link_orders()
+    totals = dict((pk, [0, 0]) for pk in forms)
+    newest = {}
+    merged = merge_streams(
+        [(pk, form.extract(full)) for pk, form in forms.items()], workers)
+    try:
+        for pk, recs, done in merged:
+            form = forms[pk]
+            if done:
+                form.advance_watermark(newest.get(pk))
+                continue
+            frecs = [PLAN.apply(rec) for rec in recs]
+            new, changed = form.upsert_recs(frecs)
+            totals[pk][0] += new
+            totals[pk][1] += changed
+            stamps = [frec['last_update'] for frec in frecs
+                      if frec.get('last_update')]
+            if stamps and (newest.get(pk) is None or newest[pk] < max(stamps)):
+                newest[pk] = max(stamps)
+    finally:
+        merged.close()
+    return dict((pk, tuple(cnt)) for pk, cnt in totals.items())
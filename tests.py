@@ -1,3 +1,779 @@
-from django.test import TestCase
+import os
+import json
+import shutil
+import datetime
+import tempfile
+import unittest
+from unittest import mock
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.management import call_command, CommandError
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone as dtz
+from .bench.fixtures import FixtureSet, build_datamap
+from .bench.server import StandInAdapter, BASE_URL
+from .bulk import BulkQuery, BulkJobError
+from . import fetcher
+from .fetcher import pack_ids, run_batch
+from .models import ForceAPI, OAuthToken, DataMap, MapSched
+from .models import Account, ServiceOrder, SFUser
+from .models import Forms_Access, Survey_Form, Survey_Record
+from .models import NPSRollup, RollupState
+from .planner import LoadPlanner
+from .scheduler import Scheduler
+from .transport import SFTransport, QueryError
+from . import export, rollups, snapshot, views
 
-# Create your tests here.
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=dtz.utc)
+
+
+class StandInTestCase(TestCase):
+    """Runs the client stack against the in-process stand-in org"""
+    size = 200
+
+    def setUp(self):
+        self.fixtures = FixtureSet(self.size)
+        self.api = ForceAPI.objects.create(
+            user_id='tests@example.com',
+            access_token_url=BASE_URL + '/token')
+        self.adapter = self.mount(StandInAdapter(self.fixtures, 50))
+
+    def tearDown(self):
+        self.drop()
+
+    def mount(self, adapter):
+        self.api.transport().session.mount(BASE_URL + '/', adapter)
+        return adapter
+
+    def drop(self):
+        api = self.api
+        SFTransport.drop((api.pk, api.user_id, api.access_token_url))
+
+
+class BulkQueryTests(StandInTestCase):
+
+    def test_pages_results_by_locator(self):
+        job = BulkQuery(
+            self.api,
+            'SELECT Id, Name FROM SVMXC__Service_Order__c',
+            poll_seconds=0,
+            max_records=30)
+        rows = [row for batch in job.iter_batches(45) for row in batch]
+        self.assertEqual(len(rows), self.size)
+        self.assertEqual(len(set(row['Id'] for row in rows)), self.size)
+        self.assertEqual(rows[0]['Name'], 'WO-00000000')
+
+    def test_empty_fields_read_as_none(self):
+        job = BulkQuery(
+            self.api,
+            'SELECT Id, SVMXC__Case__c FROM SVMXC__Service_Order__c',
+            poll_seconds=0)
+        rows = [row for batch in job.iter_batches() for row in batch]
+        blank = [row for row in rows if row['SVMXC__Case__c'] is None]
+        self.assertTrue(blank)
+        self.assertNotIn('', [row['SVMXC__Case__c'] for row in rows])
+
+    def test_polls_until_complete(self):
+        self.adapter.job_polls = 3
+        job = BulkQuery(self.api, 'SELECT Id FROM Account', poll_seconds=0)
+        job.submit()
+        before = self.adapter.calls
+        self.assertEqual(job.wait()['state'], 'JobComplete')
+        self.assertEqual(self.adapter.calls - before, 4)
+
+    def test_slow_job_is_aborted(self):
+        self.adapter.job_polls = 1000
+        job = BulkQuery(self.api, 'SELECT Id FROM Account',
+                        poll_seconds=0, max_wait=0)
+        job.submit()
+        with self.assertRaises(BulkJobError):
+            job.wait()
+        self.assertEqual(self.adapter.jobs[job.job_id]['state'], 'Aborted')
+
+    def test_rejected_job_raises(self):
+        job = BulkQuery(self.api, 'SELECT Id FROM Nothing', poll_seconds=0)
+        with self.assertRaises(BulkJobError):
+            job.submit()
+
+    def test_bulk_extract_loads_the_map(self):
+        datamap = build_datamap(self.api, 'bulk', extractor='BULK')
+        datamap.load_sf_data(full=True)
+        run = datamap.syncrun_set.get()
+        self.assertEqual(run.status, 'OK')
+        self.assertEqual(ServiceOrder.objects.count(), self.size)
+        self.assertFalse(ServiceOrder.objects.filter(
+            svmxc_company_c__isnull=True).exists())
+
+
+class TokenTests(StandInTestCase):
+
+    def test_process_reuses_stored_token(self):
+        first = self.api.get_connection()
+        self.assertEqual(self.api.transport().logins, 1)
+        # a fresh transport stands for another process
+        self.drop()
+        self.mount(StandInAdapter(self.fixtures))
+        second = self.api.get_connection()
+        self.assertEqual(self.api.transport().logins, 0)
+        self.assertEqual(second['access_token'], first['access_token'])
+
+    def test_login_finds_a_token_stored_meanwhile(self):
+        tok = OAuthToken.objects.create(key=self.api.token_key())
+        tok.store({'access_token': 'other', 'instance_url': BASE_URL},
+                  dtz.now().timestamp() + 600)
+        # refresh_connection finds the token another worker stored
+        cnn = self.api.refresh_connection()
+        self.assertEqual(cnn['access_token'], 'other')
+        self.assertEqual(self.api.transport().logins, 0)
+
+    def test_only_the_rejected_token_is_expired(self):
+        cnn = self.api.get_connection()
+        self.api.invalidate_connection({'access_token': 'stale'})
+        tok = OAuthToken.objects.get(key=self.api.token_key())
+        self.assertTrue(tok.is_valid())
+        self.api.invalidate_connection(cnn)
+        tok.refresh_from_db()
+        self.assertFalse(tok.is_valid())
+
+
+class QueryErrorTests(StandInTestCase):
+
+    def test_error_body_raises(self):
+        datamap = build_datamap(self.api, 'errors')
+        with self.assertRaises(QueryError) as ctx:
+            datamap.sf_recs('query/01g000000000000bad')
+        self.assertEqual(ctx.exception.status, 400)
+        self.assertEqual(
+            ctx.exception.body[0]['errorCode'], 'INVALID_QUERY_LOCATOR')
+
+
+class PlannerTests(StandInTestCase):
+
+    def test_toposort_puts_parents_first(self):
+        planner = LoadPlanner(build_datamap(self.api, 'order'))
+        order = planner.order
+        for parent in ('Account', 'Case', 'Contact', 'ServiceGroupMembers'):
+            self.assertLess(
+                order.index(parent), order.index('ServiceOrder'))
+        self.assertLess(
+            order.index('SFUser'), order.index('ServiceGroupMembers'))
+        self.assertEqual(planner.deferred['SFUser'], set(['manager']))
+        self.assertEqual(planner.deferred['ServiceOrder'], set())
+
+    def test_toposort_defers_a_cycle(self):
+        planner = LoadPlanner(build_datamap(self.api, 'cycle'))
+        planner.by_class = {'A': None, 'B': None}
+        planner.parents = {'A': {'b': 'B'}, 'B': {'a': 'A'}}
+        order, deferred = planner.toposort()
+        self.assertEqual(order, ['A', 'B'])
+        self.assertEqual(deferred, {'A': set(['b']), 'B': set()})
+
+    def test_self_references_are_linked(self):
+        datamap = build_datamap(self.api, 'users')
+        datamap.mapobject_set.get(dj_class='SFUser').load_obj(full=True)
+        self.assertEqual(SFUser.objects.count(), self.fixtures.counts['User'])
+        user = SFUser.objects.get(sfid=self.fixtures.sfid('User', 4))
+        self.assertEqual(user.manager_id, self.fixtures.sfid('User', 0))
+
+    def test_missing_parent_is_stored_as_null(self):
+        class Hiding(StandInAdapter):
+            def matching(self, sobject, where):
+                if sobject == 'Account':
+                    return []
+                return StandInAdapter.matching(self, sobject, where)
+
+        self.mount(Hiding(self.fixtures, 50))
+        datamap = build_datamap(self.api, 'absent')
+        datamap.load_sf_data(full=True)
+        self.assertEqual(datamap.syncrun_set.get().status, 'OK')
+        self.assertEqual(ServiceOrder.objects.filter(
+            svmxc_company_c__isnull=True).count(), self.size)
+
+    def test_failed_parent_fetch_writes_nothing(self):
+        class Failing(StandInAdapter):
+            def batch(self, data):
+                return {'hasErrors': True, 'results': []}
+
+            def query(self, qtxt, size):
+                if ' in (' in qtxt:
+                    return 503, [{'errorCode': 'SERVER_UNAVAILABLE'}]
+                return StandInAdapter.query(self, qtxt, size)
+
+        self.mount(Failing(self.fixtures, 50))
+        datamap = build_datamap(self.api, 'failing')
+        with self.assertRaises(QueryError):
+            datamap.load_sf_data(full=True)
+        self.assertEqual(datamap.syncrun_set.get().status, 'ERR')
+        self.assertFalse(ServiceOrder.objects.exists())
+        order = datamap.mapobject_set.get(dj_class='ServiceOrder')
+        self.assertIsNone(order.sync_watermark)
+
+
+class NextAfterTests(TestCase):
+
+    def sched(self, frequency, unit, start):
+        api = ForceAPI.objects.create(user_id='sched@example.com')
+        datamap = DataMap.objects.create(name='sched', api_cred=api)
+        return MapSched.objects.create(
+            data_map=datamap, frequency=frequency, freq_unit=unit,
+            start=start, next_itr=start)
+
+    def test_future_iteration_is_kept(self):
+        sched = self.sched(1, 'DY', utc(2026, 3, 1))
+        self.assertEqual(
+            sched.next_after(utc(2026, 2, 1)), utc(2026, 3, 1))
+
+    def test_hours_round_up_to_the_next_step(self):
+        sched = self.sched(2, 'HR', utc(2026, 3, 1))
+        self.assertEqual(
+            sched.next_after(utc(2026, 3, 1, 5, 30)), utc(2026, 3, 1, 6))
+        self.assertEqual(
+            sched.next_after(utc(2026, 3, 1, 6)), utc(2026, 3, 1, 6))
+
+    def test_weeks_step_by_weeks(self):
+        sched = self.sched(1, 'WK', utc(2026, 1, 5))
+        self.assertEqual(
+            sched.next_after(utc(2026, 1, 20)), utc(2026, 1, 26))
+
+    def test_months_clamp_to_the_month_end(self):
+        sched = self.sched(1, 'MO', utc(2026, 1, 31))
+        self.assertEqual(
+            sched.next_after(utc(2026, 2, 15)), utc(2026, 2, 28))
+        self.assertEqual(
+            sched.next_after(utc(2026, 3, 5)), utc(2026, 3, 31))
+
+    def test_increment_writes_once(self):
+        sched = self.sched(1, 'DY', utc(2020, 1, 1))
+        with self.assertNumQueries(1):
+            sched.increment_nxt()
+        self.assertGreaterEqual(sched.next_itr, dtz.now())
+
+
+
+class SchedulerRefreshTests(StandInTestCase):
+
+    def test_refresh_keeps_edits_made_meanwhile(self):
+        datamap = build_datamap(self.api, 'edited')
+        sched = MapSched.objects.select_related('data_map').get(
+            pk=datamap.mapsched_set.create(frequency=1, freq_unit='DY').pk)
+        # an admin edits the map while the refresh runs
+        DataMap.objects.filter(pk=datamap.pk).update(
+            name='renamed', map_active=False, max_concurrency=1)
+        Scheduler().refresh(sched)
+        datamap.refresh_from_db()
+        self.assertEqual(datamap.name, 'renamed')
+        self.assertFalse(datamap.map_active)
+        self.assertEqual(datamap.max_concurrency, 1)
+        self.assertIsNotNone(datamap.last_refresh)
+
+
+class RollupDeltaTests(TestCase):
+
+    def setUp(self):
+        access = Forms_Access.objects.create(
+            name='forms', client_id='id', client_secret='secret')
+        self.form = Survey_Form.objects.create(
+            name='survey', form_id=1, access=access)
+        Account.objects.create(sfid='001-1', global_region_c='EUROPE')
+        Account.objects.create(sfid='001-2', global_region_c='USCAN')
+        for num in range(4):
+            ServiceOrder.objects.create(
+                sfid='a2B-%d' % num,
+                name='WO-%d' % num,
+                svmxc_company_c_id='001-%d' % (1 + num % 2),
+                svmxc_order_type_c='Field Service',
+                svmxc_completed_date_time_c=utc(2026, 1 + num, 10))
+
+    def survey(self, num, nps, wo_name=None, month=1):
+        return {
+            'forms_id': str(num),
+            'wo_name': wo_name or 'WO-%d' % (num % 4),
+            'last_update': utc(2026, month, 1 + num % 20),
+            'nps': nps,
+            'nss_eodb': num % 11,
+        }
+
+    def assertMatchesRebuild(self):
+        fields = [key for key, lookup in rollups.KEYS] + list(
+            rollups.COUNTERS)
+        fields[fields.index('technician_id')] = 'technician'
+        kept = sorted(map(str, NPSRollup.objects.values_list(*fields)))
+        rollups.rebuild()
+        built = sorted(map(str, NPSRollup.objects.values_list(*fields)))
+        self.assertEqual(kept, built)
+
+    def test_inserts_and_updates_follow_the_surveys(self):
+        self.form.upsert_recs(
+            [self.survey(num, num % 11) for num in range(12)])
+        self.assertMatchesRebuild()
+        later = [self.survey(num, 10 - num % 11, month=2)
+                 for num in range(0, 12, 3)]
+        self.form.upsert_recs(later)
+        self.assertMatchesRebuild()
+
+    def test_order_changes_move_surveys(self):
+        self.form.upsert_recs([self.survey(num, 9) for num in range(8)])
+        # what the ServiceOrder upsert hook does around its write
+        tracker = rollups.tracker(
+            Survey_Record.objects.filter(work_order_id='a2B-1'))
+        ServiceOrder.objects.filter(sfid='a2B-1').update(
+            svmxc_company_c_id='001-1', svmxc_order_type_c='Installation')
+        tracker()
+        self.assertMatchesRebuild()
+
+    def test_null_keys_share_one_bucket(self):
+        self.form.upsert_recs([self.survey(1, 9, wo_name='WO-none')])
+        self.form.upsert_recs([self.survey(2, 3, wo_name='WO-none')])
+        bucket = NPSRollup.objects.get(region__isnull=True)
+        self.assertEqual(bucket.responses, 2)
+        self.assertTrue(RollupState.objects.exists())
+        self.assertEqual(bucket.nps(), 0.0)
+        self.assertMatchesRebuild()
+
+    def test_late_orders_are_linked(self):
+        self.form.upsert_recs([self.survey(1, 9, wo_name='WO-late')])
+        ServiceOrder.objects.create(
+            sfid='a2B-9', name='WO-late', svmxc_company_c_id='001-2')
+        self.assertEqual(self.form.link_orders(), 1)
+        self.assertEqual(
+            Survey_Record.objects.get(forms_id='1').work_order_id, 'a2B-9')
+        self.assertMatchesRebuild()
+
+
+class FetcherTests(StandInTestCase):
+
+    def query_for(self, where):
+        return 'query?q=SELECT+Id+FROM+Account+WHERE+' + where
+
+    def test_ids_are_packed_up_to_the_url_limit(self):
+        ids = [self.fixtures.sfid('Account', idx) for idx in range(40)]
+        queries = pack_ids(self.query_for, ids, max_url=300)
+        self.assertGreater(len(queries), 1)
+        self.assertTrue(all(len(qs) <= 300 for qs in queries))
+        packed = ''.join(queries)
+        self.assertTrue(all(("'%s'" % sfid) in packed for sfid in ids))
+
+    def test_failed_batch_query_is_retried_alone(self):
+        class Flaky(StandInAdapter):
+            def batch(self, data):
+                rtn = StandInAdapter.batch(self, data)
+                rtn['results'][0] = {'statusCode': 503, 'result': None}
+                return rtn
+
+        self.mount(Flaky(self.fixtures, 50))
+        datamap = build_datamap(self.api, 'flaky')
+        ids = [self.fixtures.sfid('Account', idx) for idx in range(6)]
+        queries = pack_ids(self.query_for, ids, max_url=150)
+        self.assertGreater(len(queries), 1)
+        results = run_batch(datamap, queries)
+        self.assertEqual(len(results), len(queries))
+        self.assertEqual(
+            sorted(rec['Id'] for recs in results for rec in recs), ids)
+
+    def test_failed_retry_raises(self):
+        class Down(StandInAdapter):
+            def query(self, qtxt, size):
+                return 503, [{'errorCode': 'SERVER_UNAVAILABLE'}]
+
+        self.mount(Down(self.fixtures, 50))
+        datamap = build_datamap(self.api, 'down')
+        queries = [self.query_for("Id+in+('x')"), self.query_for("Id='y'")]
+        with self.assertRaises(QueryError):
+            run_batch(datamap, queries)
+
+
+class CollectionTests(StandInTestCase):
+
+    def order_ids(self, count):
+        return [self.fixtures.sfid('SVMXC__Service_Order__c', idx)
+                for idx in range(count)]
+
+    def test_get_many_maps_the_fields(self):
+        datamap = build_datamap(self.api, 'many')
+        order = datamap.mapobject_set.get(dj_class='ServiceOrder')
+        ids = self.order_ids(3)
+        recs = order.get_many(ids + ['a2B-missing'])
+        self.assertEqual(sorted(rec['Id'] for rec in recs), ids)
+        self.assertEqual(recs[0]['Name'], 'WO-00000000')
+
+    @mock.patch.object(fetcher, 'COLLECTION_SIZE', 10)
+    def test_composite_calls_stay_under_the_collection_limit(self):
+        datamap = build_datamap(self.api, 'composite')
+        # the in-memory test database takes one thread at a time
+        datamap.max_concurrency = 1
+        datamap.save()
+        order = datamap.mapobject_set.get(dj_class='ServiceOrder')
+        ids = self.order_ids(120)
+        before = self.adapter.calls
+        self.assertEqual(order.load_many(ids), 120)
+        self.assertEqual(ServiceOrder.objects.count(), 120)
+        self.assertGreaterEqual(self.adapter.calls - before, 3)
+
+    @mock.patch.object(fetcher, 'COLLECTION_SIZE', 10)
+    def test_failed_subrequest_raises(self):
+        class Failing(StandInAdapter):
+            def subrequest(self, path, data):
+                if self.fixtures.sfid('SVMXC__Service_Order__c', 20) in (
+                        data.get('ids') or []):
+                    return 500, [{'errorCode': 'UNKNOWN_EXCEPTION'}]
+                return StandInAdapter.subrequest(self, path, data)
+
+        self.mount(Failing(self.fixtures, 50))
+        datamap = build_datamap(self.api, 'failing')
+        order = datamap.mapobject_set.get(dj_class='ServiceOrder')
+        with self.assertRaises(QueryError) as ctx:
+            order.get_many(self.order_ids(40))
+        self.assertEqual(ctx.exception.status, 500)
+
+
+
+class FormsStandIn(StandInAdapter):
+    """Answers the forms token and records endpoints from a list"""
+
+    def __init__(self, records):
+        super(FormsStandIn, self).__init__(None)
+        self.records = records
+        self.tokens = []
+        self.pages = 0
+        self.on_page = None
+
+    def answer(self, request):
+        if request.url.endswith('token.oauth2'):
+            self.tokens.append('forms-%d' % len(self.tokens))
+            return self.respond(request, 200, {
+                'access_token': self.tokens[-1], 'expires_in': 7199})
+        auth = request.headers.get('Authorization', '')
+        if not(self.tokens) or auth != 'Bearer ' + self.tokens[-1]:
+            return self.respond(request, 401, [{'message': 'expired'}])
+        body = json.loads(request.body.decode('utf-8'))
+        recs = sorted(self.records,
+                      key=lambda rec: (rec['dt_updated'], rec['record_id']))
+        for cond in (body['filters'] or {}).get('and', []):
+            recs = [rec for rec in recs if self.matches(rec, cond)]
+        start = body['offset']
+        page = recs[start:start + body['limit']]
+        self.pages += 1
+        if self.on_page:
+            self.on_page(self)
+        return self.respond(request, 200, {'records': page})
+
+    def matches(self, rec, cond):
+        val = rec.get(str(cond['field_id']))
+        if cond['operator'] == 'eq':
+            return val == cond['value']
+        return val is not None and val > cond['value']
+
+
+class FormsTestCase(TestCase):
+
+    def setUp(self):
+        self.access = Forms_Access.objects.create(
+            name='forms', client_id='id', client_secret='secret')
+        self.form = Survey_Form.objects.create(
+            name='survey', form_id=1, access=self.access)
+        self.adapter = FormsStandIn([])
+        self.access.transport().session.mount('https://', self.adapter)
+
+    def tearDown(self):
+        SFTransport.drop(('forms', self.access.pk, 'id'))
+
+    def record(self, num, day=1, **fields):
+        rec = {'record_id': num,
+               'dt_updated': '2026-03-%02dT10:00:00Z' % day,
+               '1588082': 'WO-%d' % num}
+        rec.update(fields)
+        return rec
+
+    def read(self, limit):
+        return [rec['record_id'] for page in self.access.iter_records(
+            1, ['record_id', 'dt_updated'], limit=limit) for rec in page]
+
+
+class FormsRecordTests(FormsTestCase):
+
+    def test_rejected_token_logs_in_again(self):
+        self.adapter.records = [self.record(num) for num in range(5)]
+
+        def expire(adapter):
+            if adapter.pages == 1:
+                adapter.tokens.append('revoked')
+        self.adapter.on_page = expire
+        self.assertEqual(self.read(2), [0, 1, 2, 3, 4])
+        self.assertEqual(self.access.transport().logins, 2)
+        self.assertNotEqual(OAuthToken.objects.get(
+            key=self.access.token_key()).access_token, 'forms-0')
+
+    def test_updates_between_pages_lose_no_record(self):
+        recs = [self.record(num, day=1 + num) for num in range(9)]
+        self.adapter.records = recs
+
+        def update_first(adapter):
+            if adapter.pages == 1:
+                recs[0]['dt_updated'] = '2026-04-01T10:00:00Z'
+        self.adapter.on_page = update_first
+        read = self.read(3)
+        self.assertEqual(sorted(set(read)), list(range(9)))
+        self.assertEqual(read[-1], 0)
+
+    def test_records_tied_on_dt_updated_are_paged(self):
+        self.adapter.records = [self.record(num) for num in range(7)]
+        self.adapter.records.append(self.record(7, day=2))
+        self.assertEqual(self.read(3), list(range(8)))
+
+
+class FormsSyncTests(FormsTestCase):
+
+    def test_sync_moves_the_watermark(self):
+        self.adapter.records = [
+            self.record(num, day=1 + num, **{'1672513': num})
+            for num in range(5)]
+        self.assertEqual(self.form.sync(), (5, 0))
+        self.form.refresh_from_db()
+        self.assertEqual(self.form.sync_watermark, utc(2026, 3, 5, 10))
+        self.assertEqual(Survey_Record.objects.get(forms_id='3').nss_eodb, 3)
+        self.adapter.records[1].update(
+            {'dt_updated': '2026-03-06T10:00:00Z', '1672513': 9})
+        self.assertEqual(self.form.sync(), (0, 1))
+        self.form.refresh_from_db()
+        self.assertEqual(self.form.sync_watermark, utc(2026, 3, 6, 10))
+        self.assertEqual(Survey_Record.objects.get(forms_id='1').nss_eodb, 9)
+
+    def test_delta_asks_only_past_the_watermark(self):
+        self.form.sync_watermark = utc(2026, 3, 3, 10)
+        self.form.save()
+        self.adapter.records = [
+            self.record(num, day=1 + num) for num in range(5)]
+        self.assertEqual(self.form.sync(), (3, 0))
+        self.assertEqual(self.form.sync(full=True), (2, 0))
+
+
+class MetricsViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        access = Forms_Access.objects.create(
+            name='forms', client_id='id', client_secret='secret')
+        self.form = Survey_Form.objects.create(
+            name='survey', form_id=1, access=access,
+            last_refresh=utc(2026, 3, 1))
+        for num, nps in enumerate((10, 9, 2)):
+            Survey_Record.objects.create(
+                survey_form=self.form, forms_id=str(num), wo_name='WO',
+                last_update=utc(2026, 2, 1), nps=nps)
+
+    def get(self, etag=None, **params):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return views.metrics(RequestFactory().get(
+            '/metrics/', params, **headers))
+
+    def responses(self, resp):
+        return json.loads(resp.content.decode('utf-8'))['rows'][0][
+            'responses']
+
+    def test_unchanged_data_revalidates(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        again = self.get(etag=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+        other = self.get(etag=first['ETag'], region='EUROPE')
+        self.assertEqual(other.status_code, 200)
+
+    def test_body_is_cached_until_the_next_sync(self):
+        first = self.get()
+        self.assertEqual(self.responses(first), 0)
+        NPSRollup.objects.create(responses=5)
+        self.assertEqual(self.responses(self.get()), 0)
+        self.form.last_refresh = utc(2026, 3, 2)
+        self.form.save()
+        resp = self.get()
+        self.assertNotEqual(resp['ETag'], first['ETag'])
+        self.assertEqual(self.responses(resp), 5)
+
+    def test_rebuild_replaces_the_cached_body(self):
+        first = self.get()
+        self.assertEqual(self.responses(first), 0)
+        rollups.rebuild()
+        resp = self.get(etag=first['ETag'])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.responses(resp), 3)
+
+    def test_bad_months_are_refused(self):
+        for month in ('2026-13', '2026-00', '26-01'):
+            resp = self.get(start=month)
+            self.assertEqual(resp.status_code, 400)
+        self.assertEqual(self.get(start='2026-02').status_code, 200)
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        access = Forms_Access.objects.create(
+            name='forms', client_id='id', client_secret='secret')
+        form = Survey_Form.objects.create(
+            name='survey', form_id=1, access=access)
+        Account.objects.create(sfid='001-1', global_region_c='EUROPE')
+        for num in range(5):
+            order = ServiceOrder.objects.create(
+                sfid='a2B-%d' % num, name='WO-%d' % num,
+                svmxc_company_c_id='001-1',
+                svmxc_completed_date_time_c=utc(2026, 1, 10 + num, 12))
+            # orders 1 and 3 have two surveys, order 4 none
+            for idx in range(num % 2 + 1 if num < 4 else 0):
+                Survey_Record.objects.create(
+                    survey_form=form, work_order=order,
+                    forms_id='%d-%d' % (num, idx), wo_name=order.name)
+        self.user = User.objects.create_user('export')
+
+    def lines(self, chunk_size, fltrs=None, surveyed=False):
+        qs = export.export_qs(fltrs, surveyed)
+        return list(export.iter_csv(qs, chunk_size))
+
+    def test_pages_keep_every_row_once(self):
+        whole = self.lines(100)
+        self.assertEqual(len(whole), 1 + 7)
+        self.assertEqual(self.lines(1), whole)
+        self.assertEqual(self.lines(2), whole)
+        surveyed = self.lines(2, surveyed=True)
+        self.assertEqual(len(surveyed), 1 + 6)
+        self.assertNotIn('a2B-4', ''.join(surveyed))
+
+    def request(self, **params):
+        req = RequestFactory().get('/export.csv', params)
+        req.user = self.user
+        return req
+
+    def test_view_needs_the_survey_permission(self):
+        with self.assertRaises(PermissionDenied):
+            views.export_csv(self.request())
+        self.user.user_permissions.add(
+            Permission.objects.get(codename='view_survey_record'))
+        self.user = User.objects.get(pk=self.user.pk)
+        resp = views.export_csv(self.request(start='2026-01-12'))
+        body = b''.join(resp.streaming_content).decode('utf-8')
+        self.assertEqual(len(body.splitlines()), 1 + 4)
+
+    def test_impossible_dates_are_refused(self):
+        self.user.is_superuser = True
+        resp = views.export_csv(self.request(start='2017-02-30'))
+        self.assertEqual(resp.status_code, 400)
+        with self.assertRaises(CommandError):
+            call_command('exportcsv', start='2017-02-30')
+
+
+@unittest.skipUnless(snapshot.np and snapshot.fcntl, 'needs numpy')
+class SnapshotTests(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        settings = override_settings(NPS_SNAPSHOT_DIR=self.root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # every row here was written within the overlap
+        overlap = mock.patch.object(
+            snapshot, 'OVERLAP', datetime.timedelta(0))
+        overlap.start()
+        self.addCleanup(overlap.stop)
+        access = Forms_Access.objects.create(
+            name='forms', client_id='id', client_secret='secret')
+        self.form = Survey_Form.objects.create(
+            name='survey', form_id=1, access=access)
+        Account.objects.create(sfid='001-1', global_region_c='EUROPE')
+        Account.objects.create(sfid='001-2', global_region_c='USCAN')
+        for num in range(6):
+            ServiceOrder.objects.create(
+                sfid='a2B-%d' % num, name='WO-%d' % num,
+                svmxc_company_c_id='001-%d' % (1 + num % 2),
+                svmxc_completed_date_time_c=utc(2026, 1 + num % 3, 10),
+                systemmodstamp=utc(2026, 1, 1))
+        self.form.upsert_recs([self.survey(num, num) for num in range(11)])
+
+    def survey(self, num, nps, wo_name=None):
+        return {'forms_id': str(num),
+                'wo_name': wo_name or 'WO-%d' % (num % 6),
+                'last_update': utc(2026, 1, 1 + num), 'nps': nps}
+
+    def by_region(self):
+        return dict((row['region'], (row['responses'], row['nps']))
+                    for row in snapshot.Snapshot().nps_by('region'))
+
+    def test_chunked_build_matches_the_database(self):
+        self.assertEqual(snapshot.update(chunk_size=4),
+                         {'orders': 6, 'surveys': 11})
+        regions = self.by_region()
+        self.assertEqual(regions['EUROPE'][0], 6)
+        self.assertEqual(regions['USCAN'][0], 5)
+        view = snapshot.Snapshot()
+        self.assertEqual(
+            sorted(view.column('surveys', 'pk')),
+            sorted(Survey_Record.objects.values_list('pk', flat=True)))
+
+    def test_update_appends_only_changed_rows(self):
+        snapshot.update()
+        first = snapshot.read_manifest(self.root)
+        self.form.upsert_recs([dict(self.survey(3, 10), last_update=utc(
+            2026, 2, 1))])
+        self.assertEqual(snapshot.update(), {'orders': 0, 'surveys': 1})
+        manifest = snapshot.read_manifest(self.root)
+        segments = manifest['tables']['surveys']['segments']
+        self.assertEqual(segments[0], first['tables']['surveys'][
+            'segments'][0])
+        self.assertEqual(segments[1][1], 1)
+        self.assertEqual(manifest['tables']['surveys']['rows'], 11)
+        view = snapshot.Snapshot()
+        nps = dict(zip(view.column('surveys', 'pk'),
+                       view.column('surveys', 'nps')))
+        rec = Survey_Record.objects.get(forms_id='3')
+        self.assertEqual(nps[rec.pk], 10)
+        self.assertEqual(len(view.column('surveys', 'pk')), 11)
+
+    def test_linked_surveys_reach_the_snapshot(self):
+        self.form.upsert_recs([self.survey(20, 9, wo_name='WO-late')])
+        snapshot.update()
+        ServiceOrder.objects.create(
+            sfid='a2B-9', name='WO-late', svmxc_company_c_id='001-2')
+        self.assertEqual(self.form.link_orders(), 1)
+        self.assertEqual(snapshot.update(), {'orders': 1, 'surveys': 1})
+        view = snapshot.Snapshot()
+        self.assertNotIn(snapshot.NULL, view.survey_orders())
+        self.assertEqual(self.by_region()['USCAN'][0], 6)
+
+    @mock.patch.object(snapshot, 'MAX_SEGMENTS', 2)
+    def test_segments_are_compacted(self):
+        snapshot.update()
+        for num in range(4):
+            self.form.upsert_recs([dict(
+                self.survey(num, 0), last_update=utc(2026, 3, 1))])
+            snapshot.update()
+        manifest = snapshot.read_manifest(self.root)
+        self.assertLessEqual(len(manifest['tables']['surveys']['segments']),
+                             2)
+        view = snapshot.Snapshot()
+        self.assertEqual(len(view.column('surveys', 'pk')), 11)
+        self.assertEqual(
+            sorted(view.column('surveys', 'nps')),
+            sorted(Survey_Record.objects.values_list('nps', flat=True)))
+
+    def test_leftovers_of_a_failed_update_are_removed(self):
+        snapshot.update()
+        os.makedirs(os.path.join(self.root, 'v1'))
+        os.makedirs(snapshot.segment_path(self.root, 'orders', 'v1-0000'))
+        snapshot.update(full=True)
+        snapshot.update()
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'v1')))
+        manifest = snapshot.read_manifest(self.root)
+        kept = sorted(
+            seg for seg, size in manifest['tables']['orders']['segments'])
+        self.assertEqual(sorted(os.listdir(
+            os.path.join(self.root, 'segments', 'orders'))), kept)
+        self.assertEqual(len(os.listdir(self.root)), 5)
+
+    def test_updates_take_turns(self):
+        with snapshot.update_lock(self.root):
+            with open(os.path.join(self.root, 'update.lock')) as other:
+                with self.assertRaises(BlockingIOError):
+                    snapshot.fcntl.flock(
+                        other, snapshot.fcntl.LOCK_EX | snapshot.fcntl.LOCK_NB)
@@ -0,0 +1,108 @@
+"""Pooled keep-alive HTTP transport for the Salesforce REST API"""
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+API_VERSION = 'v37.0'
+POOL_SIZE = 25
+
+
+class QueryError(Exception):
+    """raised when Salesforce answers a query with an error body"""
+
+    def __init__(self, status, body):
+        Exception.__init__(self, '%s: %s' % (status, body))
+        self.status = status
+        self.body = body
+
+
+class SFTransport(object):
+    """Keep-alive session, token state and counters for one credential"""
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, proxd=None, pool_size=POOL_SIZE):
+        self.session = requests.Session()
+        # proxies are resolved once here instead of from the environment
+        # on every request
+        self.session.trust_env = False
+        self.session.verify = os.environ.get('REQUESTS_CA_BUNDLE', True)
+        if proxd:
+            self.session.proxies.update(proxd)
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.conn = None
+        self.conn_expires = None
+        self.lock = threading.RLock()
+        self.requests = 0
+        self.logins = 0
+        self.bytes = 0
+        self.local = threading.local()
+
+    @classmethod
+    def for_key(cls, key, proxd=None):
+        """gets the shared transport for a credential key"""
+        with cls._registry_lock:
+            if key not in cls._registry:
+                cls._registry[key] = cls(proxd)
+            return cls._registry[key]
+
+    @classmethod
+    def drop(cls, key):
+        """discards the shared transport for a credential key"""
+        with cls._registry_lock:
+            trn = cls._registry.pop(key, None)
+        if trn is not None:
+            trn.session.close()
+
+    def request(self, method, url, **kwargs):
+        """sends a request through the pooled session"""
+        resp = self.session.request(method, url, **kwargs)
+        with self.lock:
+            self.requests += 1
+        if not kwargs.get('stream'):
+            self.add_bytes(len(resp.content))
+        return resp
+
+    def add_bytes(self, count):
+        """counts bytes received, in total and for the calling thread"""
+        with self.lock:
+            self.bytes += count
+        self.local.bytes = self.thread_bytes() + count
+
+    def thread_bytes(self):
+        """bytes received so far by the calling thread"""
+        return getattr(self.local, 'bytes', 0)
+
+    def handshakes(self):
+        """number of connections opened by the pools of this session"""
+        total = 0
+        for adapter in set(self.session.adapters.values()):
+            if not(hasattr(adapter, 'poolmanager')):
+                continue
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    total += pool.num_connections
+        return total
+
+    def stats(self):
+        """counters for requests, logins, handshakes and bytes received"""
+        return {
+            'requests': self.requests,
+            'logins': self.logins,
+            'handshakes': self.handshakes(),
+            'bytes': self.bytes,
+        }
+
+
+def stats_delta(before, after):
+    """difference between two stats() snapshots"""
+    return dict((key, after[key] - before.get(key, 0)) for key in after)
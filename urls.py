@@ -6,4 +6,6 @@ from . import views
 app_name = 'nps'
 urlpatterns = [
     url(r'^$', views.index, name='index'),
+    url(r'^metrics/$', views.metrics, name='metrics'),
+    url(r'^export\.csv$', views.export_csv, name='export_csv'),
 ]
\ No newline at end of file
@@ -1,7 +1,160 @@
+import re
+import hashlib
+import datetime
+from django.contrib.auth.decorators import permission_required
+from django.core.cache import cache
+from django.db.models import Max
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_GET
+from .models import DataMap, Survey_Form
+from . import rollups, export
 
 
+METRICS_CACHE_SECONDS = 24 * 60 * 60
+GROUPS = {
+    'region': 'region',
+    'subregion': 'subregion',
+    'technician': 'technician_id',
+    'order_type': 'order_type',
+    'month': 'month',
+}
+
 
 def index(request):
     context = {}
     return render(request, 'nps/index.html', context)
+
+
+def data_version():
+    """time of the last sync or rebuild that could have changed the rollups"""
+    stamps = [
+        DataMap.objects.filter(
+            mapobject__dj_class='ServiceOrder').aggregate(
+                stamp=Max('last_refresh'))['stamp'],
+        Survey_Form.objects.aggregate(stamp=Max('last_refresh'))['stamp'],
+        rollups.rebuilt(),
+    ]
+    stamps = [stamp for stamp in stamps if stamp is not None]
+    return max(stamps) if stamps else None
+
+
+def date_param(name, text):
+    """date a YYYY-MM-DD parameter names"""
+    match = re.match(r'^(\d{4})-(\d{2})-(\d{2})$', text)
+    if match:
+        try:
+            return datetime.date(*[int(part) for part in match.groups()])
+        except ValueError:
+            pass
+    raise ValueError('%s must be a date like 2017-01-31' % name)
+
+
+def export_filters(params):
+    """ServiceOrder filters asked for by an export query string"""
+    fltrs = {}
+    if params.get('region'):
+        fltrs['svmxc_company_c__global_region_c'] = params['region']
+    if params.get('order_type'):
+        fltrs['svmxc_order_type_c'] = params['order_type']
+    for name, lookup in (('start', 'gte'), ('end', 'lt')):
+        if params.get(name):
+            fltrs['svmxc_completed_date_time_c__date__' + lookup] = (
+                date_param(name, params[name]))
+    return fltrs
+
+
+def month_param(name, text):
+    """first day of the month a YYYY-MM parameter names"""
+    match = re.match(r'^(\d{4})-(\d{2})$', text)
+    if match:
+        try:
+            return datetime.date(int(match.group(1)), int(match.group(2)), 1)
+        except ValueError:
+            pass
+    raise ValueError('%s must be a month like 2017-01' % name)
+
+
+def metrics_query(params):
+    """rollup filters and grouping asked for by the query string"""
+    fltrs = {}
+    for name in ('region', 'subregion', 'technician', 'order_type'):
+        if params.get(name):
+            fltrs[GROUPS[name]] = params[name]
+    for name, lookup in (('start', 'month__gte'), ('end', 'month__lte')):
+        if params.get(name):
+            fltrs[lookup] = month_param(name, params[name])
+    group_by = []
+    for name in params.get('group_by', '').split(','):
+        if not(name):
+            continue
+        if not(name in GROUPS):
+            raise ValueError('cannot group by %s' % name)
+        group_by.append(GROUPS[name])
+    return fltrs, group_by
+
+
+@require_GET
+def metrics(request):
+    """NPS and NSS scores from the rollups, cached until the next sync
+
+    Query parameters region, subregion, technician and order_type
+    filter, start and end (YYYY-MM) bound the month and group_by is a
+    comma separated list of region, subregion, technician, order_type
+    and month.
+    """
+    params = dict(
+        (key, request.GET.get(key, '')) for key in sorted(request.GET))
+    version = data_version()
+    stamp = version.isoformat() if version else ''
+    ident = stamp + '?' + '&'.join(
+        '%s=%s' % (key, val) for key, val in params.items())
+    etag = quote_etag(hashlib.md5(ident.encode('utf-8')).hexdigest())
+    modified = int(version.timestamp()) if version else None
+    resp = get_conditional_response(
+        request, etag=etag, last_modified=modified)
+    if resp is None:
+        key = 'nps:metrics:' + etag.strip('"')
+        body = cache.get(key)
+        if body is None:
+            try:
+                fltrs, group_by = metrics_query(params)
+            except ValueError as exc:
+                return JsonResponse({'error': str(exc)}, status=400)
+            data = {
+                'updated': version,
+                'filters': params,
+                'rows': rollups.summarize(fltrs, group_by),
+            }
+            body = JsonResponse(data).content
+            cache.set(key, body, METRICS_CACHE_SECONDS)
+        resp = HttpResponse(body, content_type='application/json')
+    resp['ETag'] = etag
+    if modified is not None:
+        resp['Last-Modified'] = http_date(modified)
+    # clients may keep the body but must revalidate it on every poll
+    patch_cache_control(resp, no_cache=True)
+    return resp
+
+
+@require_GET
+@permission_required('nps.view_survey_record', raise_exception=True)
+def export_csv(request):
+    """work orders joined with surveys as a streamed CSV download
+
+    Takes region, order_type, start and end (completion dates) and
+    surveyed=1 to leave out orders without a survey. The rows carry
+    customer comments and contact requests, so only users who may view
+    survey records get them.
+    """
+    try:
+        fltrs = export_filters(request.GET)
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    qs = export.export_qs(fltrs, request.GET.get('surveyed') == '1')
+    resp = StreamingHttpResponse(
+        export.iter_csv(qs), content_type='text/csv; charset=utf-8')
+    resp['Content-Disposition'] = 'attachment; filename="nps_export.csv"'
+    return resp
@@ -0,0 +1,99 @@
+"""Bounded thread pools for concurrent Salesforce API calls
+
+Worker threads only talk to the API. Rows are written by the calling
+thread, so the database sees a single writer per sync.
+"""
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connections
+
+
+def closing_db(func):
+    """runs func and releases the thread's database connections"""
+    def wrapped(*args):
+        try:
+            return func(*args)
+        finally:
+            connections.close_all()
+    return wrapped
+
+
+def parallel_map(func, items, workers):
+    """applies func to items on at most workers threads, keeping order"""
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        return list(pool.map(closing_db(func), items))
+
+
+_DONE = object()
+PUT_TIMEOUT = 0.5
+
+
+def merge_streams(streams, workers):
+    """drains iterators on threads, yielding (key, item, done) as they arrive
+
+    streams is a list of (key, iterator) pairs. At most workers
+    iterators run at once. A final (key, None, True) marks the end of
+    each stream, and an exception raised by a stream is re-raised here.
+    When the consumer stops early or a stream fails, the threads stop
+    after their current item instead of waiting on a full queue.
+    """
+    streams = list(streams)
+    if workers <= 1 or len(streams) <= 1:
+        for key, items in streams:
+            for item in items:
+                yield key, item, False
+            yield key, None, True
+        return
+    workers = min(workers, len(streams))
+    out = queue.Queue(maxsize=workers * 2)
+    todo = queue.Queue()
+    stop = threading.Event()
+    for stream in streams:
+        todo.put(stream)
+
+    def put(entry):
+        """queues entry unless the consumer has gone, returning if it did"""
+        while not(stop.is_set()):
+            try:
+                out.put(entry, timeout=PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def pump():
+        while not(stop.is_set()):
+            try:
+                key, items = todo.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                for item in items:
+                    if not(put((key, item, None))):
+                        return
+                put((key, _DONE, None))
+            except Exception as exc:
+                put((key, _DONE, exc))
+
+    threads = [
+        threading.Thread(target=closing_db(pump), daemon=True)
+        for i in range(workers)]
+    for thr in threads:
+        thr.start()
+    try:
+        left = len(streams)
+        while left:
+            key, item, exc = out.get()
+            if exc is not None:
+                raise exc
+            if item is _DONE:
+                left -= 1
+                yield key, None, True
+            else:
+                yield key, item, False
+    finally:
+        stop.set()